@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+#
+# Bulk persistence of BeerXMLNodes.
+#
+# BeerXMLNode.get_or_create() saves one node at a time, issuing
+# a get_or_create per related node, a save per foreign key and an
+# add per many-to-many relation. bulk_get_or_create() saves any
+# number of nodes with a fixed number of queries per model: one
+# to find existing rows by their content fingerprint, one bulk
+# insert of the new rows and one to read back their primary keys,
+# followed by a lookup and a bulk insert per many-to-many table,
+# a refresh of the stats of the saved recipes and an update of the
+# search index. Everything runs in one transaction.
+
+from django.db import transaction
+from django.db.models.fields.related import ManyToOneRel, ManyToManyRel
+
+from brewery.models import Recipe, Style, normalize
+from brewery.beerxml.calculations import update_stats
+from brewery.beerxml.styles import clear_style_index
+from brewery.beerxml.search import SEARCH_FIELDS, update_objects
+from brewery.beerxml.error import BeerXMLError
+from brewery.beerxml.nodes import BeerXMLNode, get_relation_fields
+
+# Number of values in each "IN (...)" lookup. Keeps
+# us below the limit of 999 variables in SQLite.
+LOOKUP_BATCH_SIZE = 500
+
+def _chunks(items, size=LOOKUP_BATCH_SIZE):
+    items = list(items)
+    for i in xrange(0, len(items), size):
+        yield items[i:i + size]
+
+class _Entry(object):
+    """
+    A node waiting to be saved, along with the
+    unsaved model instance built from it.
+    """
+    __slots__ = ("node", "instance", "key", "obj", "created")
+
+    def __init__(self, node, instance):
+        self.node = node
+        self.instance = instance
+        self.key = None
+        self.obj = None
+        self.created = False
+
+
+class BulkPersister(object):
+    """
+    Saves a set of BeerXMLNodes, and all nodes related to
+    them, with a fixed number of queries per model.
+    """
+
+    def __init__(self, inherit=None):
+        self.inherit = inherit or {}
+        self.entries = {}       # id(node) -> _Entry
+        self.models = {}        # model -> [_Entry]
+
+    def collect(self, node):
+        """
+        Build unsaved instances for node and all
+        related nodes, grouped by model.
+        """
+        assert isinstance(node, BeerXMLNode), \
+            "%s must be a BeerXMLNode instance." % node
+        if id(node) in self.entries:
+            return self.entries[id(node)]
+
+        model = node._model
+        relations = get_relation_fields(model, ManyToOneRel) \
+                  | get_relation_fields(model, ManyToManyRel)
+        lookup = dict([(k, v) for k, v in node.iteritems() if not "__" in k
+                       and not k in relations])
+        lookup.update(self.inherit)
+        try:
+            instance = model(**lookup)
+        except Exception, e:
+            raise BeerXMLError(e)
+
+        entry = _Entry(node, instance)
+        self.entries[id(node)] = entry
+        self.models.setdefault(model, []).append(entry)
+
+        for m2one in node.many_to_one:
+            for field_name, n in m2one.iteritems():
+                if n is not None:
+                    self.collect(n)
+        for m2m in node.many_to_many:
+            for field_name, n_list in m2m.iteritems():
+                for n in n_list:
+                    self.collect(n)
+        return entry
+
+    def model_order(self):
+        """
+        Return the collected models ordered so that models are
+        saved after the models they have foreign keys to, and the
+        models of their FINGERPRINT_RELATIONS.
+        """
+        def depth(model):
+            targets = [f.rel.to for f in model._meta.fields
+                       if isinstance(f.rel, ManyToOneRel)]
+            targets += [model._meta.get_field(name).rel.to
+                        for name in model.FINGERPRINT_RELATIONS]
+            targets = [t for t in targets if t in self.models and t is not model]
+            return 1 + max(map(depth, targets)) if targets else 0
+        return sorted(self.models, key=depth)
+
+    def related_fingerprints(self, entry):
+        """
+        Return the fingerprints of the objects in each of the
+        FINGERPRINT_RELATIONS of entry, which are saved already,
+        but not the relations themselves. Objects which are in a
+        relation more than once only get one row, and count once.
+        """
+        related = {}
+        for name in entry.instance.FINGERPRINT_RELATIONS:
+            objects = []
+            for n in entry.node.get(name) or []:
+                obj = self.entries[id(n)].obj
+                if not obj in objects:
+                    objects.append(obj)
+            related[name] = [obj.fingerprint for obj in objects]
+        return related
+
+    def find_existing(self, model, keys):
+        """
+        Fetch the rows of model matching keys, which are (owner pk,
+        fingerprint) tuples. Returns a dict mapping keys to rows.
+        """
+        owners = {}
+        for owner, fingerprint in keys:
+            owners.setdefault(owner, []).append(fingerprint)
+        
+        found = {}
+        for owner, fingerprints in owners.iteritems():
+            for chunk in _chunks(fingerprints):
+                qs = model.objects.filter(registered_by=owner, fingerprint__in=chunk)
+                for obj in qs.order_by("-pk"):
+                    found[(owner, obj.fingerprint)] = obj
+        return found
+
+    def save_model(self, model):
+        """
+        Save all collected instances of model, reusing
+        identical rows which already exists.
+        """
+        entries = self.models[model]
+
+        # Point foreign keys to the already saved related objects
+        fk_fields = [f for f in model._meta.fields if isinstance(f.rel, ManyToOneRel)]
+        # bulk_create() calls no save(), so the values
+        # are normalized here, all at once.
+        normalize([entry.instance for entry in entries])
+        # Keys in the order the nodes were collected, so
+        # new rows are inserted in document order
+        keys, instances = [], {}
+        for entry in entries:
+            for field in fk_fields:
+                related = entry.node.get(field.name)
+                if isinstance(related, BeerXMLNode):
+                    setattr(entry.instance, field.name, self.entries[id(related)].obj)
+            entry.instance.fingerprint = entry.instance.get_fingerprint(
+                self.related_fingerprints(entry))
+            entry.key = (entry.instance.registered_by_id, entry.instance.fingerprint)
+            if not entry.key in instances:
+                instances[entry.key] = entry.instance
+                keys.append(entry.key)
+
+        found = self.find_existing(model, keys)
+        missing = [k for k in keys if not k in found]
+        if missing:
+            model.objects.bulk_create([instances[k] for k in missing])
+            created = self.find_existing(model, missing)
+            if len(created) != len(missing):
+                raise BeerXMLError("Could not read back saved %s objects" % model.__name__)
+            found.update(created)
+
+        missing = set(missing)
+        updates = {}
+        for entry in entries:
+            entry.obj = found[entry.key]
+            entry.created = entry.key in missing
+            if entry.created:
+                continue
+            # Existing rows get their foreign keys updated,
+            # just like BeerXMLNode.get_or_create() does.
+            for field in fk_fields:
+                related = entry.node.get(field.name)
+                if not isinstance(related, BeerXMLNode):
+                    continue
+                value = getattr(entry.instance, field.attname)
+                if getattr(entry.obj, field.attname) != value:
+                    setattr(entry.obj, field.attname, value)
+                    updates.setdefault((field.attname, value), set()).add(entry.obj.pk)
+        for (attname, value), pks in updates.iteritems():
+            for chunk in _chunks(pks):
+                model.objects.filter(pk__in=chunk).update(**{attname: value})
+
+    def save_many_to_many(self):
+        """
+        Insert the many-to-many rows between the saved objects,
+        which are not already there, in document order. The order
+        of mash steps is the order of their rows.
+        """
+        rows = {}   # field -> [(source pk, target pk)], without duplicates
+        seen = set()
+        for model, entries in self.models.iteritems():
+            for entry in entries:
+                for m2m in entry.node.many_to_many:
+                    for field_name, n_list in m2m.iteritems():
+                        field = model._meta.get_field(field_name)
+                        pairs = rows.setdefault(field, [])
+                        for n in n_list:
+                            pair = (entry.obj.pk, self.entries[id(n)].obj.pk)
+                            if not (field, pair) in seen:
+                                seen.add((field, pair))
+                                pairs.append(pair)
+
+        for field, pairs in rows.iteritems():
+            if not pairs:
+                continue
+            through = field.rel.through
+            source = through._meta.get_field(field.m2m_field_name()).attname
+            target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+
+            existing = set()
+            for chunk in _chunks(set([s for s, t in pairs])):
+                existing.update(through.objects.filter(**{"%s__in" % source: chunk})
+                                .values_list(source, target))
+            through.objects.bulk_create([through(**{source: s, target: t})
+                                         for s, t in pairs if not (s, t) in existing])
+
+    def save_stats(self):
+        """
+        Refresh the stats of the saved recipes. Bulk inserts
+        send no signals, so this is not done for us.
+        """
+        pks = [entry.obj.pk for entry in self.models.get(Recipe, [])]
+        for chunk in _chunks(pks):
+            update_stats(Recipe.objects.filter(pk__in=chunk))
+
+    def save_search_index(self):
+        """
+        Add the created styles and recipes to the search index.
+        """
+        for model in SEARCH_FIELDS:
+            update_objects(model, [entry.obj for entry in self.models.get(model, [])
+                                   if entry.created])
+
+    def save(self):
+        for model in self.model_order():
+            self.save_model(model)
+        self.save_many_to_many()
+        self.save_stats()
+        self.save_search_index()
+        # Same goes for the style index
+        if [entry for entry in self.models.get(Style, []) if entry.created]:
+            clear_style_index()
+
+
+def bulk_get_or_create(nodes, **kwargs):
+    """
+    Save a list of nodes, and all nodes related to them, to
+    the database in one transaction. Identical rows which already
+    exist are reused, like BeerXMLNode.get_or_create() does.
+
+    kwargs take the same special dictionary 'inherit' as
+    BeerXMLNode.get_or_create(), to set the same attributes on
+    all nodes. Returns a list of (object, created) tuples, one
+    for each node in nodes.
+    """
+    persister = BulkPersister(kwargs.pop("inherit", {}))
+    try:
+        with transaction.commit_on_success():
+            entries = [persister.collect(node) for node in nodes]
+            persister.save()
+    except BeerXMLError:
+        raise
+    except Exception, e:
+        raise BeerXMLError(e)
+    return [(entry.obj, entry.created) for entry in entries]
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+#
+# Estimates of original and final gravity, color, bitterness
+# and alcohol of recipes, calculated from their ingredients with
+# the formulas selected in the recipe options.
+#
+# Each fermentable is reduced to its contribution of gravity
+# points and malt color units per liter of batch, which only
+# depends on the fermentable itself (and the efficiency for
+# mashed grains). A recipe is then evaluated from a plain tuple
+# of its own values, its fermentable contributions, its hops and
+# the attenuation of its yeasts. calculate() loads these for one
+# recipe with a fixed number of queries, while calculate_many()
+# reads them for a whole queryset with values_list(), a chunk of
+# recipes at a time, without building any model instances.
+
+from decimal import Decimal
+
+from django.db import transaction
+
+from brewery.models import Recipe, RecipeOption, RecipeStats
+from brewery.beerxml.formulas import bitterness, color, gravity
+from brewery.beerxml.formulas import weight, volume
+from brewery.beerxml.queries import CHUNK_SIZE, ingredient_rows, to_float
+
+KG_TO_LB = weight.UNITS.factor("kg", "lb")[0]
+L_TO_GAL = volume.UNITS.factor("l", "gal")[0]
+
+# Gravity points per pound per gallon of sucrose, which
+# the fermentable yield percentages are relative to.
+SUCROSE_PPG = 46.21
+
+# Fermentable types which are mashed, and so are
+# subject to the brewhouse efficiency.
+MASHED = ("grain", "adjunct")
+
+# Hop uses which add bitterness
+BITTERING = ("boil", "first wort", "aroma")
+
+DEFAULT_EFFICIENCY = 75.0
+DEFAULT_ATTENUATION = 75.0
+
+# Defaults for recipes without options, as in RecipeOption
+DEFAULT_COLOR_FORMULA = 2
+DEFAULT_IBU_FORMULA = 0
+IBU_METHODS = {u"tinseth": 0, u"rager": 1, u"garetz": 2}
+
+COLOR_FORMULAS = {
+    0: color.mosher,
+    1: color.daniels,
+    2: color.morey,
+}
+
+def fermentable_contribution(amount, ferm_yield, lovibond, ferm_type, efficiency):
+    """
+    Return the (gravity points, malt color units) a fermentable
+    adds to one liter of batch. amount is in kilograms and
+    efficiency is the brewhouse efficiency percentage.
+    """
+    pounds = to_float(amount) * KG_TO_LB
+    points = SUCROSE_PPG * to_float(ferm_yield) / 100 * pounds / L_TO_GAL
+    if ferm_type in MASHED:
+        points *= to_float(efficiency, DEFAULT_EFFICIENCY) / 100
+    return points, to_float(lovibond) * pounds / L_TO_GAL
+
+def ibu(hops, ibu_formula, batch_size, boil_size, og):
+    """
+    Return the IBUs of hops, a list of (alpha percentage, amount in
+    kilograms, time in minutes, use) tuples, using Tinseth's (0),
+    Rager's (1) or Garetz' (2) formula.
+    """
+    hops = [(to_float(alpha), to_float(amount) * 1000, to_float(time))
+            for alpha, amount, time, use in hops if use in BITTERING]
+    if not hops or not batch_size:
+        return 0.0
+    concentration = batch_size / (boil_size or batch_size)
+    boil_gravity = 1 + (og - 1) * concentration
+
+    if ibu_formula == 1:
+        rager = bitterness.Rager()
+        adjustment = rager.gravity_adjustment(boil_gravity)
+        return sum(rager.ibu(grams, rager.utilization_percentage(time) / 100,
+                             alpha / 100, batch_size, adjustment)
+                   for alpha, grams, time in hops)
+
+    if ibu_formula == 2:
+        garetz = bitterness.Garetz()
+        gravity_factor = garetz.gravity_factor(boil_gravity)
+        temperature_factor = garetz.temperature_factor(0)
+        # The hopping rate factor depends on the IBUs we are
+        # calculating, which converges in a few iterations.
+        result = 0.0
+        for i in xrange(4):
+            adjustments = garetz.combined_adjustments(gravity_factor,
+                garetz.hopping_rate_factor(concentration, result), temperature_factor)
+            result = sum(garetz.ibu(grams, garetz.utilization_percentage(time),
+                                    alpha, batch_size, adjustments)
+                         for alpha, grams, time in hops)
+        return result
+
+    tinseth = bitterness.Tinseth()
+    bigness = tinseth.bigness_factor(boil_gravity)
+    return sum(tinseth.ibu(tinseth.alpha_acid_utilization(bigness,
+                               tinseth.boil_time_factor(time)),
+                           tinseth.mg_alpha_acids(alpha / 100, grams, batch_size))
+               for alpha, grams, time in hops)
+
+def evaluate(recipe, fermentables, hops, attenuations):
+    """
+    Evaluate a recipe. recipe is a (batch size, boil size, color
+    formula, ibu formula, hop utilization) tuple, fermentables a list
+    of (gravity points, malt color units) contributions, hops a list
+    of (alpha, amount, time, use) tuples and attenuations a list of
+    yeast attenuation percentages. Returns a dict of og, fg, color
+    (in SRM), ibu and abv.
+    """
+    batch_size, boil_size, color_formula, ibu_formula, hop_utilization = recipe
+    batch_size, boil_size = to_float(batch_size), to_float(boil_size)
+    if batch_size:
+        points = sum(p for p, c in fermentables) / batch_size
+        mcu = sum(c for p, c in fermentables) / batch_size
+    else:
+        points = mcu = 0.0
+    og = 1 + points / 1000
+
+    attenuations = [a for a in attenuations if a is not None]
+    attenuation = max(attenuations) if attenuations else DEFAULT_ATTENUATION
+    fg = og - (og - 1) * to_float(attenuation) / 100
+
+    if color_formula is None:
+        color_formula = DEFAULT_COLOR_FORMULA
+    if ibu_formula is None:
+        ibu_formula = DEFAULT_IBU_FORMULA
+    # Some programs export a hop utilization of 0 when it is not set
+    ibus = ibu(hops, ibu_formula, batch_size, boil_size, og) \
+         * (to_float(hop_utilization) or 100.0) / 100
+    return {
+        "og": og,
+        "fg": fg,
+        "color": COLOR_FORMULAS[color_formula](mcu),
+        "ibu": ibus,
+        "abv": gravity.alcohol_by_volume(og, fg) * 100,
+    }
+
+def _ibu_formula(option_formula, ibu_method):
+    if option_formula is not None:
+        return option_formula
+    return IBU_METHODS.get(ibu_method)
+
+def load(pk):
+    """
+    Load a recipe and everything needed to evaluate it with
+    four queries, whatever the number of ingredients.
+    """
+    return Recipe.objects.select_related("equipment", "recipeoption") \
+            .prefetch_related("fermentables", "hops", "yeasts").get(pk=pk)
+
+def calculate(recipe):
+    """
+    Calculate the estimates of a recipe, given as a Recipe or
+    its primary key. See evaluate() for the result.
+    """
+    if not isinstance(recipe, Recipe):
+        recipe = load(recipe)
+    try:
+        option = recipe.recipeoption
+    except RecipeOption.DoesNotExist:
+        option = None
+    hop_utilization = recipe.equipment.hop_utilization if recipe.equipment else None
+
+    return evaluate(
+        (recipe.batch_size, recipe.boil_size,
+         option.color_formula if option else None,
+         _ibu_formula(option.ibu_formula if option else None, recipe.ibu_method),
+         hop_utilization),
+        [fermentable_contribution(f.amount, f.ferm_yield, f.color, f.ferm_type,
+                                  recipe.efficiency)
+         for f in recipe.fermentables.all()],
+        [(h.alpha, h.amount, h.time, h.use) for h in recipe.hops.all()],
+        [y.attenuation for y in recipe.yeasts.all()])
+
+def calculate_many(queryset, chunk_size=CHUNK_SIZE):
+    """
+    Calculate the estimates of all recipes in queryset, with four
+    queries per chunk of chunk_size recipes. Yields (recipe pk,
+    estimates) tuples, see evaluate() for the estimates.
+    """
+    last = None
+    while True:
+        recipes = queryset.order_by("pk")
+        if last is not None:
+            recipes = recipes.filter(pk__gt=last)
+        recipes = list(recipes.values_list("pk", "batch_size", "boil_size",
+            "efficiency", "recipeoption__color_formula", "recipeoption__ibu_formula",
+            "ibu_method", "equipment__hop_utilization")[:chunk_size])
+        if not recipes:
+            break
+        pks = [r[0] for r in recipes]
+        chunk = queryset.filter(pk__gte=pks[0], pk__lte=pks[-1])
+        fermentables = ingredient_rows(chunk, "fermentables", "amount", "ferm_yield",
+                             "color", "ferm_type")
+        hops = ingredient_rows(chunk, "hops", "alpha", "amount", "time", "use")
+        yeasts = ingredient_rows(chunk, "yeasts", "attenuation")
+
+        for (pk, batch_size, boil_size, efficiency, color_formula, ibu_formula,
+             ibu_method, hop_utilization) in recipes:
+            yield pk, evaluate(
+                (batch_size, boil_size, color_formula,
+                 _ibu_formula(ibu_formula, ibu_method), hop_utilization),
+                [fermentable_contribution(amount, ferm_yield, lovibond, ferm_type,
+                                          efficiency)
+                 for amount, ferm_yield, lovibond, ferm_type
+                 in fermentables.get(pk, [])],
+                hops.get(pk, []),
+                [a for (a,) in yeasts.get(pk, [])])
+        if len(recipes) < chunk_size:
+            break
+        last = pks[-1]
+
+def to_fields(estimates, gravity_units=0, color_system=0):
+    """
+    Return the Recipe field values for estimates, with gravities
+    in specific gravity (0) or plato (1), and color in SRM (0) or
+    EBC (1), as chosen in RecipeOption.
+    """
+    if gravity_units == 1:
+        og = u"%.1f °P" % gravity.gravity_to_plato(estimates["og"])
+        fg = u"%.1f °P" % gravity.gravity_to_plato(estimates["fg"])
+    else:
+        og, fg = u"%.3f sg" % estimates["og"], u"%.3f sg" % estimates["fg"]
+    if color_system == 1:
+        est_color = u"%.1f EBC" % color.srm_to_ebc(estimates["color"])
+    else:
+        est_color = u"%.1f SRM" % estimates["color"]
+    return {
+        "est_og": og,
+        "est_fg": fg,
+        "est_color": est_color,
+        "ibu": Decimal("%.1f" % estimates["ibu"]),
+        "est_abv": Decimal("%.1f" % estimates["abv"]),
+    }
+
+@transaction.commit_on_success
+def recalculate(queryset, chunk_size=CHUNK_SIZE):
+    """
+    Calculate and store the estimates of all recipes
+    in queryset. Returns the number of recipes updated.
+    """
+    units = dict([(pk, (g, c)) for pk, g, c in queryset.values_list("pk",
+                  "recipeoption__gravity", "recipeoption__color")])
+    count = 0
+    for pk, estimates in calculate_many(queryset, chunk_size):
+        gravity_units, color_system = units.get(pk, (None, None))
+        Recipe.objects.filter(pk=pk).update(**to_fields(estimates,
+            gravity_units or 0, color_system or 0))
+        count += 1
+    return count
+
+def update_stats(queryset, chunk_size=CHUNK_SIZE):
+    """
+    Calculate the estimates of all recipes in queryset and store 
+    them as RecipeStats, replacing any existing stats. Returns the
+    number of recipes updated. Runs in the current transaction.
+    """
+    stats = []
+    def flush():
+        RecipeStats.objects.filter(pk__in=[s.recipe_id for s in stats]).delete()
+        RecipeStats.objects.bulk_create(stats)
+    
+    count = 0
+    for pk, estimates in calculate_many(queryset, chunk_size):
+        stats.append(RecipeStats(recipe_id=pk, **dict([(k, Decimal("%.9f" % v)) 
+                                                       for k, v in estimates.iteritems()])))
+        if len(stats) == chunk_size:
+            flush()
+            count, stats = count + len(stats), []
+    if stats:
+        flush()
+    return count + len(stats)
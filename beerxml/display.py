@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+#
+# Parsing of the display_* fields of BeerXML records, like
+# "5.00 gal", "64 F" or "1.050 SG", back into a number and a unit.
+#
+# The strings are free form, written by whatever program exported
+# the records, so the grammar accepts signs, decimal commas, a
+# degree sign before the unit and the common spellings of each
+# unit, which are mapped to the unit names of the formulas modules.
+# The same few strings repeat throughout a catalog, so parsed
+# results are kept in a bounded LRU cache, shared by all threads.
+#
+# recipe_units() goes the other way, telling which units to
+# display the values of each recipe in, from its options.
+
+import re
+import threading
+from collections import namedtuple
+
+from brewery.models import RecipeOption
+from brewery.beerxml.formulas import weight, volume, temperature, pressure
+
+DisplayValue = namedtuple("DisplayValue", "value unit")
+
+EMPTY = DisplayValue(None, None)
+
+# Number of distinct strings kept in the cache
+CACHE_SIZE = 10000
+
+# Number of records read from the database at a time
+CHUNK_SIZE = 2000
+
+_grammar = re.compile(ur"""
+    ^\s*
+    (?P<number>[-+]?(?:\d+(?:[.,]\d*)?|[.,]\d+)(?:[eE][-+]?\d+)?)
+    \s*
+    (?:°\s*|deg(?:rees?)?\s+)?
+    (?P<unit>[^\d\s].*?)?
+    \s*$
+""", re.VERBOSE | re.UNICODE)
+
+# Spellings of the units, in lower case, and the unit they mean
+UNITS = {
+    u"kg": u"kg", u"kgs": u"kg", u"kilogram": u"kg", u"kilograms": u"kg",
+    u"g": u"g", u"gm": u"g", u"gr": u"g", u"gram": u"g", u"grams": u"g",
+    u"oz": u"oz", u"ounce": u"oz", u"ounces": u"oz",
+    u"lb": u"lb", u"lbs": u"lb", u"pound": u"lb", u"pounds": u"lb",
+    u"l": u"l", u"liter": u"l", u"liters": u"l", u"litre": u"l", u"litres": u"l",
+    u"ml": u"ml", u"milliliter": u"ml", u"milliliters": u"ml",
+    u"tsp": u"tsp", u"teaspoon": u"tsp", u"teaspoons": u"tsp",
+    u"tblsp": u"tblsp", u"tbsp": u"tblsp", u"tablespoon": u"tblsp",
+    u"tablespoons": u"tblsp",
+    u"cup": u"cup", u"cups": u"cup",
+    u"pt": u"pt", u"pint": u"pt", u"pints": u"pt",
+    u"qt": u"qt", u"quart": u"qt", u"quarts": u"qt",
+    u"gal": u"gal", u"gallon": u"gal", u"gallons": u"gal",
+    u"c": u"C", u"celsius": u"C", u"f": u"F", u"fahrenheit": u"F",
+    u"k": u"K", u"kelvin": u"K",
+    u"kpa": u"kpa", u"pa": u"pa", u"bar": u"bar", u"atm": u"atm", u"psi": u"psi",
+    u"sg": u"sg", u"p": u"plato", u"plato": u"plato",
+    u"srm": u"srm", u"ebc": u"ebc", u"l°": u"lovibond", u"lovibond": u"lovibond",
+    u"min": u"min", u"mins": u"min", u"minute": u"min", u"minutes": u"min",
+    u"hr": u"hour", u"hour": u"hour", u"hours": u"hour",
+    u"day": u"day", u"days": u"day", u"week": u"week", u"weeks": u"week",
+    u"%": u"%", u"vol": u"vols", u"vols": u"vols", u"volumes": u"vols",
+}
+
+# Conversion tables of the units which can be converted, by
+# dimension. oz is both a weight and a (fluid ounce) volume, so
+# the table is picked by dimension rather than by unit.
+DIMENSIONS = {
+    "weight": weight.UNITS,
+    "volume": volume.UNITS,
+    "temperature": temperature.UNITS,
+    "pressure": pressure.UNITS,
+}
+
+
+class LRUCache(object):
+    """
+    A dict like cache of at most size items, which drops the
+    least recently used item when full. The items are kept in a
+    dict of links of a circular doubly linked list, ordered from
+    least to most recently used, so a hit moves a single link.
+    The list is guarded by a lock, so the cache can be shared by
+    threads.
+    """
+    # Links are [previous link, next link, key, value]
+
+    def __init__(self, size):
+        self.size = size
+        self.items = {}
+        self.root = []
+        self.lock = threading.Lock()
+        self.clear()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, default=None):
+        with self.lock:
+            link = self.items.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return self._touch(link)
+
+    def _touch(self, link):
+        # Move the link to the end, as most recently used
+        prev, next, key, value = link
+        prev[1] = next
+        next[0] = prev
+        root = self.root
+        last = root[0]
+        last[1] = root[0] = link
+        link[0], link[1] = last, root
+        return value
+
+    def set(self, key, value):
+        with self.lock:
+            if key in self.items:
+                link = self.items[key]
+                link[3] = value
+                self._touch(link)
+                return
+            root = self.root
+            if len(self.items) >= self.size:
+                # Reuse the root as the new link, and make the
+                # least recently used link the new root.
+                root[2], root[3] = key, value
+                self.items[key] = root
+                self.root = root = root[1]
+                del self.items[root[2]]
+                root[2] = root[3] = None
+            else:
+                last = root[0]
+                last[1] = root[0] = self.items[key] = [last, root, key, value]
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.root[:] = [self.root, self.root, None, None]
+            self.hits = self.misses = 0
+
+
+_cache = LRUCache(CACHE_SIZE)
+
+def _parse(text):
+    match = _grammar.match(text)
+    if match is None:
+        return EMPTY
+    number, unit = match.group("number", "unit")
+    value = float(number.replace(u",", u"."))
+    if unit is not None:
+        unit = UNITS.get(unit.lower(), unit)
+    return DisplayValue(value, unit)
+
+def parse(text):
+    """
+    Parse a display string into a DisplayValue of the number
+    and the unit. The unit is None if there is none, and both
+    are None if text is empty or not a number.
+    """
+    if not text:
+        return EMPTY
+    result = _cache.get(text)
+    if result is None:
+        result = _parse(text)
+        _cache.set(text, result)
+    return result
+
+def _table(to_unit, dimension):
+    if dimension is not None:
+        table = DIMENSIONS[dimension]
+        if to_unit not in table:
+            raise ValueError("%s is not a unit of %s" % (to_unit, dimension))
+        return table
+    tables = [t for t in DIMENSIONS.itervalues() if to_unit in t]
+    if len(tables) > 1:
+        raise ValueError("%s is a unit of more than one dimension, "
+                         "the dimension must be given" % to_unit)
+    return tables[0] if tables else None
+
+def convert(text, to_unit, dimension=None):
+    """
+    Parse a display string and convert it to to_unit, within the
+    units of dimension ("weight", "volume", "temperature" or
+    "pressure"). dimension may be left out if to_unit belongs to
+    only one of them, but is required for units like oz, which is
+    both a weight and a volume. Returns None if text has no number,
+    or its unit can not be converted to to_unit. Numbers without a
+    unit are assumed to be in to_unit.
+    """
+    table = _table(to_unit, dimension)
+    value, unit = parse(text)
+    if value is None:
+        return None
+    if unit is None or unit == to_unit:
+        return value
+    if table is None or unit not in table:
+        return None
+    return table.convert(value, unit, to_unit)
+
+def parse_many(texts):
+    """
+    Parse a sequence of display strings. Returns a list of
+    DisplayValues.
+    """
+    return [parse(text) for text in texts]
+
+def parse_column(queryset, field, chunk_size=CHUNK_SIZE):
+    """
+    Parse the display strings in field of all records in queryset,
+    reading chunk_size records at a time. Yields (pk, DisplayValue)
+    tuples.
+    """
+    last = None
+    while True:
+        rows = queryset.order_by("pk")
+        if last is not None:
+            rows = rows.filter(pk__gt=last)
+        rows = list(rows.values_list("pk", field)[:chunk_size])
+        for pk, text in rows:
+            yield pk, parse(text)
+        if len(rows) < chunk_size:
+            break
+        last = rows[-1][0]
+
+def clear_cache():
+    _cache.clear()
+
+def recipe_units(queryset):
+    """
+    Return the display units chosen in the options of each recipe
+    in queryset, as a dict of recipe pk to a dict of the units for
+    "weight", "small weight", "volume", "small volume", "temperature"
+    and "pressure". Recipes without options get the default units.
+    The units can be handed straight to the convert() functions of
+    the formulas modules, converting a column of values at once.
+    """
+    defaults = dict([(f.name, f.default) for f in RecipeOption._meta.fields
+                     if f.name in ("weight", "volume", "temperature", "pressure")])
+    units = {}
+    for pk, w, v, t, p in queryset.values_list("pk", "recipeoption__weight",
+            "recipeoption__volume", "recipeoption__temperature", "recipeoption__pressure"):
+        w = defaults["weight"] if w is None else w
+        v = defaults["volume"] if v is None else v
+        t = defaults["temperature"] if t is None else t
+        p = defaults["pressure"] if p is None else p
+        units[pk] = {
+            "weight": weight.SYSTEM_UNITS[w],
+            "small weight": weight.SYSTEM_SMALL_UNITS[w],
+            "volume": volume.SYSTEM_UNITS[v],
+            "small volume": volume.SYSTEM_SMALL_UNITS[v],
+            "temperature": temperature.SYSTEM_UNITS[t],
+            "pressure": pressure.SYSTEM_UNITS[p],
+        }
+    return units
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+#
+# Streaming export of brewery models to BeerXML and CSV.
+#
+# Records are read from the database in chunks of chunk_size,
+# ordered by primary key, with their foreign keys joined in and
+# their many-to-many relations prefetched for the whole chunk.
+# Each record is written to the output as soon as it has been
+# built, using lxml's incremental xmlfile writer, so memory use
+# depends on the chunk size and not on the size of the export.
+# CSV rows are read with values_list() in the same way, without
+# building model instances at all.
+
+import csv
+from decimal import Decimal
+
+from lxml import etree
+from django.db.models.base import Model
+from django.db.models.fields import BooleanField, NullBooleanField
+from django.db.models.fields.related import ManyToOneRel, ManyToManyRel
+
+from brewery.beerxml.error import BeerXMLError
+from brewery.beerxml.nodes import NODENAMES, MANY_TO_ONE, MANY_TO_MANY
+
+# Number of records read from the database at a time
+CHUNK_SIZE = 500
+
+# Fields which are not part of the BeerXML standard
+EXCLUDE = ("id", "slug", "registered_by", "modified_by",
+           "cdt", "mdt", "fingerprint")
+
+# Mapping of brewery models to BeerXML standard node tags
+TAGNAMES = dict([(v, k) for k, v in NODENAMES.iteritems()])
+
+_export_plans = {}
+
+def get_tag(model):
+    """
+    Return the BeerXML tag name for model.
+    """
+    try:
+        return TAGNAMES[model.__name__]
+    except KeyError:
+        raise BeerXMLError("%s can not be exported to BeerXML" % model.__name__)
+
+def get_export_plan(model):
+    """
+    Return the export plan for model, which is a list of (tag,
+    field, relation) tuples in field order. The tag is the field
+    name in upper case, or the BeerXML name from _beerxml_attrs.
+    relation is None for plain fields, MANY_TO_ONE or MANY_TO_MANY.
+    Plans are built once per model.
+    """
+    try:
+        return _export_plans[model]
+    except KeyError:
+        pass
+
+    tags = dict([(name, tag) for tag, name
+                 in getattr(model, "_beerxml_attrs", {}).iteritems()])
+    plan = []
+    opts = model._meta
+    for field in opts.fields + opts.many_to_many:
+        if field.name in EXCLUDE:
+            continue
+        relation = None
+        if isinstance(field.rel, ManyToOneRel):
+            relation = MANY_TO_ONE
+        elif isinstance(field.rel, ManyToManyRel):
+            relation = MANY_TO_MANY
+        plan.append((tags.get(field.name, field.name).upper(), field, relation))
+
+    _export_plans[model] = plan
+    return plan
+
+def get_related_lookups(model, prefix=""):
+    """
+    Return the select_related() and prefetch_related() lookups
+    needed to export model without a query per record.
+    """
+    select, prefetch = [], []
+    for tag, field, relation in get_export_plan(model):
+        name = prefix + field.name
+        if relation is MANY_TO_ONE:
+            select.append(name)
+            s, p = get_related_lookups(field.rel.to, name + "__")
+            select.extend(s)
+            prefetch.extend(p)
+        elif relation is MANY_TO_MANY:
+            prefetch.append(name)
+    return select, prefetch
+
+def format_decimal(value):
+    """
+    Return a Decimal as text, without trailing zeros.
+    """
+    value = u"%s" % value
+    if u"." in value:
+        value = value.rstrip(u"0").rstrip(u".")
+    return value
+
+def format_value(obj, field):
+    """
+    Return the value of field on obj as BeerXML text, or
+    None if the value is empty.
+    """
+    value = getattr(obj, field.attname)
+    if value is None or value == "":
+        return None
+    if isinstance(field, (BooleanField, NullBooleanField)):
+        return value and u"TRUE" or u"FALSE"
+    if field.choices:
+        return u"%s" % getattr(obj, "get_%s_display" % field.name)()
+    if isinstance(value, Decimal):
+        return format_decimal(value)
+    return u"%s" % value
+
+def to_element(obj):
+    """
+    Build the BeerXML element for a model instance,
+    including all related records.
+    """
+    model = obj.__class__
+    element = etree.Element(get_tag(model))
+    for tag, field, relation in get_export_plan(model):
+        if relation is MANY_TO_ONE:
+            related = getattr(obj, field.name)
+            if related is not None:
+                element.append(to_element(related))
+        elif relation is MANY_TO_MANY:
+            records = etree.SubElement(element, tag)
+            for related in getattr(obj, field.name).all():
+                records.append(to_element(related))
+        else:
+            value = format_value(obj, field)
+            if value is not None:
+                etree.SubElement(element, tag).text = value
+    return element
+
+def iter_objects(queryset, chunk_size=CHUNK_SIZE):
+    """
+    Iterate over queryset in chunks of chunk_size, with
+    related records loaded a chunk at a time.
+    """
+    select, prefetch = get_related_lookups(queryset.model)
+    queryset = queryset.select_related(*select).prefetch_related(*prefetch)
+    last = None
+    while True:
+        chunk = queryset.order_by("pk")
+        if last is not None:
+            chunk = chunk.filter(pk__gt=last)
+        chunk = list(chunk[:chunk_size])
+        for obj in chunk:
+            yield obj
+        if len(chunk) < chunk_size:
+            break
+        last = chunk[-1].pk
+
+def export(objects, output, chunk_size=CHUNK_SIZE):
+    """
+    Write objects to output as a BeerXML document. objects is
+    a queryset, a model instance or a list of model instances,
+    all of the same model. output is a path or anything with a
+    write() method, like a file or a HttpResponse.
+    """
+    if isinstance(objects, Model):
+        objects = [objects]
+    if hasattr(objects, "model"):
+        model = objects.model
+        objects = iter_objects(objects, chunk_size)
+    elif objects:
+        model = objects[0].__class__
+    else:
+        raise BeerXMLError("Nothing to export")
+
+    with etree.xmlfile(output, encoding="utf-8") as xf:
+        xf.write_declaration()
+        with xf.element("%sS" % get_tag(model)):
+            for obj in objects:
+                xf.write(to_element(obj), pretty_print=True)
+
+
+class Echo(object):
+    """
+    A file like object which returns what is written to
+    it, so csv.writer can hand us one line at a time.
+    """
+    def write(self, value):
+        return value
+
+def iter_rows(queryset, fields, chunk_size=CHUNK_SIZE):
+    """
+    Iterate over values_list() rows of fields in queryset. Fields
+    may span relations, like "hops__name", which gives one row per
+    related record. Records are read in chunks of chunk_size, with
+    two queries per chunk.
+    """
+    last = None
+    while True:
+        pks = queryset.order_by("pk")
+        if last is not None:
+            pks = pks.filter(pk__gt=last)
+        pks = list(pks.values_list("pk", flat=True)[:chunk_size])
+        if not pks:
+            break
+        rows = queryset.filter(pk__gte=pks[0], pk__lte=pks[-1]).order_by("pk")
+        for row in rows.values_list(*fields).iterator():
+            yield row
+        if len(pks) < chunk_size:
+            break
+        last = pks[-1]
+
+def iter_csv(queryset, fields=None, header=True, chunk_size=CHUNK_SIZE):
+    """
+    Iterate over the lines of a CSV export of fields in queryset,
+    encoded as utf-8. fields defaults to all plain BeerXML fields
+    of the model. The iterator can be handed straight to a
+    HttpResponse (or StreamingHttpResponse), which streams it.
+    """
+    if fields is None:
+        fields = [field.name for tag, field, relation
+                  in get_export_plan(queryset.model) if relation is None]
+    writer = csv.writer(Echo())
+    encode = lambda v: isinstance(v, unicode) and v.encode("utf-8") or v
+
+    if header:
+        yield writer.writerow([encode(f) for f in fields])
+    for row in iter_rows(queryset, fields, chunk_size):
+        values = []
+        for value in row:
+            if value is None:
+                value = ""
+            elif isinstance(value, Decimal):
+                value = format_decimal(value)
+            values.append(encode(value))
+        yield writer.writerow(values)
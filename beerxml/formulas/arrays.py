@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+#
+# numpy is an optional dependency (see README.md). The modules
+# working on whole columns of values get it from optional_numpy(),
+# which gives None when numpy is not installed, and either fall
+# back to plain Python or call require_numpy() first, so that only
+# the features which need numpy fail without it.
+
+def optional_numpy():
+    """
+    Return the numpy module, or None if it is not installed.
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+np = optional_numpy()
+
+def require_numpy(feature):
+    """
+    Return the numpy module, or raise ImportError naming
+    feature if it is not installed.
+    """
+    if np is None:
+        raise ImportError("%s requires numpy" % feature)
+    return np
+
+def as_array(values, feature="Working on arrays"):
+    """
+    Return values as an array of floats.
+    """
+    return require_numpy(feature).asarray(values, dtype=np.float64)
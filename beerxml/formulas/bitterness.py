@@ -8,6 +8,7 @@
 # http://www.realbeer.com/hops/
 
 import math
+from bisect import bisect_left
 
 class Tinseth:
     """
@@ -54,7 +55,7 @@ class Tinseth:
         to boil time.
         """
         e = 2.71828182846
-        return 1 - e ** (-0.04 * float(time_in_minutes)) / 4.15
+        return (1 - e ** (-0.04 * float(time_in_minutes))) / 4.15
 
 
 class Rager:
@@ -68,7 +69,7 @@ class Rager:
         Calculate IBU using metric units.
         """
         return grams_of_hop * utilization_percentage * alpha_acid_percentage \
-                * 1000 / batch_size_liters * (1 + gravity_adjustment)
+                * 1000 / (batch_size_liters * (1 + gravity_adjustment))
                 
     def ibu_non_metric(self, ounces_of_hop, utilization_percentage, 
                alpha_acid_percentage, batch_size_gallons, gravity_adjustment):
@@ -76,7 +77,7 @@ class Rager:
         Calculate IBU using non-metric units.
         """
         return ounces_of_hop * utilization_percentage * alpha_acid_percentage \
-                * 7462 / batch_size_gallons * (1 + gravity_adjustment)
+                * 7462 / (batch_size_gallons * (1 + gravity_adjustment))
         
     def utilization_percentage(self, time_in_minutes):
         """
@@ -92,42 +93,58 @@ class Rager:
         return (boil_gravity - 1.050) / 0.2 if boil_gravity > 1.050 else 0
     
     
-class Garetz:    
+class UtilizationTable(object):
     """
-    Estimate IBUs using Garetz' equations.
+    Lookup table of utilization percentages by boil time. The
+    table is a sequence of (boil time, utilization) tuples, sorted 
+    by boil time, where each utilization applies to boil times up
+    to and including its boil time. Boil times may be floats, and
+    boil times past the end of the table get the last utilization.
     """
-    class range_dict(dict):
+    def __init__(self, table):
+        self.bounds = tuple([float(t) for t, u in table])
+        self.values = tuple([u for t, u in table])
+    
+    def __getitem__(self, time_in_minutes):
+        i = bisect_left(self.bounds, time_in_minutes)
+        return self.values[min(i, len(self.values) - 1)]
+    
+    def get(self, time_in_minutes):
+        return self.__getitem__(time_in_minutes)
+    
+    def interpolate(self, time_in_minutes):
         """
-        Wierd dict to support xrange keys
+        Return the utilization interpolated linearly between
+        the boil times in the table, starting at 0 utilization 
+        for 0 minutes.
         """
-        def __getitem__(self, key):
-            for k, v in self.iteritems():
-                if key in k:
-                    return v
-            raise KeyError(key)
-        
-        def get(self, key):
-            try:
-                return self.__getitem__(key)
-            except KeyError:
-                return None
-    
-    # I know.. it's silly =)
-    utilization_table = range_dict({
-        xrange(0, 10)   : 0,
-        xrange(11, 15)  : 2,
-        xrange(16, 20)  : 5,
-        xrange(21, 25)  : 8,
-        xrange(26, 30)  : 11,
-        xrange(32, 35)  : 14,
-        xrange(36, 40)  : 16,
-        xrange(41, 45)  : 18,
-        xrange(46, 50)  : 19,
-        xrange(51, 60)  : 20,
-        xrange(61, 70)  : 21,
-        xrange(71, 80)  : 22,
-        xrange(81, 90)  : 23,
-    })
+        bounds, values = (0.0,) + self.bounds, (0,) + self.values
+        i = bisect_left(bounds, time_in_minutes)
+        if i == 0:
+            return float(values[0])
+        if i == len(bounds):
+            return float(values[-1])
+        t0, t1 = bounds[i - 1], bounds[i]
+        return values[i - 1] + (values[i] - values[i - 1]) \
+                * (time_in_minutes - t0) / (t1 - t0)
+    
+    def lookup(self, times_in_minutes, interpolate=False):
+        """
+        Look up the utilization of a sequence of boil times.
+        """
+        get = interpolate and self.interpolate or self.__getitem__
+        return [get(t) for t in times_in_minutes]
+
+
+class Garetz:    
+    """
+    Estimate IBUs using Garetz' equations.
+    """
+    utilization_table = UtilizationTable(
+        # Boil time (up to and including), utilization percentage
+        ((10, 0), (15, 2), (20, 5), (25, 8), (30, 11), (35, 14), (40, 16),
+         (45, 18), (50, 19), (60, 20), (70, 21), (80, 22), (90, 23))
+    )
     
     def ibu(self, grams_of_hop, utilization_percentage, alpha_acid_percentage, 
             batch_size_liters, combined_adjustments):
@@ -135,7 +152,7 @@ class Garetz:
         Calculate IBUs using metric units.
         """
         return grams_of_hop * utilization_percentage * alpha_acid_percentage \
-                * 0.1 / batch_size_liters * combined_adjustments
+                * 0.1 / (batch_size_liters * combined_adjustments)
     
     def ibu_non_metric(self, ounces_of_hop, utilization_percentage, 
                alpha_acid_percentage, batch_size_gallons, combined_adjustments):
@@ -143,7 +160,7 @@ class Garetz:
         Calculate IBUs using non-metric units.
         """
         return ounces_of_hop * utilization_percentage * alpha_acid_percentage \
-                * 0.749 / batch_size_gallons * combined_adjustments
+                * 0.749 / (batch_size_gallons * combined_adjustments)
     
     def combined_adjustments(self, gravity_factor, hopping_rate_factor, 
                              temperature_factor):
@@ -168,9 +185,10 @@ class Garetz:
     
     def gravity_factor(self, boil_gravity):
         """
-        Calculate gravity factor.
+        Calculate gravity factor. Like Rager's gravity adjustment,
+        it only applies to boil gravities above 1.050.
         """
-        return (boil_gravity - 1.050 / 0.2) + 1
+        return ((boil_gravity - 1.050) / 0.2) + 1 if boil_gravity > 1.050 else 1
     
     def hopping_rate_factor(self, concentration_factor, desired_ibu):
         """
@@ -184,11 +202,13 @@ class Garetz:
         """
         return ((elevation_in_feet / 550) * 0.02) + 1
     
-    def utilization_percentage(self, time_in_minutes):
+    def utilization_percentage(self, time_in_minutes, interpolate=False):
         """
         Get the average utilization percentage based on
         boil time.
         """ 
+        if interpolate:
+            return self.utilization_table.interpolate(time_in_minutes)
         return self.utilization_table[time_in_minutes]
     
     
@@ -1,3 +1,199 @@
 # -*- coding: utf-8 -*-
 #
-#
\ No newline at end of file
+# References:
+# http://howtobrew.com/section3/chapter16-3.html
+# http://www.beersmith.com/mash-calculations/
+#
+# Mash water and temperature calculations, from the heat balance
+# of the mash. Everything is in kilograms, liters and degrees
+# Celsius, like the BeerXML records.
+#
+# The heat needed to warm each part of the mash one degree is its
+# weight times its specific heat relative to water, so a kilogram
+# of grain counts as GRAIN_SPECIFIC_HEAT kilograms of water, and
+# the tun counts as its weight times the specific heat of its
+# material. The tun is only taken into account when the mash
+# profile says so (equip_adjust). Otherwise it is assumed to be
+# preheated, and neither gives nor takes any heat.
+#
+# schedule() runs through the steps of one mash profile, and
+# schedule_many() does the same for any number of profiles at once
+# with numpy, one step position at a time.
+
+from collections import namedtuple
+
+from brewery.beerxml.formulas.arrays import optional_numpy, require_numpy
+
+np = optional_numpy()
+
+# Specific heat of grain, relative to water
+GRAIN_SPECIFIC_HEAT = 0.4
+
+# Volume of a kilogram of grain in the mash, in liters
+GRAIN_VOLUME = 0.67
+
+# Temperature of a boiling decoction
+BOILING_TEMP = 100.0
+
+# Temperature of the grain when not given
+DEFAULT_GRAIN_TEMP = 20.0
+
+INFUSION, TEMPERATURE, DECOCTION = u"infusion", u"temperature", u"decoction"
+STEP_TYPES = (INFUSION, TEMPERATURE, DECOCTION)
+
+# The result of each step. infuse_temp is the temperature of the
+# water added in the step, water and ratio the total water in the
+# mash and the liters of water per kilogram of grain after the step,
+# decoction_amount the liters of mash to boil and heat the heat
+# added from outside the mash (by heating it or by the decoction)
+# in kilocalories.
+MashStepResult = namedtuple("MashStepResult", "step_type step_temp infuse_amount "
+                            "infuse_temp water ratio decoction_amount heat")
+
+def _float(value, default=0.0):
+    return default if value is None else float(value)
+
+def infusion_temp(heat, capacity, target_temp, infuse_amount):
+    """
+    Return the temperature of infuse_amount liters of water which
+    brings a mash to target_temp. capacity is the heat capacity of
+    the mash (kilograms of water which take the same heat to warm a
+    degree) and heat its heat content (the capacity times the mash
+    temperature, or the sum of that of each part if they are not at
+    the same temperature).
+    """
+    return (target_temp * (capacity + infuse_amount) - heat) / infuse_amount
+
+def infusion_amount(heat, capacity, target_temp, infuse_temp):
+    """
+    Return the liters of water at infuse_temp which brings a mash
+    to target_temp, see infusion_temp().
+    """
+    return (target_temp * capacity - heat) / (infuse_temp - target_temp)
+
+def strike_temp(grain_weight, grain_temp, target_temp, infuse_amount,
+                tun_weight=0.0, tun_specific_heat=0.0, tun_temp=None):
+    """
+    Return the temperature of the first infusion, which brings the
+    grain from grain_temp and the tun from tun_temp (the grain
+    temperature if not given) to target_temp.
+    """
+    grain = grain_weight * GRAIN_SPECIFIC_HEAT
+    tun = tun_weight * tun_specific_heat
+    if tun_temp is None:
+        tun_temp = grain_temp
+    return infusion_temp(grain * grain_temp + tun * tun_temp, grain + tun,
+                         target_temp, infuse_amount)
+
+def decoction_fraction(heat, capacity, mash_capacity, target_temp):
+    """
+    Return the fraction of a mash to boil and return to the mash to
+    bring it to target_temp, see infusion_temp(). mash_capacity is
+    the heat capacity of the grain and water, without the tun, which
+    stays where it is.
+    """
+    mash_temp = heat / capacity
+    return (target_temp * capacity - heat) / (mash_capacity * (BOILING_TEMP - mash_temp))
+
+def schedule(grain_weight, steps, grain_temp=None, tun_temp=None, tun_weight=None,
+             tun_specific_heat=None, equip_adjust=False):
+    """
+    Run through a mash schedule, returning a MashStepResult for each
+    step. steps is a list of (step type, step temperature, infusion
+    amount) tuples. The grain and tun start at grain_temp and tun_temp,
+    which default to 20 C and the grain temperature.
+
+    Infusion steps without an infusion amount, and temperature steps,
+    are heated from outside the mash. Water added in a temperature
+    step is assumed to be at the step temperature.
+    """
+    grain_weight = _float(grain_weight)
+    grain_temp = _float(grain_temp, DEFAULT_GRAIN_TEMP)
+    tun_temp = _float(tun_temp, grain_temp)
+    tun = _float(tun_weight) * _float(tun_specific_heat) if equip_adjust else 0.0
+
+    grain = grain_weight * GRAIN_SPECIFIC_HEAT
+    heat, capacity = grain * grain_temp + tun * tun_temp, grain + tun
+    water = 0.0
+    results = []
+    for step_type, step_temp, infuse_amount in steps:
+        step_type = (step_type or INFUSION).lower()
+        step_temp, infuse_amount = _float(step_temp), _float(infuse_amount)
+        infuse_temp = decoction_amount = None
+        added = 0.0
+
+        if step_type == INFUSION and infuse_amount > 0:
+            infuse_temp = infusion_temp(heat, capacity, step_temp, infuse_amount)
+        else:
+            added = step_temp * capacity - heat
+            if step_type == DECOCTION and added > 0 and water:
+                decoction_amount = decoction_fraction(heat, capacity, capacity - tun,
+                    step_temp) * (water + grain_weight * GRAIN_VOLUME)
+        water += infuse_amount
+        capacity += infuse_amount
+        heat = capacity * step_temp
+        results.append(MashStepResult(step_type, step_temp, infuse_amount or None,
+            infuse_temp, water, water / grain_weight if grain_weight else None,
+            decoction_amount, added))
+    return results
+
+def schedule_many(grain_weight, grain_temp, tun_temp, tun_capacity,
+                  step_types, step_temps, infuse_amounts, offsets):
+    """
+    Run through the mash schedules of many mash profiles at once.
+    grain_weight, grain_temp, tun_temp and tun_capacity (tun weight
+    times specific heat, or 0 if the tun is not taken into account)
+    have a value per profile. step_types (indices into STEP_TYPES),
+    step_temps and infuse_amounts have a value per step, with the
+    steps of profile i in [offsets[i]:offsets[i + 1]], like the
+    segments of formulas.vectorized.
+
+    Returns a dict of arrays of infuse_temp, water, ratio,
+    decoction_amount and heat, with a value per step as in
+    schedule(). Values which do not apply are NaN.
+    """
+    require_numpy("schedule_many")
+    grain_weight = np.asarray(grain_weight, dtype=np.float64)
+    tun = np.asarray(tun_capacity, dtype=np.float64)
+    step_types = np.asarray(step_types, dtype=np.intp)
+    step_temps = np.asarray(step_temps, dtype=np.float64)
+    infuse_amounts = np.nan_to_num(np.asarray(infuse_amounts, dtype=np.float64))
+    offsets = np.asarray(offsets, dtype=np.intp)
+    counts = np.diff(offsets)
+
+    grain = grain_weight * GRAIN_SPECIFIC_HEAT
+    heat = grain * np.asarray(grain_temp, dtype=np.float64) \
+         + tun * np.asarray(tun_temp, dtype=np.float64)
+    capacity = grain + tun
+    water = np.zeros(len(grain_weight))
+
+    results = dict([(name, np.empty(len(step_temps)) * np.nan) for name
+                    in ("infuse_temp", "water", "ratio", "decoction_amount", "heat")])
+    # Each round runs the next step of all profiles which have one
+    for position in xrange(counts.max() if len(counts) else 0):
+        profiles = np.nonzero(counts > position)[0]
+        steps = offsets[profiles] + position
+        target, amount = step_temps[steps], infuse_amounts[steps]
+        h, c, w = heat[profiles], capacity[profiles], water[profiles]
+
+        infused = (step_types[steps] == STEP_TYPES.index(INFUSION)) & (amount > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            results["infuse_temp"][steps] = np.where(infused,
+                (target * (c + amount) - h) / amount, np.nan)
+            added = np.where(infused, 0.0, target * c - h)
+            results["heat"][steps] = added
+
+            decocted = (step_types[steps] == STEP_TYPES.index(DECOCTION)) \
+                     & (added > 0) & (w > 0)
+            fraction = added / ((c - tun[profiles]) * (BOILING_TEMP - h / c))
+            results["decoction_amount"][steps] = np.where(decocted,
+                fraction * (w + grain_weight[profiles] * GRAIN_VOLUME), np.nan)
+
+            w = w + amount
+            results["water"][steps] = w
+            results["ratio"][steps] = np.where(grain_weight[profiles] > 0,
+                                               w / grain_weight[profiles], np.nan)
+        water[profiles] = w
+        capacity[profiles] = c + amount
+        heat[profiles] = (c + amount) * target
+    return results
@@ -1,3 +1,32 @@
 # -*- coding: utf-8 -*-
 #
-#
\ No newline at end of file
+# Pressure conversions. BeerXML records store all pressures
+# in kilopascals.
+#
+# Values may be numbers or numpy arrays, see units.ConversionTable.
+
+from brewery.beerxml.formulas.units import ConversionTable
+
+# Kilopascals per unit
+UNITS = ConversionTable({
+    "kpa": 1.0,
+    "pa": 0.001,
+    "bar": 100.0,
+    "atm": 101.325,
+    "psi": 6.894757293168361,
+})
+
+# Units for each RecipeOption.PRESSURE choice
+SYSTEM_UNITS = {0: "kpa", 1: "psi", 2: "bar"}
+
+def convert(value, from_unit, to_unit):
+    """
+    Convert value from from_unit to to_unit.
+    """
+    return UNITS.convert(value, from_unit, to_unit)
+
+def kilopascals_to_psi(kilopascals):
+    return UNITS.convert(kilopascals, "kpa", "psi")
+
+def psi_to_kilopascals(psi):
+    return UNITS.convert(psi, "psi", "kpa")
@@ -1,3 +1,31 @@
 # -*- coding: utf-8 -*-
 #
-#
\ No newline at end of file
+# Temperature conversions between degrees Celsius, Fahrenheit
+# and Kelvin. BeerXML records store all temperatures in degrees
+# Celsius.
+#
+# Values may be numbers or numpy arrays, see units.ConversionTable.
+
+from brewery.beerxml.formulas.units import ConversionTable
+
+# (Degrees Celsius per degree, Celsius at 0 degrees) per unit
+UNITS = ConversionTable({
+    "C": 1.0,
+    "F": (5.0 / 9, -32 * 5.0 / 9),
+    "K": (1.0, -273.15),
+})
+
+# Units for each RecipeOption.TEMPERATURE choice
+SYSTEM_UNITS = {0: "C", 1: "F"}
+
+def convert(value, from_unit, to_unit):
+    """
+    Convert value from from_unit to to_unit.
+    """
+    return UNITS.convert(value, from_unit, to_unit)
+
+def celsius_to_fahrenheit(celsius):
+    return UNITS.convert(celsius, "C", "F")
+
+def fahrenheit_to_celsius(fahrenheit):
+    return UNITS.convert(fahrenheit, "F", "C")
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# Table driven unit conversions, used by the weight, volume,
+# temperature and pressure modules.
+#
+# Every unit is described by its (scale, offset) relative to a
+# base unit, so that base = value * scale + offset. From these,
+# the (scale, offset) of converting between any two units is
+# computed once, when the table is built, and a conversion is a
+# single multiply and add. This works the same on numbers and on
+# numpy arrays, which converts a whole column of values at once.
+
+from decimal import Decimal
+
+from brewery.beerxml.formulas.arrays import optional_numpy, as_array, require_numpy
+
+np = optional_numpy()
+
+def _value(value):
+    """
+    Return value as something we can do float arithmetic on:
+    Decimals as floats, and lists or tuples as numpy arrays.
+    """
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (list, tuple)):
+        return as_array(value, "Converting sequences")
+    return value
+
+
+class ConversionTable(object):
+    """
+    Conversions between the units in units, a dict mapping
+    each unit name to its (scale, offset) relative to the base
+    unit, or just the scale if the offset is 0.
+    """
+    def __init__(self, units):
+        self.units = {}
+        for unit, relative in units.iteritems():
+            if not isinstance(relative, tuple):
+                relative = (relative, 0.0)
+            self.units[unit] = (float(relative[0]), float(relative[1]))
+        # to = value * scale_from / scale_to + (offset_from - offset_to) / scale_to
+        self.factors = {}
+        for a, (scale_a, offset_a) in self.units.iteritems():
+            for b, (scale_b, offset_b) in self.units.iteritems():
+                self.factors[(a, b)] = (scale_a / scale_b, (offset_a - offset_b) / scale_b)
+
+    def __contains__(self, unit):
+        return unit in self.units
+
+    def factor(self, from_unit, to_unit):
+        """
+        Return the (scale, offset) for converting from_unit to to_unit.
+        """
+        try:
+            return self.factors[(from_unit, to_unit)]
+        except KeyError:
+            raise ValueError("Can not convert %s to %s" % (from_unit, to_unit))
+
+    def convert(self, value, from_unit, to_unit):
+        """
+        Convert value, a number or an array of numbers, from from_unit
+        to to_unit. Either unit may be a sequence with one unit per
+        value, e.g. the display units of the recipes on a page, and
+        a single number is then converted to or from each unit.
+        """
+        value = _value(value)
+        if isinstance(from_unit, basestring) and isinstance(to_unit, basestring):
+            scale, offset = self.factor(from_unit, to_unit)
+        else:
+            require_numpy("Converting to a sequence of units")
+            # A single value is converted to each of the units
+            units = [u for u in (from_unit, to_unit) if not isinstance(u, basestring)]
+            count = len(units[0]) if np.ndim(value) == 0 else len(value)
+            if isinstance(from_unit, basestring):
+                from_unit = [from_unit] * count
+            if isinstance(to_unit, basestring):
+                to_unit = [to_unit] * count
+            if len(from_unit) != count or len(to_unit) != count:
+                raise ValueError("Got %d values, %d from units and %d to units" 
+                                 % (count, len(from_unit), len(to_unit)))
+            factors = [self.factor(a, b) for a, b in zip(from_unit, to_unit)]
+            scale = np.array([s for s, o in factors])
+            offset = np.array([o for s, o in factors])
+        if isinstance(offset, float) and not offset:
+            return value * scale
+        return value * scale + offset
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# Vectorized versions of the color, gravity and bitterness
+# formulas, which work on whole columns of values (numpy arrays
+# or sequences) at once, giving the same results as the scalar
+# functions applied to each value.
+#
+# Per-recipe values, like the total color of a grain bill or the
+# IBUs of all hop additions, are calculated from flat columns of
+# ingredients, sorted by recipe, along with segment offsets: an
+# array of n + 1 indices where the ingredients of recipe i are
+# found in values[offsets[i]:offsets[i + 1]].
+
+from functools import wraps
+
+from brewery.beerxml.formulas import bitterness, color, gravity
+from brewery.beerxml.formulas.arrays import optional_numpy, as_array
+
+np = optional_numpy()
+
+def _array(values):
+    """
+    Return values as an array of floats.
+    """
+    return as_array(values, "Vectorized formulas")
+
+#
+# Segments
+#
+
+def segment_ids(offsets):
+    """
+    Return the segment index of each value, given
+    the segment offsets.
+    """
+    offsets = np.asarray(offsets, dtype=np.intp)
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+def segment_sum(values, offsets):
+    """
+    Sum values per segment. Empty segments sum to 0.
+    """
+    values = _array(values)
+    return np.bincount(segment_ids(offsets), weights=values,
+                       minlength=len(offsets) - 1)
+
+def expand(values, offsets):
+    """
+    Repeat a per segment value for each value in the segment,
+    e.g. the batch size of a recipe for each of its hops.
+    """
+    values = _array(values)
+    return np.repeat(values, np.diff(np.asarray(offsets, dtype=np.intp)))
+
+#
+# Color and gravity
+#
+# The scalar formulas are plain arithmetic, which works on numpy
+# arrays as it is, so they are wrapped rather than rewritten. The
+# wrappers only turn their arguments into arrays first.
+# gravity.brix_to_gravity() is left out, as it is not implemented.
+
+def elementwise(func):
+    """
+    Wrap a scalar formula, so it takes anything _array() does
+    and works on each value. None arguments are passed on as is.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        args = [None if a is None else _array(a) for a in args]
+        kwargs = dict([(k, None if v is None else _array(v))
+                       for k, v in kwargs.iteritems()])
+        return func(*args, **kwargs)
+    return wrapper
+
+mcu = elementwise(color.mcu)
+srm_to_ebc = elementwise(color.srm_to_ebc)
+mosher = elementwise(color.mosher)
+daniels = elementwise(color.daniels)
+morey = elementwise(color.morey)
+
+def recipe_mcu(grain_color_lovibond, grain_weight_lbs, offsets, volume_gallons):
+    """
+    Malt Color Units of each recipe, given the color and weight
+    of all grains and the batch volume of each recipe.
+    """
+    return segment_sum(_array(grain_color_lovibond) * _array(grain_weight_lbs),
+                       offsets) / _array(volume_gallons)
+
+plato_to_gravity = elementwise(gravity.plato_to_gravity)
+gravity_to_plato = elementwise(gravity.gravity_to_plato)
+gravity_to_brix = elementwise(gravity.gravity_to_brix)
+specific_gravity = elementwise(gravity.specific_gravity)
+alcohol_by_volume = elementwise(gravity.alcohol_by_volume)
+alcohol_by_weight = elementwise(gravity.alcohol_by_weight)
+true_extract = elementwise(gravity.true_extract)
+true_attenuation = elementwise(gravity.true_attenuation)
+
+#
+# Bitterness
+#
+# The equations are inherited from the scalar classes, and work
+# on arrays as they are. Only the methods which need float() or
+# the math module are replaced.
+
+class Tinseth(bitterness.Tinseth):
+    """
+    Estimating IBUs using Tinseth's equations, on arrays.
+    """
+    def bigness_factor(self, wort_gravity):
+        return 1.65 * 0.000125 ** (_array(wort_gravity) - 1.0)
+
+    def boil_time_factor(self, time_in_minutes):
+        e = 2.71828182846
+        return (1 - e ** (-0.04 * _array(time_in_minutes))) / 4.15
+
+    def recipe_ibu(self, alpha_acid_rating, grams_of_hop, time_in_minutes,
+                   offsets, wort_gravity, batch_size_liters):
+        """
+        IBUs of each recipe, given the alpha acid rating, weight
+        and boil time of all hop additions, and the wort gravity
+        and batch size of each recipe.
+        """
+        utilization = self.alpha_acid_utilization(
+            self.bigness_factor(expand(wort_gravity, offsets)),
+            self.boil_time_factor(time_in_minutes))
+        mg_alpha_acids = self.mg_alpha_acids(_array(alpha_acid_rating),
+            _array(grams_of_hop), expand(batch_size_liters, offsets))
+        return segment_sum(self.ibu(utilization, mg_alpha_acids), offsets)
+
+
+class Rager(bitterness.Rager):
+    """
+    Estimate IBUs using Rager's equations, on arrays.
+    """
+    def utilization_percentage(self, time_in_minutes):
+        return 18.11 + 13.86 * np.tanh((_array(time_in_minutes) - 31.32) / 18.27)
+
+    def gravity_adjustment(self, boil_gravity):
+        boil_gravity = _array(boil_gravity)
+        return np.where(boil_gravity > 1.050, (boil_gravity - 1.050) / 0.2, 0.0)
+
+    def recipe_ibu(self, alpha_acid_percentage, grams_of_hop, time_in_minutes,
+                   offsets, boil_gravity, batch_size_liters):
+        """
+        IBUs of each recipe, given the alpha acid percentage, weight
+        and boil time of all hop additions, and the boil gravity
+        and batch size of each recipe.
+        """
+        return segment_sum(self.ibu(_array(grams_of_hop),
+            self.utilization_percentage(time_in_minutes),
+            _array(alpha_acid_percentage), expand(batch_size_liters, offsets),
+            self.gravity_adjustment(expand(boil_gravity, offsets))), offsets)
+
+
+class Garetz(bitterness.Garetz):
+    """
+    Estimate IBUs using Garetz' equations, on arrays.
+    """
+    def utilization_percentage(self, time_in_minutes, interpolate=False):
+        table = self.utilization_table
+        time_in_minutes = _array(time_in_minutes)
+        if interpolate:
+            return np.interp(time_in_minutes, (0.0,) + table.bounds, (0,) + table.values)
+        i = np.searchsorted(table.bounds, time_in_minutes, side="left")
+        return _array(table.values)[np.minimum(i, len(table.values) - 1)]
+
+    def recipe_ibu(self, alpha_acid_percentage, grams_of_hop, time_in_minutes,
+                   offsets, batch_size_liters, combined_adjustments, 
+                   interpolate=False):
+        """
+        IBUs of each recipe, given the alpha acid percentage, weight
+        and boil time of all hop additions, and the batch size and
+        combined adjustments of each recipe.
+        """
+        return segment_sum(self.ibu(_array(grams_of_hop),
+            self.utilization_percentage(time_in_minutes, interpolate),
+            _array(alpha_acid_percentage), expand(batch_size_liters, offsets),
+            expand(combined_adjustments, offsets)), offsets)
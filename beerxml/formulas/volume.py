@@ -1,3 +1,44 @@
 # -*- coding: utf-8 -*-
 #
-#
\ No newline at end of file
+# Volume conversions, for the volume units of BeerXML (tsp, tblsp,
+# oz, cup, pt, qt, ml and l, all US units), along with US and
+# imperial gallons and the imperial pint, quart and fluid ounce.
+# BeerXML records store all volumes in liters.
+#
+# Values may be numbers or numpy arrays, see units.ConversionTable.
+
+from brewery.beerxml.formulas.units import ConversionTable
+
+# Liters per unit
+UNITS = ConversionTable({
+    "l": 1.0,
+    "ml": 0.001,
+    "tsp": 0.00492892159375,
+    "tblsp": 0.01478676478125,
+    "oz": 0.0295735295625,
+    "cup": 0.2365882365,
+    "pt": 0.473176473,
+    "qt": 0.946352946,
+    "gal": 3.785411784,
+    "imp oz": 0.0284130625,
+    "imp pt": 0.56826125,
+    "imp qt": 1.1365225,
+    "imp gal": 4.54609,
+})
+
+# Units for each RecipeOption.VOLUME choice, for batch
+# sizes and for small amounts like water additions.
+SYSTEM_UNITS = {0: "l", 1: "gal", 2: "imp gal"}
+SYSTEM_SMALL_UNITS = {0: "ml", 1: "oz", 2: "imp oz"}
+
+def convert(value, from_unit, to_unit):
+    """
+    Convert value from from_unit to to_unit.
+    """
+    return UNITS.convert(value, from_unit, to_unit)
+
+def liters_to_gallons(liters):
+    return UNITS.convert(liters, "l", "gal")
+
+def gallons_to_liters(gallons):
+    return UNITS.convert(gallons, "gal", "l")
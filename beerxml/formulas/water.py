@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+#
+# References:
+# http://howtobrew.com/section3/chapter15-3.html
+# http://www.brewersfriend.com/water-chemistry/
+#
+# Water chemistry: blending waters, adding brewing salts and
+# finding the blend or the salt additions which come closest to
+# a target water profile.
+#
+# A water profile is a vector of the ion concentrations in IONS,
+# in parts per million (mg/l), and a set of waters is a matrix
+# with a profile per row. Blending is then a matrix product of the
+# volume fractions with the profiles, and the ions added by salts
+# a matrix product of the grams per liter with SALTS_MATRIX, whose
+# rows are worked out from the molar masses of the salts.
+#
+# Target matching is a least squares problem with bounds (blend
+# fractions between 0 and 1 summing to 1, salt amounts between 0
+# and a maximum), solved by accelerated projected gradient descent.
+# The solvers take a batch of problems sharing the same matrix at
+# once.
+
+from brewery.beerxml.formulas.arrays import optional_numpy, as_array
+
+np = optional_numpy()
+
+IONS = ("calcium", "magnesium", "sodium", "sulfate", "chloride", "bicarbonate")
+
+ATOMIC_MASS = {
+    "H": 1.008, "C": 12.011, "O": 15.999, "Na": 22.98977, "Mg": 24.305,
+    "S": 32.065, "Cl": 35.453, "Ca": 40.078,
+}
+
+# Composition of the ions, by element
+ION_ELEMENTS = {
+    "calcium": {"Ca": 1},
+    "magnesium": {"Mg": 1},
+    "sodium": {"Na": 1},
+    "sulfate": {"S": 1, "O": 4},
+    "chloride": {"Cl": 1},
+    "bicarbonate": {"H": 1, "C": 1, "O": 3},
+}
+
+# Composition of the salts, by element, and the number of each
+# ion they give when dissolved. Chalk is counted as giving two
+# bicarbonate ions, as it only dissolves in water with carbon
+# dioxide (CaCO3 + CO2 + H2O -> Ca + 2 HCO3).
+SALTS = {
+    "gypsum": ({"Ca": 1, "S": 1, "O": 6, "H": 4}, {"calcium": 1, "sulfate": 1}),
+    "calcium chloride": ({"Ca": 1, "Cl": 2, "H": 4, "O": 2}, {"calcium": 1, "chloride": 2}),
+    "epsom salt": ({"Mg": 1, "S": 1, "O": 11, "H": 14}, {"magnesium": 1, "sulfate": 1}),
+    "magnesium chloride": ({"Mg": 1, "Cl": 2, "H": 12, "O": 6},
+                           {"magnesium": 1, "chloride": 2}),
+    "table salt": ({"Na": 1, "Cl": 1}, {"sodium": 1, "chloride": 1}),
+    "baking soda": ({"Na": 1, "H": 1, "C": 1, "O": 3}, {"sodium": 1, "bicarbonate": 1}),
+    "chalk": ({"Ca": 1, "C": 1, "O": 3}, {"calcium": 1, "bicarbonate": 2}),
+}
+SALT_NAMES = tuple(sorted(SALTS))
+
+def molar_mass(elements):
+    """
+    Return the molar mass of a compound, given as a
+    dict of the number of atoms of each element.
+    """
+    return sum(ATOMIC_MASS[e] * n for e, n in elements.iteritems())
+
+def salt_ppm(salt):
+    """
+    Return the parts per million of each ion in IONS given
+    by one gram of salt per liter of water.
+    """
+    elements, ions = SALTS[salt]
+    mass = molar_mass(elements)
+    return [1000 * molar_mass(ION_ELEMENTS[ion]) * ions.get(ion, 0) / mass
+            for ion in IONS]
+
+def _array(values):
+    return as_array(values, "Water chemistry")
+
+# Parts per million of each ion per gram of each salt per liter,
+# a row per salt in SALT_NAMES
+SALTS_MATRIX = _array([salt_ppm(s) for s in SALT_NAMES]) if np is not None else None
+
+def blend(profiles, volumes):
+    """
+    Return the profile of a blend of waters with the given profiles
+    (a row per water) and volumes. With a matrix of volumes (a row
+    per blend), returns a profile for each blend.
+    """
+    volumes = _array(volumes)
+    totals = volumes.sum(axis=-1)
+    return volumes.dot(_array(profiles)) / np.expand_dims(totals, -1)
+
+def add_salts(profile, grams, volume):
+    """
+    Return the profile of volume liters of water with the profile
+    profile, after adding grams of each salt in SALT_NAMES. Works on
+    a row of profiles, grams and volumes at once too.
+    """
+    grams_per_liter = _array(grams) / np.expand_dims(_array(volume), -1)
+    return _array(profile) + grams_per_liter.dot(SALTS_MATRIX)
+
+def project_simplex(x):
+    """
+    Return the nearest points to the rows of x which have no
+    negative values and sum to 1.
+    """
+    x = np.atleast_2d(x)
+    n = x.shape[1]
+    u = -np.sort(-x, axis=1)
+    cumulative = np.cumsum(u, axis=1) - 1
+    index = np.arange(1, n + 1)
+    # The number of values which stay positive
+    count = (u - cumulative / index > 0).sum(axis=1)
+    theta = cumulative[np.arange(len(x)), count - 1] / count
+    return np.maximum(x - theta[:, np.newaxis], 0)
+
+def _weights(weights):
+    if weights is None:
+        return np.ones(len(IONS))
+    return _array(weights)
+
+def least_squares(matrix, targets, project, start, weights=None, iterations=1000,
+                  tolerance=1e-9):
+    """
+    Minimize ||(x matrix - target) * weights||^2 for each row of
+    targets, by accelerated projected gradient descent (FISTA).
+    project maps the rows of x onto the allowed values, and start
+    is the first guess. The step size is 1/L, where L is the
+    Lipschitz constant of the gradient (twice the squared spectral
+    norm of the weighted matrix). Returns the rows of x.
+    """
+    weights = _weights(weights)
+    a = _array(matrix) * weights
+    b = np.atleast_2d(_array(targets)) * weights
+    gram, ab = a.dot(a.T), b.dot(a.T)
+    step = 1.0 / (2 * np.linalg.norm(a, 2) ** 2 or 1.0)
+    x = y = project(np.atleast_2d(_array(start)))
+    t = 1.0
+    for i in xrange(iterations):
+        new = project(y - step * 2 * (y.dot(gram) - ab))
+        change = np.abs(new - x).max()
+        t, previous = (1 + (1 + 4 * t * t) ** 0.5) / 2, t
+        y = new + (previous - 1) / t * (new - x)
+        x = new
+        if change < tolerance:
+            break
+    return x
+
+def match_blend(profiles, targets, weights=None, iterations=1000):
+    """
+    Return the volume fractions of the waters with the given
+    profiles whose blend comes closest to each target profile.
+    weights is the importance of each ion, all equal by default.
+    """
+    profiles = _array(profiles)
+    targets = np.atleast_2d(_array(targets))
+    start = np.ones((len(targets), len(profiles))) / len(profiles)
+    return least_squares(profiles, targets, project_simplex, start, weights, iterations)
+
+def match_salts(profiles, targets, volume, max_grams=None, weights=None,
+                iterations=1000):
+    """
+    Return the grams of each salt in SALT_NAMES to add to volume
+    liters of water with each profile in profiles, to come closest
+    to the matching target profile. Salts can only be added, so
+    ions which are above the target are left there. max_grams
+    limits the amount of each salt, per liter of water.
+    """
+    profiles = np.atleast_2d(_array(profiles))
+    deficits = np.atleast_2d(_array(targets)) - profiles
+    if max_grams is None:
+        upper = np.inf
+    else:
+        upper = _array(max_grams)
+    project = lambda x: np.clip(x, 0, upper)
+    start = np.zeros((len(deficits), len(SALT_NAMES)))
+    grams_per_liter = least_squares(SALTS_MATRIX, deficits, project, start,
+                                    weights, iterations)
+    return grams_per_liter * np.expand_dims(_array(volume), -1)
+
+def best_pair_ratios(first, second, targets, weights=None):
+    """
+    Return the fraction of the first water which brings each blend
+    of two waters closest to the target, for rows of first and
+    second profiles and targets. With two waters the least squares
+    solution has a closed form, so any number of pairs is one pass.
+    """
+    weights = _weights(weights)
+    first, second = _array(first) * weights, _array(second) * weights
+    difference = first - second
+    targets = _array(targets) * weights
+    squared = (difference * difference).sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = ((targets - second) * difference).sum(axis=-1) / squared
+    return np.clip(np.nan_to_num(ratio), 0, 1)
+
+def distance(profiles, targets, weights=None):
+    """
+    Return the (weighted) distance in parts per million between
+    each profile and target.
+    """
+    difference = (_array(profiles) - _array(targets)) * _weights(weights)
+    return np.sqrt((difference * difference).sum(axis=-1))
+
+def pairwise_distances(profiles, targets, weights=None):
+    """
+    Return the matrix of (weighted) distances between each profile
+    (rows) and each target (columns).
+    """
+    weights = _weights(weights)
+    a, b = _array(profiles) * weights, _array(targets) * weights
+    squared = (a * a).sum(axis=1)[:, np.newaxis] + (b * b).sum(axis=1) - 2 * a.dot(b.T)
+    return np.sqrt(np.maximum(squared, 0))
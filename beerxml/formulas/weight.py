@@ -1,3 +1,39 @@
 # -*- coding: utf-8 -*-
 #
-#
\ No newline at end of file
+# Weight conversions, for the weight units of BeerXML (kg, g,
+# oz and lb). BeerXML records store all weights in kilograms.
+#
+# Values may be numbers or numpy arrays, see units.ConversionTable.
+
+from brewery.beerxml.formulas.units import ConversionTable
+
+# Kilograms per unit
+UNITS = ConversionTable({
+    "kg": 1.0,
+    "g": 0.001,
+    "oz": 0.028349523125,
+    "lb": 0.45359237,
+})
+
+# Units for each RecipeOption.WEIGHT choice, for grains
+# and for small amounts like hops and spices.
+SYSTEM_UNITS = {0: "kg", 1: "lb", 2: "lb"}
+SYSTEM_SMALL_UNITS = {0: "g", 1: "oz", 2: "oz"}
+
+def convert(value, from_unit, to_unit):
+    """
+    Convert value from from_unit to to_unit.
+    """
+    return UNITS.convert(value, from_unit, to_unit)
+
+def kilograms_to_pounds(kilograms):
+    return UNITS.convert(kilograms, "kg", "lb")
+
+def pounds_to_kilograms(pounds):
+    return UNITS.convert(pounds, "lb", "kg")
+
+def grams_to_ounces(grams):
+    return UNITS.convert(grams, "g", "oz")
+
+def ounces_to_grams(ounces):
+    return UNITS.convert(ounces, "oz", "g")
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+#
+# Loading whole recipe graphs, for rendering and export.
+#
+# Rendering a recipe touches its style, equipment, mash profile and
+# mash steps, ingredients, options and stats. Done one attribute at
+# a time that is a query per relation per recipe. with_graph()
+# joins in the foreign keys and one-to-one relations, and prefetches
+# each many-to-many relation with one query for all recipes, so any
+# number of recipes is loaded with at most GRAPH_QUERIES queries.
+#
+# recipe_graphs() turns the loaded recipes into records: namedtuples
+# of the field values of each object, with records (or tuples of
+# records) in place of the relations of the graph. Records take
+# less memory than model instances, can not be changed and never
+# go back to the database, so code rendering them can not cause a
+# query per recipe by accident. Relations outside the graph, like
+# registered_by, are left as their ids.
+#
+# Mash steps are read in the order they were added to the mash
+# profile, the order of the rows of the many-to-many table. Both
+# with_graph() and recipe_graphs() read them with _mash_steps(), as
+# prefetch_related() would give them in the default MashStep order.
+
+from collections import namedtuple
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils.encoding import force_unicode
+
+GRAPH_SELECT = ("style", "equipment", "mash", "recipeoption", "stats")
+GRAPH_PREFETCH = ("hops", "fermentables", "miscs", "yeasts", "waters", "mash__mash_steps")
+
+# The recipes, one per prefetched relation and one for the mash steps
+GRAPH_QUERIES = 1 + len(GRAPH_PREFETCH)
+
+# The relations left to prefetch_related(), see _mash_steps()
+_prefetch = [name for name in GRAPH_PREFETCH if name != "mash__mash_steps"]
+
+_record_types = {}
+
+def _tree(lookups):
+    """
+    Turn lookups like "mash__mash_steps" into a tree
+    of dicts, {"mash": {"mash_steps": {}}}.
+    """
+    tree = {}
+    for lookup in lookups:
+        node = tree
+        for name in lookup.split("__"):
+            node = node.setdefault(name, {})
+    return tree
+
+GRAPH = _tree(GRAPH_SELECT + GRAPH_PREFETCH)
+
+
+class RecordMixin(object):
+    """
+    Methods of the record types.
+    """
+    __slots__ = ()
+
+    def display(self, name):
+        """
+        Return the display value of a field with
+        choices, like get_FOO_display() does.
+        """
+        value = getattr(self, name)
+        return force_unicode(self._choices[name].get(value, value), strings_only=True)
+
+
+def record_type(model, relations=()):
+    """
+    Return the namedtuple type of the records of model, which has
+    a field for each field of model, and each name in relations.
+    Types are built once per model and relations.
+    """
+    key = (model, tuple(sorted(relations)))
+    try:
+        return _record_types[key]
+    except KeyError:
+        pass
+
+    fields = model._meta.fields
+    names = [f.attname for f in fields]
+    names.extend([name for name in key[1] if not name in names])
+    base = namedtuple("%sRecord" % model.__name__, names)
+    cls = type(base.__name__, (RecordMixin, base), {
+        "__slots__": (),
+        "model": model,
+        "_choices": dict([(f.name, dict(f.flatchoices)) for f in fields if f.choices]),
+    })
+    _record_types[key] = cls
+    return cls
+
+def to_record(obj, relations, related=None):
+    """
+    Return the record of a model instance, with the relations in the
+    tree relations followed (see _tree()). Those must be loaded
+    already, or they will be read from the database. related maps
+    (model, pk, name) keys to lists of objects to use for a
+    many-to-many relation instead of reading it from obj.
+    """
+    model = obj.__class__
+    values = [getattr(obj, f.attname) for f in model._meta.fields]
+    for name in sorted(relations):
+        key = (model, obj.pk, name)
+        if related is not None and key in related:
+            value = related[key]
+        else:
+            try:
+                value = getattr(obj, name)
+            except ObjectDoesNotExist:
+                value = None
+            if hasattr(value, "all"):
+                value = list(value.all())
+        if isinstance(value, list):
+            values.append(tuple([to_record(o, relations[name], related) for o in value]))
+        elif value is not None:
+            values.append(to_record(value, relations[name], related))
+        else:
+            values.append(None)
+    return record_type(model, relations)(*values)
+
+def _mash_steps(recipes):
+    """
+    Read the mash steps of the mash profiles of recipes in one
+    query, in the order they were added. Returns a dict of
+    (MashProfile, pk, "mash_steps") keys to lists of steps.
+    """
+    from brewery.models import MashProfile
+    through = MashProfile.mash_steps.through
+    profiles = set([r.mash_id for r in recipes if r.mash_id is not None])
+    steps = dict([((MashProfile, pk, "mash_steps"), []) for pk in profiles])
+    if profiles:
+        rows = through.objects.filter(mashprofile__in=profiles) \
+                              .select_related("mashstep").order_by("pk")
+        for row in rows:
+            steps[(MashProfile, row.mashprofile_id, "mash_steps")].append(row.mashstep)
+    return steps
+
+def attach_mash_steps(recipes):
+    """
+    Load the mash steps of the mash profiles of recipes, loaded
+    with select_related("mash"), in one query, and keep them the
+    way prefetch_related() does, so mash.mash_steps.all() returns
+    them in the order they were added without another query.
+    """
+    from brewery.models import MashProfile
+    steps = _mash_steps(recipes)
+    for recipe in recipes:
+        if recipe.mash_id is None:
+            continue
+        mash = recipe.mash
+        queryset = mash.mash_steps.all()
+        queryset._result_cache = steps[(MashProfile, mash.pk, "mash_steps")]
+        queryset._prefetch_done = True
+        mash.__dict__.setdefault("_prefetched_objects_cache", {})["mash_steps"] = queryset
+
+def with_graph(queryset):
+    """
+    Return queryset, a RecipeQuerySet, with the whole
+    recipe graph loaded along with each recipe.
+    """
+    queryset = queryset.select_related(*GRAPH_SELECT).prefetch_related(*_prefetch)
+    queryset._with_mash_steps = True
+    return queryset
+
+def recipe_graphs(queryset):
+    """
+    Load the recipes in queryset, typically a page of recipes, as
+    records with their whole graph, with at most GRAPH_QUERIES
+    queries.
+    """
+    recipes = list(queryset.select_related(*GRAPH_SELECT).prefetch_related(*_prefetch))
+    related = _mash_steps(recipes)
+    return [to_record(recipe, GRAPH, related) for recipe in recipes]
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+# Bulk import of BeerXML files.
+#
+# Parsing and type conversion is CPU bound, so files are parsed
+# in a pool of worker processes. The resulting nodes are sent back
+# to the calling process, which is the only one talking to the
+# database, and saved one file at a time as they arrive.
+
+import os
+import time
+import itertools
+import multiprocessing
+
+from brewery.beerxml import parser
+from brewery.beerxml.bulk import bulk_get_or_create
+from brewery.beerxml.error import BeerXMLError
+
+class IngestResult(object):
+    """
+    The outcome of importing a single file.
+    """
+
+    def __init__(self, path, nodes=0, objects=None, error=None):
+        self.path = path
+        self.nodes = nodes
+        self.objects = objects or []
+        self.error = error
+
+    @property
+    def success(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.success:
+            return "<IngestResult: %s (%d nodes)>" % (self.path, self.nodes)
+        return "<IngestResult: %s (failed)>" % self.path
+
+
+class IngestReport(object):
+    """
+    Collects the results of a bulk import, and
+    keeps track of the throughput.
+    """
+
+    def __init__(self):
+        self.results = []
+        self.elapsed = 0.0
+
+    def add(self, result):
+        self.results.append(result)
+
+    @property
+    def succeeded(self):
+        return [r for r in self.results if r.success]
+
+    @property
+    def failed(self):
+        return [r for r in self.results if not r.success]
+
+    @property
+    def nodes(self):
+        return sum(r.nodes for r in self.succeeded)
+
+    @property
+    def files_per_second(self):
+        return len(self.results) / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def nodes_per_second(self):
+        return self.nodes / self.elapsed if self.elapsed else 0.0
+
+
+def find_files(paths, extension=".xml"):
+    """
+    Expand a list of files and directories to a sorted
+    list of files. Directories are searched recursively
+    for files ending with extension.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                files.extend([os.path.join(dirpath, f) for f in filenames
+                              if f.lower().endswith(extension)])
+        else:
+            files.append(path)
+    return sorted(files)
+
+def parse_file(path):
+    """
+    Parse a BeerXML file to a list of BeerXMLNodes. This
+    runs in the worker processes, so errors are returned
+    instead of raised. Returns a (path, nodes, error) tuple.
+    """
+    try:
+        return path, list(parser.iter_beerxml(path=path)), None
+    except Exception, e:
+        return path, None, "%s: %s" % (e.__class__.__name__, e)
+
+def ingest(paths, processes=None, chunksize=1, callback=None, **kwargs):
+    """
+    Import all BeerXML files found in paths, which may be
+    files or directories.
+
+    Files are parsed in a pool of processes (defaults to the
+    number of cpus, use processes=1 to parse in this process), while
+    saving is done here, with each file in its own transaction.
+    kwargs are passed on to bulk_get_or_create(), so
+    inherit={"registered_by": user} works as usual.
+
+    callback, if given, is called with each IngestResult as
+    soon as the file has been saved. Returns an IngestReport.
+    """
+    files = find_files(paths)
+    report = IngestReport()
+    start = time.time()
+
+    pool = None
+    if processes == 1 or len(files) < 2:
+        results = itertools.imap(parse_file, files)
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(parse_file, files, chunksize)
+
+    try:
+        for path, nodes, error in results:
+            result = IngestResult(path, error=error)
+            if error is None:
+                try:
+                    result.objects = save_nodes(nodes, **kwargs)
+                    result.nodes = len(nodes)
+                except BeerXMLError, e:
+                    result.error = "%s: %s" % (e.__class__.__name__, e)
+            report.add(result)
+            if callback is not None:
+                callback(result)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    report.elapsed = time.time() - start
+    return report
+
+def save_nodes(nodes, **kwargs):
+    """
+    Save a list of nodes to database in a single transaction.
+    Returns the list of saved model instances.
+    """
+    return [obj for obj, created in bulk_get_or_create(nodes, **kwargs)]
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Mash schedules of recipes: the strike and infusion temperatures
+# of the steps of a recipe's mash profile, worked out with the heat
+# balance formulas of formulas.mash from the weight of the mashed
+# fermentables. mash_schedule() runs the schedule of one recipe,
+# while check_mashes() runs the schedules of a chunk of recipes at
+# a time with numpy, to find stored temperatures which are off.
+
+from brewery.models import Recipe, MashProfile
+from brewery.beerxml import display
+from brewery.beerxml.calculations import MASHED
+from brewery.beerxml.formulas import mash
+from brewery.beerxml.queries import CHUNK_SIZE, ingredient_rows, to_float
+
+def _mash_steps(profiles):
+    """
+    Return the (step pk, type, temperature, infusion amount, infusion
+    temperature) of the steps of the mash profiles in profiles (a
+    queryset or a list of pks), grouped by profile, in the order
+    they were added to the profile.
+    """
+    field = MashProfile._meta.get_field("mash_steps")
+    source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+    steps = {}
+    for row in field.rel.through.objects.filter(**{"%s__in" % source: profiles}) \
+            .order_by("pk").values_list("%s_id" % source, "%s_id" % target,
+            *["%s__%s" % (target, v) for v in ("mash_type", "step_temp",
+                                               "infuse_amount", "infuse_temp")]):
+        steps.setdefault(row[0], []).append(row[1:])
+    return steps
+
+def _grain_weight(fermentables):
+    return sum(to_float(amount) for amount, ferm_type in fermentables if ferm_type in MASHED)
+
+def mash_schedule(recipe):
+    """
+    Run through the mash schedule of a recipe (a Recipe or its pk),
+    with the weight of its mashed fermentables. Returns a list of
+    (MashStep pk, formulas.mash.MashStepResult) tuples, which is
+    empty if the recipe has no mash profile.
+    """
+    pk = recipe.pk if isinstance(recipe, Recipe) else recipe
+    recipes = Recipe.objects.filter(pk=pk, mash__isnull=False)
+    row = list(recipes.values_list("mash", "mash__grain_temp", "mash__tun_temp",
+        "mash__tun_weight", "mash__tun_specific_heat", "mash__equip_adjust"))
+    if not row:
+        return []
+    profile, grain_temp, tun_temp, tun_weight, tun_specific_heat, equip_adjust = row[0]
+    steps = _mash_steps([profile]).get(profile, [])
+    grain_weight = _grain_weight(ingredient_rows(recipes, "fermentables", "amount", "ferm_type")
+                                 .get(pk, []))
+    results = mash.schedule(grain_weight, [s[1:4] for s in steps], grain_temp,
+                            tun_temp, tun_weight, tun_specific_heat, equip_adjust)
+    return zip([s[0] for s in steps], results)
+
+def check_mashes(queryset, tolerance=1.0, chunk_size=CHUNK_SIZE):
+    """
+    Compare the infusion temperatures stored in the mash steps of the
+    recipes in queryset with the calculated ones, running the mash
+    schedules of a chunk of recipes at a time with numpy. Yields
+    (recipe pk, MashStep pk, stored, calculated) tuples, in degrees
+    Celsius, for the steps which differ by more than tolerance.
+    Steps without a stored or calculated temperature are skipped.
+    """
+    queryset = queryset.filter(mash__isnull=False)
+    last = None
+    while True:
+        recipes = queryset.order_by("pk")
+        if last is not None:
+            recipes = recipes.filter(pk__gt=last)
+        recipes = list(recipes.values_list("pk", "mash", "mash__grain_temp",
+            "mash__tun_temp", "mash__tun_weight", "mash__tun_specific_heat",
+            "mash__equip_adjust")[:chunk_size])
+        if not recipes:
+            break
+        chunk = queryset.filter(pk__gte=recipes[0][0], pk__lte=recipes[-1][0])
+        fermentables = ingredient_rows(chunk, "fermentables", "amount", "ferm_type")
+        steps = _mash_steps(set([r[1] for r in recipes]))
+
+        grain_weights, grain_temps, tun_temps, tuns, offsets = [], [], [], [], [0]
+        flat = []   # (recipe pk, step)
+        for pk, profile, grain_temp, tun_temp, tun_weight, tun_specific_heat, \
+                equip_adjust in recipes:
+            grain_weights.append(_grain_weight(fermentables.get(pk, [])))
+            grain_temps.append(to_float(grain_temp, mash.DEFAULT_GRAIN_TEMP))
+            tun_temps.append(to_float(tun_temp, grain_temps[-1]))
+            tuns.append(to_float(tun_weight) * to_float(tun_specific_heat)
+                        if equip_adjust else 0.0)
+            flat.extend([(pk, step) for step in steps.get(profile, [])])
+            offsets.append(len(flat))
+        types = [(step[1] or mash.INFUSION).lower() for pk, step in flat]
+        results = mash.schedule_many(grain_weights, grain_temps, tun_temps, tuns,
+            [mash.STEP_TYPES.index(t) if t in mash.STEP_TYPES else 0 for t in types],
+            [to_float(step[2]) for pk, step in flat],
+            [to_float(step[3]) for pk, step in flat], offsets)
+
+        for (pk, step), calculated in zip(flat, results["infuse_temp"].tolist()):
+            stored = display.convert(step[4], "C", "temperature")
+            if not stored or calculated != calculated:
+                continue
+            if abs(stored - calculated) > tolerance:
+                yield pk, step[0], stored, calculated
+        if len(recipes) < chunk_size:
+            break
+        last = recipes[-1][0]
@@ -5,7 +5,7 @@ from brewery.beerxml.error import BeerXMLError, BeerXMLValidationError
 from django.utils.encoding import smart_str
 from django.db.models.base import Model
 from django.db.models.loading import get_model
-from django.db.models.fields import FieldDoesNotExist
+from django.db.models.fields import BooleanField, NullBooleanField
 from django.db.models.fields.related import ManyToOneRel, ManyToManyRel
 from django.core.exceptions import ValidationError
 
@@ -23,13 +23,169 @@ NODENAMES = {
     "RECIPE"      : "Recipe"
 }
 
+# Relation kinds in a conversion plan
+MANY_TO_ONE = "many_to_one"
+MANY_TO_MANY = "many_to_many"
+
+# BeerXML booleans, as understood by BooleanField.to_python()
+BOOLEANS = {"TRUE": "True", "FALSE": "False"}
+
+# Registry of resolved models, conversion plans and relation
+# fields. Resolving these through the app cache and the model
+# options for every node (or every value) is expensive, so
+# each is looked up once and kept here.
+_models = {}
+_conversion_plans = {}
+_relation_fields = {}
+
+def get_node_model(name):
+    """
+    Return the brewery model for the BeerXML tag name.
+    """
+    try:
+        return _models[name]
+    except KeyError:
+        pass
+    
+    try:
+        model = get_model("brewery", NODENAMES[name]) or None
+    except KeyError, e:
+        raise BeerXMLValidationError("%s is not a valid BeerXML tag" % e.args[0])
+    if model is None:
+        raise BeerXMLValidationError("Could not find model: %s" % name) 
+    _models[name] = model
+    return model
+
+def get_relation_fields(model, field_type):
+    """
+    Return the set of field names on model which
+    have a relation of type field_type.
+    """
+    try:
+        return _relation_fields[(model, field_type)]
+    except KeyError:
+        pass
+    
+    opts = model._meta
+    fields = frozenset([f.name for f in opts.fields + opts.many_to_many
+                        if isinstance(f.rel, field_type)])
+    _relation_fields[(model, field_type)] = fields
+    return fields
+
+def clear_registry():
+    """
+    Forget all resolved models, conversion plans and
+    relation fields, e.g. after models have been changed
+    in tests.
+    """
+    _models.clear()
+    _conversion_plans.clear()
+    _relation_fields.clear()
+
+def _boolean_converter(field):
+    def convert(value):
+        return field.to_python(BOOLEANS.get(value, value))
+    return convert
+
+def get_conversion_plan(model):
+    """
+    Return the conversion plan for model, which is a dict mapping
+    lower case BeerXML tags to (field name, converter, relation) tuples.
+    
+    The converter is the to_python() method of the field (with
+    TRUE/FALSE mapped to values it understands for boolean fields),
+    or None for relations, which have relation set to MANY_TO_ONE or
+    MANY_TO_MANY. Tags listed in the model's _beerxml_attrs are mapped
+    to their field. Plans are built once per model.
+    """
+    try:
+        return _conversion_plans[model]
+    except KeyError:
+        pass
+    
+    plan = {}
+    opts = model._meta
+    for field in opts.fields + opts.many_to_many:
+        converter, relation = field.to_python, None
+        if isinstance(field.rel, ManyToOneRel):
+            converter, relation = None, MANY_TO_ONE
+        elif isinstance(field.rel, ManyToManyRel):
+            converter, relation = None, MANY_TO_MANY
+        elif isinstance(field, (BooleanField, NullBooleanField)):
+            converter = _boolean_converter(field)
+        plan[field.name] = (field.name, converter, relation)
+    
+    for tag, name in getattr(model, "_beerxml_attrs", {}).iteritems():
+        if name in plan:
+            plan[tag] = plan[name]
+    
+    _conversion_plans[model] = plan
+    return plan
+
+def _convert(key, value, converter, relation, lazy=False):
+    """
+    Convert a raw BeerXML value using an entry from a
+    conversion plan. Related records become BeerXMLNodes.
+    """
+    try:
+        if converter is not None:
+            return converter(value)
+        if relation is MANY_TO_ONE:
+            return BeerXMLNode(key, value, lazy=lazy)
+        values = []
+        if value:
+            for node in value:
+                for k, v in node.iteritems():
+                    values.append(BeerXMLNode(k, v, lazy=lazy))
+        return values
+    except ValidationError, e:
+        raise BeerXMLValidationError(e)
+    except BeerXMLError:
+        raise
+    except Exception, e:
+        raise BeerXMLError(e)
+
+def _restore_node(cls, name, items):
+    """
+    Recreate a pickled node without converting its values again.
+    """
+    node = dict.__new__(cls)
+    dict.update(node, items)
+    node.__name__ = name
+    node._pending = None
+    return node
+
+def _resolving(method):
+    """
+    Wrap a dict method, so that all pending values
+    of a lazy node are converted before it is called.
+    """
+    def wrapper(self, *args, **kwargs):
+        if self._pending:
+            self.resolve()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
 class BeerXMLNode(dict):
     """
     This class is used to map an xml node
     to a brewery model.
+    
+    Values are only stored in the dict itself, and the node has
+    no instance __dict__, which keeps large numbers of parsed nodes
+    cheap to hold in memory. Values can still be read as attributes.
+    
+    A lazy node keeps the raw BeerXML values, and converts each
+    value (or builds the related nodes) the first time it is read.
+    Note that dict(node) copies the raw values of a lazy node, call
+    resolve() first if converted values are needed.
     """
+    
+    __slots__ = ("__name__", "_pending")
 
-    def __init__(self, name, attrs):
+    def __init__(self, name, attrs, lazy=False):
         """
         Convert values to correct python data type,
         and update naming conventions.
@@ -37,6 +193,8 @@ class BeerXMLNode(dict):
         If model has some naming conventions which differs from
         XML element tags, these should be listed in the _beerxml_attrs
         dictionary attribute of the model.
+        
+        If lazy is True, values are converted on first access instead.
         """
         
         super(BeerXMLNode, self).__init__()
@@ -44,47 +202,91 @@ class BeerXMLNode(dict):
             "attrs must be a dict of attributes"
         
         self.__name__ = name.upper()    # Always use upper case naming
-        defaults = attrs.copy()
-        for key, value in defaults.iteritems():
-            # Switch names with model attribute names
-            model_name = key = key.lower()
-            if hasattr(self._model, "_beerxml_attrs"):
-                key = self._model._beerxml_attrs.get(model_name, key)
-            
-            # Update boolean field names to a value
-            # to_python() can deal with
-            if value in ("TRUE", "FALSE"):
-                if value == "TRUE":
-                    value = "True"
-                else:
-                    value = "False"
-            
+        self._pending = None
+        plan = get_conversion_plan(self._model)
+        pending = {}
+        for key, value in attrs.iteritems():
             try:
-                field = self._model._meta.get_field(key)
-                value = field.to_python(value)
-                if isinstance(field.rel, ManyToOneRel):
-                    value = BeerXMLNode(field.name, value)
-                if isinstance(field.rel, ManyToManyRel):
-                    values = []
-                    if value:
-                        for node in value:
-                            for k, v in node.iteritems():
-                                values.append(BeerXMLNode(k, v))
-                    value = values
-                self.update({key: value})   # update dict
-                setattr(self, key, value)   # set as attribute
-            except FieldDoesNotExist:
+                key, converter, relation = plan[key.lower()]
+            except KeyError:
                 # If field not does not exist on model,
                 # continue to next
                 continue
-            except ValidationError, e:
-                raise BeerXMLValidationError(e)
-            except Exception, e:
-                raise BeerXMLError(e)
-        
-        # Cache up related fields to save some iterations on save
-        self.many_to_many = list(self.iter_field_type(ManyToManyRel))
-        self.many_to_one = list(self.iter_field_type(ManyToOneRel))
+            
+            if lazy:
+                pending[key] = (converter, relation)
+            else:
+                value = _convert(key, value, converter, relation)
+            dict.__setitem__(self, key, value)
+        self._pending = pending or None
+    
+    def _resolve(self, key):
+        """
+        Convert the pending value of key, and return it.
+        """
+        converter, relation = self._pending.pop(key)
+        value = _convert(key, dict.__getitem__(self, key), converter, 
+                         relation, lazy=True)
+        dict.__setitem__(self, key, value)
+        return value
+    
+    def resolve(self):
+        """
+        Convert all pending values of a lazy node.
+        Related nodes are converted when they are read.
+        """
+        if self._pending:
+            for key in self._pending.keys():
+                if key in self:
+                    self._resolve(key)
+        self._pending = None
+    
+    def __getitem__(self, key):
+        if self._pending and key in self._pending:
+            return self._resolve(key)
+        return dict.__getitem__(self, key)
+    
+    def get(self, key, default=None):
+        if self._pending and key in self._pending:
+            return self._resolve(key)
+        return dict.get(self, key, default)
+    
+    def __setitem__(self, key, value):
+        if self._pending:
+            self._pending.pop(key, None)
+        dict.__setitem__(self, key, value)
+    
+    # Methods reading or replacing many values at once
+    # convert everything that is still pending first.
+    items = _resolving(dict.items)
+    iteritems = _resolving(dict.iteritems)
+    values = _resolving(dict.values)
+    itervalues = _resolving(dict.itervalues)
+    copy = _resolving(dict.copy)
+    pop = _resolving(dict.pop)
+    popitem = _resolving(dict.popitem)
+    setdefault = _resolving(dict.setdefault)
+    update = _resolving(dict.update)
+    __delitem__ = _resolving(dict.__delitem__)
+    
+    def __eq__(self, other):
+        self.resolve()
+        if isinstance(other, BeerXMLNode):
+            other.resolve()
+        return dict.__eq__(self, other)
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+    
+    def __reduce__(self):
+        self.resolve()
+        return (_restore_node, (self.__class__, self.__name__, dict(self)))
     
     def __repr__(self):
         # Shamelessly copied from django
@@ -98,25 +300,27 @@ class BeerXMLNode(dict):
         """
         Return the corresponding model for node
         """
-        try:
-            model = get_model("brewery", NODENAMES[self.__name__]) or None
-            if model is None:
-                raise BeerXMLValidationError("Could not find model: %s" % self.__name__) 
-            return model
-        except KeyError, e:
-            raise BeerXMLValidationError("%s is not a valid BeerXML tag" % e.args[0])
+        return get_node_model(self.__name__)
     _model = property(_get_node_model)
     
+    @property
+    def many_to_many(self):
+        return list(self.iter_field_type(ManyToManyRel))
+    
+    @property
+    def many_to_one(self):
+        return list(self.iter_field_type(ManyToOneRel))
+    
     def iter_field_type(self, field_type):
         """
         Iterates over a node, yielding all fields
         which match field_type in a key, value paired
         dict.
         """
+        fields = get_relation_fields(self._model, field_type)
         for key in self.iterkeys():
-            field = self._model._meta.get_field(key)
-            if isinstance(field.rel, field_type):
-                yield {key: self.get(field.name)}
+            if key in fields:
+                yield {key: self[key]}
     
     def get_or_create(self, **kwargs):
         """
@@ -129,11 +333,40 @@ class BeerXMLNode(dict):
             __fields__. This "should" be able to save to model
             TODO: make pretty =)
             """
+            relations = get_relation_fields(node._model, ManyToOneRel) \
+                      | get_relation_fields(node._model, ManyToManyRel)
             lookup = dict([(k, v) for k, v in node.iteritems() if not "__" in k
-                           and not (any(k in x.keys() for x in node.many_to_one) 
-                                    or any(k in x.keys() for x in node.many_to_many))])
+                           and not k in relations])
             return lookup
         
+        def get_node_fingerprint(node, lookup):
+            """
+            Return the fingerprint of the object node is saved as,
+            including the objects of its FINGERPRINT_RELATIONS,
+            which are made from the related nodes.
+            """
+            instance = node._model(**lookup)
+            instance.clean()
+            related = {}
+            for name in instance.FINGERPRINT_RELATIONS:
+                # An object in a relation more than once counts once
+                fingerprints = []
+                for n in node.get(name) or []:
+                    fingerprint = get_node_fingerprint(n, get_clean_lookup(n))
+                    if not fingerprint in fingerprints:
+                        fingerprints.append(fingerprint)
+                related[name] = fingerprints
+            return instance.get_fingerprint(related)
+        
+        def get_or_create_object(node, lookup):
+            """
+            Find the object with the same content fingerprint
+            and owner as lookup, or create it.
+            """
+            return node._model.objects.get_or_create(
+                fingerprint=get_node_fingerprint(node, lookup),
+                registered_by=lookup.get("registered_by"), defaults=lookup)
+        
         def save_node_relations(node, obj, **kwargs):
             """
             node = BeerXMLNode(), obj = saved Model() instance.
@@ -163,7 +396,7 @@ class BeerXMLNode(dict):
                     for field_name, n in m2one.iteritems():
                         lookup = get_clean_lookup(n)
                         lookup.update(inherit)
-                        rel_obj, created = n._model.objects.get_or_create(**lookup)
+                        rel_obj, created = get_or_create_object(n, lookup)
                         setattr(obj, field_name, rel_obj)
                         obj.save()
                         save_node_relations(n, rel_obj)
@@ -174,7 +407,7 @@ class BeerXMLNode(dict):
                         for n in n_list:
                             lookup = get_clean_lookup(n)
                             lookup.update(inherit)
-                            rel_obj, created = n._model.objects.get_or_create(**lookup)
+                            rel_obj, created = get_or_create_object(n, lookup)
                             # Ugly hack to add many-to-many relations
                             # on arbitrary fields
                             m2m_field = obj.__getattribute__(field_name)
@@ -188,7 +421,7 @@ class BeerXMLNode(dict):
             # update lookup with special inherit dict
             inherit = kwargs.pop("inherit", {})
             lookup.update(inherit)
-            obj, created = self._model.objects.get_or_create(**lookup)
+            obj, created = get_or_create_object(self, lookup)
             save_node_relations(self, obj, inherit=inherit)
         except Exception, e:
             raise BeerXMLError(e)
@@ -1,37 +1,98 @@
+import re
+
 from lxml import etree
+from django.db.models.base import Model
 from brewery.beerxml.error import BeerXMLError
 from brewery.beerxml.nodes import BeerXMLNode
+from brewery.beerxml import export
 
 try:
     from cStringIO import StringIO
 except ImportError:
     from StringIO import StringIO    
 
-def export_toxml(model_instance):
+# Matches the xml declaration of a unicode document
+_xml_declaration = re.compile(ur"^\ufeff?\s*<\?xml[^>]*\?>")
+
+def _get_source(xmldata, path=None):
     """
-    Export model instance to beerxml XML format
+    Return xmldata, or the file at path, as something lxml can
+    read from, without making copies of the input data.
+    
+    Files are only ever opened when given as path. Strings are
+    always read as documents, never as file names, so text from
+    users can not be used to read local files.
+    
+    File like objects (files, mmap objects, etc) and paths
+    are handed straight to lxml, which reads them in chunks.
+    Strings and buffers (buffer, bytearray, memoryview) are wrapped
+    in a cStringIO object, which reads from the original data
+    instead of copying it.
+    
+    Unicode strings are already decoded, so their xml declaration
+    is dropped, and they are handed to lxml as UTF-8.
     """
-    raise NotImplementedError("This feature is not yet implemented")
+    if path is not None:
+        if xmldata is not None:
+            raise BeerXMLError("Give either the input data or a path, not both")
+        return path
+    if hasattr(xmldata, "read"):
+        return xmldata
+    if isinstance(xmldata, unicode):
+        xmldata = _xml_declaration.sub(u"", xmldata, 1).encode("utf-8")
+    try:
+        return StringIO(xmldata)
+    except TypeError:
+        raise BeerXMLError("Input data must be a file, str or buffer object")
 
-def export_tocsv(model_instance):
+def export_toxml(objects, output=None, chunk_size=export.CHUNK_SIZE):
     """
-    Export model instance to CSV format
+    Export a queryset, model instance or list of model instances 
+    to beerxml XML format. The document is streamed to output, 
+    which may be a path or anything with a write() method, like 
+    a file or a HttpResponse. If output is None, the document
+    is returned as a string.
     """
-    raise NotImplementedError("This feature is not yet implemented")
+    if output is not None:
+        return export.export(objects, output, chunk_size)
+    output = StringIO()
+    export.export(objects, output, chunk_size)
+    return output.getvalue()
 
-def to_tuple(xmldata):
+def export_tocsv(objects, fields=None, output=None, chunk_size=export.CHUNK_SIZE):
     """
-    Reads a file or string to a tuple
-    structure of the xml input data.
+    Export a queryset or model instance to CSV format, with one
+    row per record, or per related record if fields span relations
+    (like "hops__name"). fields default to all BeerXML fields.
+    
+    If output is None, an iterator over the lines is returned,
+    which can be passed to a HttpResponse to stream it. Otherwise
+    the lines are written to output, which must have a write()
+    method, like a file or a HttpResponse.
     """
-    try:
-        xml = StringIO(xmldata)
-    except:
-        if not isinstance(xmldata, file):
-            raise BeerXMLError("Input data must be a file or str object")
-        xml = StringIO(xmldata.read())
+    if isinstance(objects, Model):
+        objects = objects.__class__._default_manager.filter(pk=objects.pk)
+    lines = export.iter_csv(objects, fields, chunk_size=chunk_size)
+    if output is None:
+        return lines
+    for line in lines:
+        output.write(line)
+
+# Comments and processing instructions carry no BeerXML
+# data, so we leave them out of the tree altogether.
+_parser = etree.XMLParser(remove_comments=True, remove_pis=True)
+
+def to_tuple(xmldata=None, path=None):
+    """
+    Reads a file or string, or the file at path,
+    to a tuple structure of the xml input data.
+    """
+    xml = _get_source(xmldata, path)
     
-    tree = etree.parse(xml)
+    try:
+        tree = etree.parse(xml, _parser)
+    except etree.XMLSyntaxError, e:
+        raise BeerXMLError(e)
 
     parse_node = lambda node: \
         (node.tag, tuple(map(parse_node, node)) or node.text)
@@ -40,69 +101,125 @@ def to_tuple(xmldata):
     nodetree = parse_node(root)
     return nodetree
 
-def to_dict(xmldata):
-    """
-    Reads a file or string to a dictionary
-    structure of the xml input data.
+def _dictify(node):
+    return dict([(n.tag, _dictify(n)) for n in node]) or node.text
+
+def _parse_node(node):
     """
-    try:
-        xml = StringIO(xmldata)
-    except:
-        if not isinstance(xmldata, file):
-            raise BeerXMLError("Input data must be a file or str object")
-        xml = StringIO(xmldata.read())
+    Convert a single BeerXML record element (RECIPE, HOP, MASH...)
+    into a (name, attrs) pair, where attrs is a dictionary of
+    element tags and values, nested for related records.
     
-    def listify(node):
-        return node.tag, list(map(dictify, node)) or node.text
+    Each element is visited once. Children with plain values
+    only (like STYLE) become a dictionary, while children holding
+    records (like HOPS or MASH) become lists of single record
+    dictionaries.
+    """
+    node_dict, related = {}, {}
+    for child in node:
+        if not len(child):
+            node_dict[child.tag] = child.text
+            continue
         
-    def dictify(node):
-        return node.tag, dict(map(dictify, node)) or node.text
-    
-    def keys(nodes):
-        return dict([(n.getparent().tag, []) for n in nodes])
+        attrs, records = {}, []
+        for elem in child:
+            if len(elem):
+                records.append(elem)
+            else:
+                attrs[elem.tag] = elem.text
+        
+        if not records:
+            node_dict[child.tag] = attrs
+            continue
+        
+        if attrs:
+            # A record with values of its own, like MASH, which
+            # keeps its related records (MASH_STEPS) in lists.
+            for record in records:
+                items = attrs.setdefault(record.tag, [])
+                items.extend([{n.tag: _dictify(n)} for n in record])
+            related[child.tag] = attrs
+        else:
+            # A collection of records, like HOPS
+            related[child.tag] = [{n.tag: _dictify(n)} for n in child]
     
-    children = etree.XPath("child::*[*]")
-    attrs = etree.XPath("child::*[not(child::*)]")
+    node_dict.update(related)
+    return node.tag, node_dict
+
+def to_dict(xmldata=None, path=None):
+    """
+    Reads a file or string, or the file at path,
+    to a dictionary structure of the xml input data.
+    """
+    xml = _get_source(xmldata, path)
     
-    tree = etree.parse(xml)
+    try:
+        tree = etree.parse(xml, _parser)
+    except etree.XMLSyntaxError, e:
+        raise BeerXMLError(e)
     root = tree.getroot()
-    nodes = children(root)
     
-    nodetree = keys(nodes)
-    for node in nodes:
-        key = node.getparent().tag
-        name, values = listify(node)
-        node_dict = dict(map(iter, values))
-        to_parse = [elem for elem in children(node) if children(elem)]
-        
-        for n in to_parse:
-            node_attrs = [listify(attr) for attr in attrs(n)]
-            if node_attrs:
-                node_attrs = dict(map(iter, node_attrs))
-                for child in children(n):
-                    if not child.tag in node_attrs.keys():
-                        node_attrs[child.tag] = []
-                    for cc in map(dictify, child):
-                        node_attrs[child.tag].append(dict([cc]))
-            else:
-                for cc in map(dictify, n):
-                    node_attrs.append(dict([cc]))
-            node_dict[n.tag] = node_attrs
-        nodetree[key].append({name: node_dict})
+    nodetree = {}
+    for node in root:
+        if len(node):
+            name, node_dict = _parse_node(node)
+            nodetree.setdefault(root.tag, []).append({name: node_dict})
     return nodetree
 
-def to_beerxml(xmldata):
+def to_beerxml(xmldata=None, lazy=False, path=None):
     """
-    Reads a file or string to a dictionary
-    structure of the xml input data with each
-    node as a BeerXMLNode()
+    Reads a file or string, or the file at path,
+    to a dictionary structure of the xml input data
+    with each node as a BeerXMLNode(). With lazy=True,
+    node values are converted when they are first read.
     """
-    nodetree = to_dict(xmldata)
+    nodetree = to_dict(xmldata, path)
     for collection, items in nodetree.iteritems():
         nodetree[collection] = []
         while items:
             item_data = items.pop()
             for name, data in item_data.iteritems():
-                node = BeerXMLNode(name=name, attrs=data)
+                node = BeerXMLNode(name=name, attrs=data, lazy=lazy)
                 nodetree[collection].append(node)
     return nodetree
+
+def iter_beerxml(xmldata=None, lazy=False, path=None):
+    """
+    Reads a file or string, or the file at path, incrementally,
+    yielding each top level record (RECIPE, HOP, FERMENTABLE, etc)
+    as a BeerXMLNode as soon as it has been parsed. With lazy=True,
+    node values are converted when they are first read.
+    
+    Processed elements are cleared from the tree, so memory
+    usage stays flat regardless of the size of the input.
+    """
+    xml = _get_source(xmldata, path)
+    
+    events = etree.iterparse(xml, events=("start", "end"),
+                             remove_comments=True, remove_pis=True)
+    depth = 0
+    while True:
+        try:
+            event, elem = next(events)
+        except StopIteration:
+            return
+        except etree.XMLSyntaxError, e:
+            raise BeerXMLError(e)
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+        
+        # elem is a child of the root element. Records
+        # without children are skipped, just like to_dict does.
+        if len(elem):
+            name, data = _parse_node(elem)
+            yield BeerXMLNode(name=name, attrs=data, lazy=lazy)
+        
+        # Throw away the processed element, and any
+        # preceding siblings still referenced by the root.
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+#
+# Reading the values of recipes and their ingredients with
+# values_list(), without building any model instances. Shared by
+# the modules calculating things for many recipes at once: the
+# recipe calculations, mash schedules, water profiles and the
+# similarity index.
+
+from brewery.models import Recipe
+
+# Number of recipes read from the database at a time
+CHUNK_SIZE = 500
+
+def to_float(value, default=0.0):
+    """
+    Return value, a number or Decimal, as a float,
+    or default if it is None.
+    """
+    return default if value is None else float(value)
+
+def ingredient_rows(queryset, field, *values):
+    """
+    Return the values of the ingredients in the many-to-many
+    field of the recipes in queryset, as a dict of recipe pk
+    to a list of tuples of values, with one query.
+    """
+    field = Recipe._meta.get_field(field)
+    source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+    rows = {}
+    for row in field.rel.through.objects.filter(**{"%s__in" % source: queryset}) \
+            .values_list("%s_id" % source, *["%s__%s" % (target, v) for v in values]):
+        rows.setdefault(row[0], []).append(row[1:])
+    return rows
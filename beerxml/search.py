@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+#
+# Full text search over the free text fields of styles and recipes.
+#
+# On SQLite with the FTS5 extension, each model gets an FTS5 table,
+# created by syncdb, which is ranked with bm25(). Otherwise an
+# inverted index is built in memory, the first time a model is
+# searched, and ranked with BM25 in Python. Either way the index
+# is updated when objects are saved or deleted (the receivers are
+# in models.py), and searches return objects containing all the
+# words searched for, best matches first.
+#
+# The inverted index is a fallback for small catalogs and for tests
+# on other databases. It lives in the memory of a single process,
+# and is only kept up to date with the changes made by that process.
+# Use FTS5 when there is more than one process, or many recipes.
+
+import re
+import math
+import heapq
+
+from django.db import connections, router, DatabaseError
+
+from brewery.models import Style, Recipe
+
+# Fields indexed per model
+SEARCH_FIELDS = {
+    Style: ("name", "profile", "ingredients", "examples", "notes"),
+    Recipe: ("name", "notes", "taste_notes"),
+}
+
+# BM25 parameters, as used by FTS5
+K1 = 1.2
+B = 0.75
+
+_words = re.compile(r"(?u)\w+")
+
+def tokenize(text):
+    """
+    Return the lower case words of text.
+    """
+    return _words.findall(text.lower()) if text else []
+
+
+class InvertedIndex(object):
+    """
+    In memory inverted index of the search fields of a model,
+    mapping each word to the number of times it occurs in
+    each object.
+    
+    Limits: every process builds its own copy, reading the whole
+    table, and only sees the saves and deletes made by that process,
+    so the copies of other processes go stale until rebuild() is
+    called. Queries score every object containing a query word in
+    Python, which takes around 0.1 seconds per query at 100,000
+    recipes (see benchmarks/search.py).
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self.postings = {}      # word -> {pk: count}
+        self.lengths = {}       # pk -> number of words
+        self.words = {}         # pk -> distinct words
+        self.total = 0
+
+    def rebuild(self):
+        self.postings.clear()
+        self.lengths.clear()
+        self.words.clear()
+        self.total = 0
+        rows = self.model._default_manager.values_list("pk", *self.fields)
+        for row in rows.iterator():
+            self.add(row[0], row[1:])
+
+    def add(self, pk, texts):
+        words = [w for text in texts for w in tokenize(text)]
+        counts = {}
+        for word in words:
+            counts[word] = counts.get(word, 0) + 1
+        for word, count in counts.iteritems():
+            self.postings.setdefault(word, {})[pk] = count
+        self.lengths[pk] = len(words)
+        self.words[pk] = tuple(counts)
+        self.total += len(words)
+
+    def remove(self, pk):
+        length = self.lengths.pop(pk, None)
+        if length is None:
+            return
+        self.total -= length
+        for word in self.words.pop(pk):
+            docs = self.postings[word]
+            del docs[pk]
+            if not docs:
+                del self.postings[word]
+
+    def update(self, obj):
+        self.remove(obj.pk)
+        self.add(obj.pk, [getattr(obj, f) for f in self.fields])
+
+    def search(self, query, limit=20):
+        """
+        Return (pk, score) tuples of the objects containing all
+        words in query, highest scores first. A limit of None
+        returns all of them.
+        """
+        words = set(tokenize(query))
+        if not words or not self.lengths:
+            return []
+        postings = []
+        for word in words:
+            if not word in self.postings:
+                return []
+            postings.append(self.postings[word])
+        postings.sort(key=len)
+
+        count = len(self.lengths)
+        average = float(self.total) / count or 1.0
+        matches = postings[0].viewkeys()
+        for docs in postings[1:]:
+            matches = matches & docs.viewkeys()
+        norms = dict([(pk, K1 * (1 - B + B * self.lengths[pk] / average))
+                      for pk in matches])
+        scores = dict.fromkeys(matches, 0.0)
+        for docs in postings:
+            idf = math.log((count - len(docs) + 0.5) / (len(docs) + 0.5) + 1)
+            for pk in matches:
+                tf = docs[pk]
+                scores[pk] += idf * tf * (K1 + 1) / (tf + norms[pk])
+        key = lambda s: (-s[1], s[0])
+        if limit is None:
+            return sorted(scores.iteritems(), key=key)
+        return heapq.nsmallest(limit, scores.iteritems(), key=key)
+
+
+class FTS5Index(object):
+    """
+    Search index of a model in an SQLite FTS5 table, named after
+    the model table. The table is created by syncdb (see
+    create_search_tables()), since creating tables in the middle
+    of a transaction would commit it.
+    """
+
+    def __init__(self, model, fields, using=None):
+        self.model = model
+        self.fields = fields
+        self.table = "%s_search" % model._meta.db_table
+        self.connection = connections[using or router.db_for_write(model)]
+        self._exists = False
+
+    def exists(self):
+        if not self._exists:
+            cursor = self.connection.cursor()
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [self.table])
+            self._exists = cursor.fetchone() is not None
+        return self._exists
+
+    def create(self):
+        """
+        Create the FTS5 table and fill it with the existing
+        objects, if it does not exist already.
+        """
+        if self.exists():
+            return False
+        qn = self.connection.ops.quote_name
+        cursor = self.connection.cursor()
+        cursor.execute("CREATE VIRTUAL TABLE %s USING fts5(%s)"
+                       % (qn(self.table), ", ".join(self.fields)))
+        self.rebuild()
+        self._exists = True
+        return True
+
+    def rebuild(self):
+        qn = self.connection.ops.quote_name
+        columns = ", ".join([qn(self.model._meta.get_field(f).column) for f in self.fields])
+        cursor = self.connection.cursor()
+        cursor.execute("DELETE FROM %s" % qn(self.table))
+        cursor.execute("INSERT INTO %s (rowid, %s) SELECT %s, %s FROM %s"
+                       % (qn(self.table), ", ".join(self.fields),
+                          qn(self.model._meta.pk.column), columns,
+                          qn(self.model._meta.db_table)))
+
+    def remove(self, pk):
+        self.remove_many([pk])
+
+    def remove_many(self, pks):
+        if pks and self.exists():
+            cursor = self.connection.cursor()
+            cursor.executemany("DELETE FROM %s WHERE rowid = %%s"
+                               % self.connection.ops.quote_name(self.table),
+                               [(pk,) for pk in pks])
+
+    def update(self, obj):
+        self.update_many([obj])
+
+    def update_many(self, objects):
+        if objects and self.exists():
+            self.remove_many([obj.pk for obj in objects])
+            cursor = self.connection.cursor()
+            cursor.executemany("INSERT INTO %s (rowid, %s) VALUES (%s)"
+                               % (self.connection.ops.quote_name(self.table),
+                                  ", ".join(self.fields),
+                                  ", ".join(["%s"] * (len(self.fields) + 1))),
+                               [[obj.pk] + [getattr(obj, f) for f in self.fields]
+                                for obj in objects])
+
+    def search(self, query, limit=20):
+        """
+        Return (pk, score) tuples of the objects containing all
+        words in query, highest scores first. A limit of None
+        returns all of them.
+        """
+        words = tokenize(query)
+        if not words or not self.exists():
+            return []
+        qn = self.connection.ops.quote_name
+        cursor = self.connection.cursor()
+        # bm25() is lower for better matches. A negative
+        # LIMIT means no limit in SQLite.
+        cursor.execute("SELECT rowid, -bm25(%s) FROM %s WHERE %s MATCH %%s "
+                       "ORDER BY bm25(%s), rowid LIMIT %%s" % ((qn(self.table),) * 4),
+                       [" ".join(['"%s"' % w for w in words]),
+                        -1 if limit is None else limit])
+        return cursor.fetchall()
+
+
+_fts5 = {}
+
+def has_fts5(using="default"):
+    """
+    Return True if the database is SQLite with FTS5.
+    """
+    if not using in _fts5:
+        connection = connections[using]
+        _fts5[using] = False
+        if connection.vendor == "sqlite":
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+                _fts5[using] = bool(cursor.fetchone()[0])
+            except DatabaseError:
+                pass
+    return _fts5[using]
+
+def create_search_tables(using="default", verbosity=1):
+    """
+    Create the FTS5 tables of the indexed models, if the
+    database supports it. Called after syncdb.
+    """
+    if not has_fts5(using):
+        return
+    for model, fields in SEARCH_FIELDS.iteritems():
+        index = FTS5Index(model, fields, using)
+        if index.create() and verbosity >= 1:
+            print "Creating search table %s" % index.table
+
+_indexes = {}
+
+def get_index(model, backend=None):
+    """
+    Return the search index of model. backend is FTS5Index or
+    InvertedIndex, and defaults to FTS5Index when its table
+    exists. The in memory index is built the first time.
+    """
+    try:
+        return _indexes[model]
+    except KeyError:
+        pass
+
+    index = None
+    if backend is None and has_fts5(router.db_for_write(model)):
+        index = FTS5Index(model, SEARCH_FIELDS[model])
+        if not index.exists():
+            index = None
+    if index is None:
+        index = (backend or InvertedIndex)(model, SEARCH_FIELDS[model])
+        if isinstance(index, InvertedIndex):
+            index.rebuild()
+    _indexes[model] = index
+    return index
+
+def clear_indexes():
+    _indexes.clear()
+
+def search(model, query, limit=20):
+    """
+    Return the objects of model (Style or Recipe) containing
+    all the words in query, best matches first.
+    """
+    results = get_index(model).search(query, limit)
+    objects = model._default_manager.in_bulk([pk for pk, score in results])
+    return [objects[pk] for pk, score in results if pk in objects]
+
+def _get_built_index(model):
+    """
+    Return the index of model if it needs to be kept up to date,
+    which is when the in memory index has been built, or when
+    the FTS5 table exists.
+    """
+    index = _indexes.get(model)
+    if index is None and has_fts5(router.db_for_write(model)):
+        index = FTS5Index(model, SEARCH_FIELDS[model])
+        if not index.exists():
+            return None
+        _indexes[model] = index
+    return index
+
+def update_objects(model, objects):
+    """
+    Add or update objects in the search index of model, if it
+    is built. Used by the post_save receiver, and for objects
+    saved without signals.
+    """
+    index = _get_built_index(model)
+    if index is not None and objects:
+        if isinstance(index, FTS5Index):
+            index.update_many(objects)
+        else:
+            for obj in objects:
+                index.update(obj)
+
+def remove_objects(model, pks):
+    """
+    Remove the objects with pks from the search index of model.
+    """
+    index = _get_built_index(model)
+    if index is not None:
+        for pk in pks:
+            index.remove(pk)
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+#
+# Finding recipes similar to a recipe, by their grain bill, hop
+# schedule and yeast.
+#
+# Each recipe is reduced to a fixed length feature vector (see
+# FEATURES): the share of its fermentables by type and by color,
+# the share of its alpha acids added at each stage of the brew,
+# its hopping rate and its yeast attenuation. The vectors of all
+# recipes are kept in a float32 matrix with rows of unit length,
+# so the cosine similarity of a recipe to all others is a single
+# matrix-vector product. The matrix can be saved to and loaded
+# from .npy files, so queries need no database access at all.
+
+from bisect import bisect_right
+
+from brewery.models import Recipe, Fermentable
+from brewery.beerxml.formulas.arrays import optional_numpy, require_numpy
+from brewery.beerxml.calculations import DEFAULT_ATTENUATION
+from brewery.beerxml.queries import CHUNK_SIZE, ingredient_rows, to_float
+
+np = optional_numpy()
+
+FERMENTABLE_TYPES = [t for t, name in Fermentable.TYPE]
+
+# Upper bounds of the color bins, in degrees Lovibond
+COLOR_BOUNDS = (3, 10, 40, 200)
+
+# Stages of hop additions. Boil additions are split by boil time,
+# using BOIL_BOUNDS, into late, middle and bittering additions.
+HOP_STAGES = ("mash", "first wort", "boil late", "boil middle",
+              "boil bittering", "aroma", "dry hop")
+BOIL_BOUNDS = (15, 45)
+
+# Grams of alpha acids per liter which gives a hopping rate of 1
+HOPPING_RATE_SCALE = 0.5
+
+FEATURES = tuple(["type %s" % t for t in FERMENTABLE_TYPES]
+    + ["color %s" % b for b in COLOR_BOUNDS + ("max",)]
+    + ["hops %s" % s for s in HOP_STAGES]
+    + ["hopping rate", "attenuation"])
+
+def _hop_stage(use, time):
+    if use == "boil":
+        return "boil %s" % ("late", "middle", "bittering")[bisect_right(BOIL_BOUNDS, time)]
+    return use
+
+def recipe_features(batch_size, fermentables, hops, attenuations):
+    """
+    Return the feature vector of a recipe as a list of floats, see
+    FEATURES. fermentables is a list of (amount, color, type)
+    tuples, hops a list of (alpha, amount, time, use) tuples and
+    attenuations a list of yeast attenuation percentages.
+    """
+    types = [0.0] * len(FERMENTABLE_TYPES)
+    colors = [0.0] * (len(COLOR_BOUNDS) + 1)
+    total = 0.0
+    for amount, lovibond, ferm_type in fermentables:
+        amount = to_float(amount)
+        total += amount
+        if ferm_type in FERMENTABLE_TYPES:
+            types[FERMENTABLE_TYPES.index(ferm_type)] += amount
+        colors[bisect_right(COLOR_BOUNDS, to_float(lovibond))] += amount
+    if total:
+        types = [t / total for t in types]
+        colors = [c / total for c in colors]
+
+    stages = [0.0] * len(HOP_STAGES)
+    alpha_acids = 0.0
+    for alpha, amount, time, use in hops:
+        grams = to_float(alpha) / 100 * to_float(amount) * 1000
+        stage = _hop_stage(use, to_float(time))
+        if stage in HOP_STAGES:
+            stages[HOP_STAGES.index(stage)] += grams
+        alpha_acids += grams
+    if alpha_acids:
+        stages = [s / alpha_acids for s in stages]
+    batch_size = to_float(batch_size)
+    rate = alpha_acids / batch_size / HOPPING_RATE_SCALE if batch_size else 0.0
+
+    attenuations = [a for a in attenuations if a is not None]
+    attenuation = max(attenuations) if attenuations else DEFAULT_ATTENUATION
+    return types + colors + stages + [rate, to_float(attenuation) / 100]
+
+def iter_features(queryset, chunk_size=CHUNK_SIZE):
+    """
+    Calculate the feature vectors of all recipes in queryset, with
+    four queries per chunk of chunk_size recipes. Yields (recipe
+    pk, features) tuples.
+    """
+    last = None
+    while True:
+        recipes = queryset.order_by("pk")
+        if last is not None:
+            recipes = recipes.filter(pk__gt=last)
+        recipes = list(recipes.values_list("pk", "batch_size")[:chunk_size])
+        if not recipes:
+            break
+        chunk = queryset.filter(pk__gte=recipes[0][0], pk__lte=recipes[-1][0])
+        fermentables = ingredient_rows(chunk, "fermentables", "amount", "color",
+                                       "ferm_type")
+        hops = ingredient_rows(chunk, "hops", "alpha", "amount", "time", "use")
+        yeasts = ingredient_rows(chunk, "yeasts", "attenuation")
+
+        for pk, batch_size in recipes:
+            yield pk, recipe_features(batch_size, fermentables.get(pk, []),
+                                      hops.get(pk, []),
+                                      [a for (a,) in yeasts.get(pk, [])])
+        if len(recipes) < chunk_size:
+            break
+        last = recipes[-1][0]
+
+def _normalize(vectors):
+    """
+    Scale the rows of vectors to unit length. Rows
+    of zeros are left as they are.
+    """
+    norms = np.sqrt((vectors * vectors).sum(axis=1))
+    norms[norms == 0] = 1
+    return vectors / norms[:, np.newaxis]
+
+
+class SimilarityIndex(object):
+    """
+    Feature vectors of a set of recipes, for finding the recipes
+    most similar to a recipe by cosine similarity. pks is a
+    sequence of recipe pks, and vectors the matching sequence
+    of feature vectors.
+    """
+
+    def __init__(self, pks, vectors):
+        require_numpy("Recipe similarity")
+        self.pks = np.asarray(pks, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(self.pks), len(FEATURES))
+        self.vectors = _normalize(vectors)
+        self._positions = None
+
+    @classmethod
+    def from_queryset(cls, queryset=None, chunk_size=CHUNK_SIZE):
+        """
+        Build the index from a Recipe queryset,
+        which defaults to all recipes.
+        """
+        require_numpy("Recipe similarity")
+        if queryset is None:
+            queryset = Recipe.objects.all()
+        pks, vectors = [], []
+        for pk, features in iter_features(queryset, chunk_size):
+            pks.append(pk)
+            vectors.append(features)
+        return cls(pks, vectors)
+
+    def save(self, path):
+        """
+        Save the index as path.pks.npy and path.vectors.npy.
+        """
+        np.save("%s.pks.npy" % path, self.pks)
+        np.save("%s.vectors.npy" % path, self.vectors)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """
+        Load an index saved with save(). With a mmap_mode of "r",
+        the vectors are memory mapped instead of read into memory.
+        """
+        require_numpy("Recipe similarity")
+        index = cls.__new__(cls)
+        index.pks = np.load("%s.pks.npy" % path)
+        index.vectors = np.load("%s.vectors.npy" % path, mmap_mode=mmap_mode)
+        index._positions = None
+        return index
+
+    def __len__(self):
+        return len(self.pks)
+
+    def vector(self, pk):
+        """
+        Return the vector of the recipe with pk, or
+        None if it is not in the index.
+        """
+        if self._positions is None:
+            self._positions = dict([(p, i) for i, p in enumerate(self.pks.tolist())])
+        i = self._positions.get(pk)
+        return None if i is None else self.vectors[i]
+
+    def _top(self, similarities, count, exclude, candidates=None):
+        """
+        Return the (pk, similarity) tuples of the count highest
+        similarities, highest first, leaving out the pk exclude.
+        candidates are the indices of the highest similarities,
+        in any order, if they are known already.
+        """
+        if candidates is not None:
+            top = candidates
+        elif count + 1 < len(similarities):
+            top = np.argpartition(-similarities, count + 1)[:count + 1]
+        else:
+            top = np.arange(len(similarities))
+        # Sort by similarity, then pk
+        top = top[np.lexsort((self.pks[top], -similarities[top]))]
+        return [(pk, float(s)) for pk, s in zip(self.pks[top].tolist(), similarities[top])
+                if pk != exclude][:count]
+
+    def nearest(self, features, count=10, exclude=None):
+        """
+        Return the count recipes most similar to a feature vector,
+        as (pk, cosine similarity) tuples, most similar first. The
+        recipe with pk exclude is left out.
+        """
+        vector = _normalize(np.asarray([features], dtype=np.float32))[0]
+        return self._top(self.vectors.dot(vector), count, exclude)
+
+    def nearest_many(self, features, count=10, excludes=None, batch_size=32):
+        """
+        Return the nearest recipes for each feature vector in
+        features, comparing batch_size vectors at a time with a
+        single matrix product. excludes is an optional list of the
+        pks to leave out for each vector.
+        """
+        features = _normalize(np.asarray(features, dtype=np.float32)
+                              .reshape(-1, len(FEATURES)))
+        if excludes is None:
+            excludes = [None] * len(features)
+        results = []
+        for start in xrange(0, len(features), batch_size):
+            # One row of similarities per vector
+            similarities = features[start:start + batch_size].dot(self.vectors.T)
+            candidates = [None] * len(similarities)
+            if count + 1 < len(self.pks):
+                candidates = np.argpartition(-similarities, count + 1, axis=1)[:, :count + 1]
+            for row, top, exclude in zip(similarities, candidates,
+                                         excludes[start:start + batch_size]):
+                results.append(self._top(row, count, exclude, top))
+        return results
+
+    def similar(self, pk, count=10):
+        """
+        Return the count recipes most similar to the recipe with
+        pk, which must be in the index, leaving out the recipe itself.
+        """
+        vector = self.vector(pk)
+        if vector is None:
+            raise KeyError("Recipe %s is not in the index" % pk)
+        return self._top(self.vectors.dot(vector), count, pk)
+
+
+def similar_recipes(recipe, index, count=10):
+    """
+    Return the count recipes in index most similar to recipe (a
+    Recipe or its pk), most similar first. Recipes which are not
+    in the index have their features calculated.
+    """
+    pk = recipe.pk if isinstance(recipe, Recipe) else recipe
+    vector = index.vector(pk)
+    if vector is None:
+        features = dict(iter_features(Recipe.objects.filter(pk=pk)))
+        if not features:
+            raise Recipe.DoesNotExist("Recipe %s does not exist" % pk)
+        vector = features[pk]
+    results = index.nearest(vector, count, exclude=pk)
+    objects = Recipe.objects.in_bulk([p for p, s in results])
+    return [objects[p] for p, s in results if p in objects]
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+#
+# Matching of recipes to the styles whose ranges of original
+# and final gravity, bitterness, color and alcohol they are in.
+#
+# For each of these dimensions, the style range boundaries split
+# the number line into elementary segments (the boundaries
+# themselves and the open intervals between them), and each
+# segment gets a bitmask of the styles covering it. Matching a
+# recipe is then a bisect per dimension and an AND of five
+# bitmasks, whatever the number of styles.
+#
+# Nearest styles are the matching styles when there are enough
+# of them. Otherwise the distance to every style is computed in one
+# go with numpy, and the nearest are picked with a partial sort.
+# Without numpy, the distances are computed one style at a time.
+#
+# The index is built from the Style table the first time it is
+# used, and rebuilt when the styles have changed since, which is
+# checked with one query each time the index is asked for. That
+# way, processes also see styles changed by other processes.
+
+import heapq
+from bisect import bisect_left
+
+from django.db.models import Count, Max
+
+from brewery.beerxml.formulas.arrays import optional_numpy
+
+np = optional_numpy()
+
+from brewery.models import Style, RecipeStats
+
+DIMENSIONS = ("og", "fg", "ibu", "color", "abv")
+
+class _Dimension(object):
+    """
+    Bitmasks of the styles covering each elementary
+    segment of one dimension.
+    """
+    def __init__(self, ranges):
+        self.bounds = sorted(set([v for r in ranges for v in r if v is not None]))
+        self.masks = [0] * (2 * len(self.bounds) + 1)
+        for bit, (low, high) in enumerate(ranges):
+            first = 0 if low is None else self.segment(low)
+            last = len(self.masks) - 1 if high is None else self.segment(high)
+            for i in xrange(first, last + 1):
+                self.masks[i] |= 1 << bit
+        self.all = (1 << len(ranges)) - 1
+
+    def segment(self, value):
+        """
+        Return the index of the segment containing value. Even
+        indices are open intervals, odd indices are boundaries.
+        """
+        i = bisect_left(self.bounds, value)
+        if i < len(self.bounds) and self.bounds[i] == value:
+            return 2 * i + 1
+        return 2 * i
+
+    def mask(self, value):
+        if value is None:
+            return self.all
+        return self.masks[self.segment(value)]
+
+
+class StyleIndex(object):
+    """
+    In memory index of the style ranges, for matching recipes
+    to styles. styles is a list of (style pk, ranges) tuples,
+    where ranges maps each dimension to a (min, max) tuple. Open
+    ended or missing ranges match any value.
+    """
+
+    def __init__(self, styles):
+        self.pks = [pk for pk, ranges in styles]
+        self.ranges = [[self._range(ranges.get(d)) for d in DIMENSIONS]
+                       for pk, ranges in styles]
+        self.dimensions = [_Dimension([r[i] for r in self.ranges])
+                           for i in xrange(len(DIMENSIONS))]
+
+        # Scale of the distance in each dimension, the
+        # average width of the style ranges.
+        self.scales = []
+        for i in xrange(len(DIMENSIONS)):
+            widths = [high - low for low, high in [r[i] for r in self.ranges]
+                      if low is not None and high is not None and high > low]
+            self.scales.append(sum(widths) / len(widths) if widths else 1.0)
+
+        if np is not None:
+            inf = float("inf")
+            self._lows = np.array([[-inf if low is None else low for low, high in r]
+                                   for r in self.ranges], dtype=float).reshape(-1, len(DIMENSIONS))
+            self._highs = np.array([[inf if high is None else high for low, high in r]
+                                    for r in self.ranges], dtype=float).reshape(-1, len(DIMENSIONS))
+
+    @staticmethod
+    def _range(r):
+        low, high = r or (None, None)
+        return (None if low is None else float(low),
+                None if high is None else float(high))
+
+    @classmethod
+    def from_queryset(cls, queryset=None):
+        """
+        Build the index from a Style queryset,
+        which defaults to all styles.
+        """
+        if queryset is None:
+            queryset = Style.objects.all()
+        fields = ["%s_%s" % (d, end) for d in DIMENSIONS for end in ("min", "max")]
+        styles = []
+        for row in queryset.order_by("pk").values_list("pk", *fields):
+            ranges = dict([(d, row[1 + 2 * i:3 + 2 * i])
+                           for i, d in enumerate(DIMENSIONS)])
+            styles.append((row[0], ranges))
+        return cls(styles)
+
+    def __len__(self):
+        return len(self.pks)
+
+    def _values(self, values):
+        return [None if values.get(d) is None else float(values[d])
+                for d in DIMENSIONS]
+
+    def match(self, values):
+        """
+        Return the pks of the styles matching values, a dict of
+        og, fg, ibu, color and abv (like the results of the recipe
+        calculations). Missing values match any style.
+        """
+        return self._match(self._values(values))
+
+    def _match(self, values):
+        mask = -1
+        for dimension, value in zip(self.dimensions, values):
+            mask &= dimension.mask(value)
+            if not mask:
+                return []
+        matches = []
+        while mask:
+            low = mask & -mask
+            matches.append(self.pks[low.bit_length() - 1])
+            mask ^= low
+        return matches
+
+    def match_many(self, rows):
+        """
+        Return the matching style pks for each dict in rows.
+        """
+        return [self.match(values) for values in rows]
+
+    def distance(self, values, i):
+        """
+        Return the distance from values to the ranges of style i,
+        in units of the average range width of each dimension.
+        Values inside the ranges have a distance of 0.
+        """
+        total = 0.0
+        for value, (low, high), scale in zip(values, self.ranges[i], self.scales):
+            if value is None:
+                continue
+            if low is not None and value < low:
+                total += ((low - value) / scale) ** 2
+            elif high is not None and value > high:
+                total += ((value - high) / scale) ** 2
+        return total ** 0.5
+
+    def distances(self, values):
+        """
+        Return a numpy array of the distances (see distance())
+        from values to every style.
+        """
+        known = [i for i, value in enumerate(values) if value is not None]
+        point = np.array([values[i] for i in known])
+        gaps = np.maximum(self._lows[:, known] - point, 0) \
+             + np.maximum(point - self._highs[:, known], 0)
+        return np.sqrt(((gaps / np.array([self.scales[i] for i in known])) ** 2).sum(axis=1))
+
+    def nearest(self, values, count=3):
+        """
+        Return the count nearest styles to values as (distance, pk)
+        tuples, nearest first. Matching styles have a distance of 0.
+        """
+        values = self._values(values)
+        matches = self._match(values)
+        if len(matches) >= count:
+            return [(0.0, pk) for pk in sorted(matches)[:count]]
+        if np is None:
+            return heapq.nsmallest(count, [(self.distance(values, i), pk)
+                                           for i, pk in enumerate(self.pks)])
+        distances = self.distances(values)
+        if count < len(distances):
+            # Keep all styles as near as the count-th nearest, 
+            # so ties are broken on the pk as by sorting them all
+            nth = np.partition(distances, count - 1)[count - 1]
+            candidates = np.flatnonzero(distances <= nth)
+        else:
+            candidates = xrange(len(distances))
+        return sorted([(float(distances[i]), self.pks[i]) for i in candidates])[:count]
+
+    def nearest_many(self, rows, count=3):
+        """
+        Return the nearest styles for each dict in rows.
+        """
+        return [self.nearest(values, count) for values in rows]
+
+
+_index = None
+_version = None
+
+def _style_version():
+    """
+    Return the number of styles, the highest pk and the latest
+    modification time, which change when styles are added, saved
+    or deleted. Changes made with QuerySet.update() are missed.
+    """
+    version = Style.objects.aggregate(Count("pk"), Max("pk"), Max("mdt"))
+    return version["pk__count"], version["pk__max"], version["mdt__max"]
+
+def get_style_index():
+    """
+    Return the index of all styles, which is built the first
+    time it is needed, and rebuilt when the styles have changed.
+    """
+    global _index, _version
+    version = _style_version()
+    if _index is None or version != _version:
+        _index = StyleIndex.from_queryset()
+        _version = version
+    return _index
+
+def clear_style_index():
+    global _index
+    _index = None
+
+def classify(queryset, nearest=False, count=3):
+    """
+    Match the recipes in queryset to styles using their stats.
+    Yields (recipe pk, style pks) tuples, or (recipe pk, [(distance,
+    style pk)]) tuples for the count nearest styles if nearest is set.
+    """
+    index = get_style_index()
+    stats = RecipeStats.objects.filter(recipe__in=queryset).order_by("pk")
+    for row in stats.values("pk", *DIMENSIONS).iterator():
+        if nearest:
+            yield row["pk"], index.nearest(row, count)
+        else:
+            yield row["pk"], index.match(row)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#
+# Water profiles of recipes: the blend of the waters of each
+# recipe, and the waters in the library closest to it. The
+# profiles are worked out with formulas.water, for a chunk of
+# recipes at a time.
+#
+# Requires numpy, see formulas.arrays.
+
+from brewery.models import Water
+from brewery.beerxml.formulas import water
+from brewery.beerxml.queries import CHUNK_SIZE, ingredient_rows, to_float
+
+def recipe_waters(queryset):
+    """
+    Return the blended water profile of each recipe in queryset, as a
+    dict of recipe pk to (profile, liters of water) tuples, where the
+    profile has the ions of formulas.water.IONS in parts per million.
+    Waters without an amount count as one liter. Recipes without
+    waters are left out.
+    """
+    profiles = {}
+    for pk, waters in ingredient_rows(queryset, "waters", "amount", *water.IONS).iteritems():
+        volumes = [to_float(w[0]) or 1.0 for w in waters]
+        ions = [[to_float(v) for v in w[1:]] for w in waters]
+        profiles[pk] = (water.blend(ions, volumes).tolist(), sum(volumes))
+    return profiles
+
+def closest_waters(queryset, waters=None, count=3, weights=None, chunk_size=CHUNK_SIZE):
+    """
+    Compare the blended water profile of each recipe in queryset
+    with every water in waters (all waters by default), a chunk of
+    recipes at a time. Yields (recipe pk, [(distance, water pk)])
+    tuples with the count closest waters, closest first. weights is
+    the importance of each ion, see formulas.water.
+    """
+    if waters is None:
+        waters = Water.objects.all()
+    library = list(waters.order_by("pk").values_list("pk", *water.IONS))
+    if not library:
+        return
+    pks = [w[0] for w in library]
+    ions = [[to_float(v) for v in w[1:]] for w in library]
+    last = None
+    while True:
+        recipes = queryset.order_by("pk")
+        if last is not None:
+            recipes = recipes.filter(pk__gt=last)
+        recipes = list(recipes.values_list("pk", flat=True)[:chunk_size])
+        if not recipes:
+            break
+        profiles = recipe_waters(queryset.filter(pk__gte=recipes[0], pk__lte=recipes[-1]))
+        blended = [pk for pk in recipes if pk in profiles]
+        if blended:
+            distances = water.pairwise_distances([profiles[pk][0] for pk in blended],
+                                                 ions, weights)
+            for pk, row in zip(blended, distances.tolist()):
+                yield pk, sorted(zip(row, pks))[:count]
+        if len(recipes) < chunk_size:
+            break
+        last = recipes[-1]
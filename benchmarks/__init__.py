@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+#
+# Benchmarks for the brewery app. Each module can be run
+# as a script from a configured django project, e.g.
+#
+#   DJANGO_SETTINGS_MODULE=settings python -m brewery.benchmarks.parser
+#
+# Benchmarks are not part of the test suite.
+
+import os
+import time
+
+from lxml import etree
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            "tests", "beerxml-examples")
+
+def timed(func, *args, **kwargs):
+    """
+    Run func with args and kwargs, returning a
+    (seconds, result) tuple.
+    """
+    start = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - start, result
+
+def replicate(filename, count):
+    """
+    Return the xml in filename as a str, with the records
+    of the root element replicated to count records.
+    """
+    root = etree.parse(os.path.join(EXAMPLES_DIR, filename)).getroot()
+    records = [etree.tostring(node) for node in root if len(node)]
+    body = "".join(records[i % len(records)] for i in xrange(count))
+    return "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<%s>%s</%s>" \
+            % (root.tag, body, root.tag)
+
+def report(title, rows):
+    """
+    Print a simple table of (label, value) rows.
+    """
+    print title
+    print "-" * len(title)
+    for label, value in rows:
+        print "  %-40s %s" % (label, value)
+    print
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+#
+# Compare parsing display strings with and without the cache,
+# for a catalog where the same strings repeat many times.
+
+import random
+
+from brewery.beerxml import display
+from brewery.benchmarks import timed, report
+
+STRINGS = (u"5.00 gal", u"6.00 gal", u"0.00 lb", u"72.0 F", u"168.0 F", u"1.050 SG",
+           u"3.0 SRM", u"12.50 qt", u"0.25 tsp", u"1.00 oz", u"60.0 min", u"2.4 vols",
+           u"18.9 l", u"20 °C", u"4.00 lb", u"125 ml")
+
+def make_column(count, distinct, seed=0):
+    rnd = random.Random(seed)
+    # A long tail of distinct amounts along with the common strings
+    strings = list(STRINGS) + [u"%.2f lb" % (i / 100.0) for i in xrange(distinct)]
+    return [rnd.choice(strings) for i in xrange(count)]
+
+def uncached(texts):
+    return [display._parse(text) for text in texts]
+
+def run(count=1000000, distinct=500):
+    texts = make_column(count, distinct)
+    display.clear_cache()
+    uncached_secs, expected = timed(uncached, texts)
+    cached_secs, result = timed(display.parse_many, texts)
+    assert result == expected
+    report("%d strings, %d distinct" % (count, len(set(texts))), [
+        ("parse every string", "%.3fs" % uncached_secs),
+        ("parse with cache", "%.3fs (%.1fx)" % (cached_secs, uncached_secs / cached_secs)),
+        ("cache hits", "%d" % display._cache.hits),
+    ])
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# Compare recalculating the IBUs and color of a large catalog
+# with the scalar formulas, one addition at a time, against the
+# vectorized formulas working on whole columns.
+
+import numpy
+
+from brewery.beerxml.formulas import bitterness, color
+from brewery.beerxml.formulas import vectorized
+from brewery.benchmarks import timed, report
+
+def catalog(recipes, additions=5, seed=0):
+    """
+    Return random columns of hop additions for a number of
+    recipes, with a fixed number of additions per recipe.
+    """
+    random = numpy.random.RandomState(seed)
+    count = recipes * additions
+    return {
+        "offsets": numpy.arange(0, count + 1, additions),
+        "alpha": random.uniform(0.03, 0.15, count),
+        "grams": random.uniform(5, 100, count),
+        "times": random.randint(1, 90, count),
+        "gravity": random.uniform(1.030, 1.100, recipes),
+        "batch_size": random.uniform(10, 40, recipes),
+    }
+
+def scalar_ibu(c):
+    tinseth = bitterness.Tinseth()
+    alpha, grams, times = c["alpha"].tolist(), c["grams"].tolist(), c["times"].tolist()
+    offsets = c["offsets"].tolist()
+    result = []
+    for r, (gravity, batch_size) in enumerate(zip(c["gravity"].tolist(), 
+                                                  c["batch_size"].tolist())):
+        total = 0.0
+        for i in xrange(offsets[r], offsets[r + 1]):
+            utilization = tinseth.alpha_acid_utilization(
+                tinseth.bigness_factor(gravity), tinseth.boil_time_factor(times[i]))
+            total += tinseth.ibu(utilization, 
+                tinseth.mg_alpha_acids(alpha[i], grams[i], batch_size))
+        result.append(total)
+    return result
+
+def vector_ibu(c):
+    return vectorized.Tinseth().recipe_ibu(c["alpha"], c["grams"], c["times"],
+                                           c["offsets"], c["gravity"], c["batch_size"])
+
+def scalar_color(c):
+    offsets = c["offsets"].tolist()
+    lovibond, lbs = (c["alpha"] * 100).tolist(), c["grams"].tolist()
+    gallons = c["batch_size"].tolist()
+    return [color.morey(sum(color.mcu(lovibond[i], lbs[i], gallons[r]) 
+                            for i in xrange(offsets[r], offsets[r + 1])))
+            for r in xrange(len(offsets) - 1)]
+
+def vector_color(c):
+    return vectorized.morey(vectorized.recipe_mcu(c["alpha"] * 100, c["grams"], 
+                                                  c["offsets"], c["batch_size"]))
+
+def run(recipes=(10000, 100000, 1000000)):
+    for count in recipes:
+        c = catalog(count)
+        rows = []
+        for name, scalar, vector in (("ibu (tinseth)", scalar_ibu, vector_ibu),
+                                     ("color (morey)", scalar_color, vector_color)):
+            scalar_secs, expected = timed(scalar, c)
+            vector_secs, result = timed(vector, c)
+            assert numpy.allclose(result, expected, rtol=1e-12)
+            rows.extend([
+                ("%s scalar" % name, "%.3fs" % scalar_secs),
+                ("%s vectorized" % name, "%.3fs (%.0fx)" 
+                    % (vector_secs, scalar_secs / vector_secs)),
+            ])
+        report("%d recipes, %d hop additions" % (count, len(c["alpha"])), rows)
+
+if __name__ == "__main__":
+    run()
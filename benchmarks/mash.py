@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+# Compare running the mash schedules of many mash profiles
+# one at a time, against running them all with schedule_many().
+
+import numpy as np
+
+from brewery.beerxml.formulas import mash
+from brewery.benchmarks import timed, report
+
+def make_profiles(count, seed=0):
+    rnd = np.random.RandomState(seed)
+    counts = rnd.randint(1, 6, count)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    steps = offsets[-1]
+    return {
+        "grain_weight": rnd.uniform(2, 10, count),
+        "grain_temp": rnd.uniform(10, 25, count),
+        "tun_temp": rnd.uniform(10, 25, count),
+        "tun_capacity": rnd.uniform(0, 1, count) * (rnd.rand(count) > 0.5),
+        "step_types": rnd.randint(0, 3, steps),
+        "step_temps": rnd.uniform(40, 78, steps),
+        "infuse_amounts": rnd.uniform(0, 15, steps) * (rnd.rand(steps) > 0.3),
+        "offsets": offsets,
+    }
+
+def one_at_a_time(p):
+    results = []
+    steps = zip([mash.STEP_TYPES[t] for t in p["step_types"]], p["step_temps"].tolist(),
+                p["infuse_amounts"].tolist())
+    offsets = p["offsets"].tolist()
+    for i in xrange(len(offsets) - 1):
+        results.extend(mash.schedule(p["grain_weight"][i], steps[offsets[i]:offsets[i + 1]],
+            p["grain_temp"][i], p["tun_temp"][i], p["tun_capacity"][i], 1.0, True))
+    return results
+
+def run(count=100000):
+    profiles = make_profiles(count)
+    loop_secs, expected = timed(one_at_a_time, profiles)
+    many_secs, result = timed(mash.schedule_many, **profiles)
+    temps = np.array([np.nan if r.infuse_temp is None else r.infuse_temp for r in expected])
+    assert np.allclose(temps, result["infuse_temp"], equal_nan=True)
+    report("%d mash profiles, %d steps" % (count, len(temps)), [
+        ("one profile at a time", "%.3fs" % loop_secs),
+        ("schedule_many", "%.3fs (%.0fx)" % (many_secs, loop_secs / many_secs)),
+    ])
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+#
+# Measure BeerXMLNode construction time and memory use on the
+# example corpus, comparing with the previous implementation, which
+# reflected on the model for every value and stored every value
+# both in the dict and as an attribute.
+
+import os
+import sys
+from decimal import Decimal
+
+from django.db.models.loading import get_model
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.fields.related import ManyToOneRel, ManyToManyRel
+
+from brewery.beerxml import parser
+from brewery.beerxml.nodes import BeerXMLNode, NODENAMES
+from brewery.benchmarks import EXAMPLES_DIR, timed, report
+
+FILES = ("equipment.xml", "grain.xml", "hops.xml", "mash.xml",
+         "misc.xml", "recipes.xml", "style.xml", "water.xml", 
+         "yeast.xml")
+
+class LegacyNode(dict):
+    """
+    The reflection based BeerXMLNode,
+    kept here for reference.
+    """
+    
+    def __init__(self, name, attrs):
+        super(LegacyNode, self).__init__()
+        self.__name__ = name.upper()
+        for key, value in attrs.copy().iteritems():
+            model_name = key = key.lower()
+            if hasattr(self._model, "_beerxml_attrs"):
+                key = self._model._beerxml_attrs.get(model_name, key)
+            if value in ("TRUE", "FALSE"):
+                value = "True" if value == "TRUE" else "False"
+            try:
+                field = self._model._meta.get_field(key)
+                value = field.to_python(value)
+                if isinstance(field.rel, ManyToOneRel):
+                    value = LegacyNode(field.name, value)
+                if isinstance(field.rel, ManyToManyRel):
+                    values = []
+                    if value:
+                        for node in value:
+                            for k, v in node.iteritems():
+                                values.append(LegacyNode(k, v))
+                    value = values
+                self.update({key: value})
+                setattr(self, key, value)
+            except FieldDoesNotExist:
+                continue
+        self.many_to_many = list(self.iter_field_type(ManyToManyRel))
+        self.many_to_one = list(self.iter_field_type(ManyToOneRel))
+    
+    @property
+    def _model(self):
+        return get_model("brewery", NODENAMES[self.__name__])
+    
+    def iter_field_type(self, field_type):
+        for key in self.iterkeys():
+            field = self._model._meta.get_field(key)
+            if isinstance(field.rel, field_type):
+                yield {key: self.get(field.name)}
+
+def sizeof(obj, seen=None):
+    """
+    Return the approximate memory used by obj and everything
+    it references, counting shared objects once.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (basestring, int, long, float, bool, Decimal)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        size += sum(sizeof(k, seen) + sizeof(v, seen) for k, v in obj.iteritems())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(sizeof(item, seen) for item in obj)
+    if hasattr(obj, "__dict__"):
+        size += sizeof(obj.__dict__, seen)
+    return size
+
+def load_corpus():
+    """
+    Return the example files as a list of (name, attrs) pairs.
+    """
+    items = []
+    for f in FILES:
+        for nodelist in parser.to_dict(path=os.path.join(EXAMPLES_DIR, f)).itervalues():
+            for item in nodelist:
+                items.extend(item.items())
+    return items
+
+def build(node_class, items, rounds):
+    for i in xrange(rounds):
+        nodes = [node_class(name, attrs) for name, attrs in items]
+    return nodes
+
+def preview(items, rounds, lazy):
+    for i in xrange(rounds):
+        for name, attrs in items:
+            node = BeerXMLNode(name, attrs, lazy=lazy)
+            node.get("name"), node.get("version"), node.get("amount")
+
+def run(rounds=50):
+    items = load_corpus()
+    legacy_time, expected = timed(build, LegacyNode, items, rounds)
+    plan_time, result = timed(build, BeerXMLNode, items, rounds)
+    assert result == expected, "BeerXMLNode output differs from legacy output"
+    report("BeerXMLNode construction, %d x %d records" % (rounds, len(items)), [
+        ("reflection per value", "%.3f s" % legacy_time),
+        ("conversion plans", "%.3f s (%.1fx)" % (plan_time, legacy_time / plan_time)),
+    ])
+    
+    eager_time, _ = timed(preview, items, rounds, False)
+    lazy_time, _ = timed(preview, items, rounds, True)
+    report("Preview (name, version and amount), %d x %d records" % (rounds, len(items)), [
+        ("full conversion", "%.3f s" % eager_time),
+        ("lazy conversion", "%.3f s (%.0f%%)" % (lazy_time, 100 * lazy_time / eager_time)),
+    ])
+    
+    legacy_size, size = sizeof(expected), sizeof(result)
+    report("BeerXMLNode memory, %d records" % len(items), [
+        ("values in dict and attributes", "%d bytes" % legacy_size),
+        ("compact nodes", "%d bytes (%.0f%% saved)" % (size, 
+                100.0 * (legacy_size - size) / legacy_size)),
+    ])
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+# Compare normalizing model instances one at a time, through a
+# pre_save signal receiver calling clean() like the models used
+# to, against normalizing them all at once with normalize().
+
+import random
+
+from django.dispatch import Signal
+from django.template.defaultfilters import slugify
+
+from brewery.models import Hop, normalize
+from brewery.benchmarks import timed, report
+
+NAMES = (u"Cascade", u"Centennial", u"East Kent Goldings", u"Fuggles",
+         u"Hallertauer Mittelfrueh", u"Northern Brewer", u"Saaz", u"Tettnang")
+USES = (u"Boil", u"Dry Hop", u"Mash", u"First Wort", u"Aroma")
+
+def legacy_clean(hop):
+    """
+    The clean() method of Hop, kept here for reference
+    (with the form taken from the form, not the use).
+    """
+    if not hop.slug:
+        hop.slug = slugify(hop.name)
+    if hop.use:
+        hop.use = u"%s" % hop.use.lower()
+    if hop.hop_type:
+        hop.hop_type = u"%s" % hop.hop_type.lower()
+    if hop.form:
+        hop.form = u"%s" % hop.form.lower()
+
+pre_save = Signal(providing_args=["instance"])
+
+def clean_hop_callback(sender, instance, **kwargs):
+    legacy_clean(instance)
+
+pre_save.connect(clean_hop_callback, sender=Hop)
+
+def make_hops(count, seed=0):
+    rnd = random.Random(seed)
+    return [Hop(name=rnd.choice(NAMES), use=rnd.choice(USES), hop_type=u"Both",
+                form=u"Pellet", alpha=5) for i in xrange(count)]
+
+def one_at_a_time(hops):
+    for hop in hops:
+        pre_save.send(sender=Hop, instance=hop)
+    return hops
+
+def values(hops):
+    return [(h.slug, h.use, h.hop_type, h.form) for h in hops]
+
+def run(count=200000):
+    legacy_secs, expected = timed(one_at_a_time, make_hops(count))
+    batch_secs, result = timed(normalize, make_hops(count))
+    assert values(result) == values(expected)
+    report("%d hops" % count, [
+        ("signal and clean() per hop", "%.3fs (%.2fus per hop)"
+            % (legacy_secs, legacy_secs / count * 1e6)),
+        ("normalize()", "%.3fs (%.2fus per hop, %.1fx)"
+            % (batch_secs, batch_secs / count * 1e6, legacy_secs / batch_secs)),
+    ])
+
+if __name__ == "__main__":
+    run()
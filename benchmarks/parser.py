@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# Compare the single pass parser.to_dict with the previous
+# implementation, which evaluated XPath expressions again
+# at every nesting level.
+
+from lxml import etree
+
+from brewery.beerxml import parser
+from brewery.benchmarks import timed, replicate, report
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+def legacy_to_dict(xmldata):
+    """
+    The XPath based to_dict implementation, kept
+    here for reference.
+    """
+    xml = StringIO(xmldata)
+    
+    def listify(node):
+        return node.tag, list(map(dictify, node)) or node.text
+        
+    def dictify(node):
+        return node.tag, dict(map(dictify, node)) or node.text
+    
+    def keys(nodes):
+        return dict([(n.getparent().tag, []) for n in nodes])
+    
+    children = etree.XPath("child::*[*]")
+    attrs = etree.XPath("child::*[not(child::*)]")
+    
+    tree = etree.parse(xml)
+    root = tree.getroot()
+    nodes = children(root)
+    
+    nodetree = keys(nodes)
+    for node in nodes:
+        key = node.getparent().tag
+        name, values = listify(node)
+        node_dict = dict(map(iter, values))
+        to_parse = [elem for elem in children(node) if children(elem)]
+        
+        for n in to_parse:
+            node_attrs = [listify(attr) for attr in attrs(n)]
+            if node_attrs:
+                node_attrs = dict(map(iter, node_attrs))
+                for child in children(n):
+                    if not child.tag in node_attrs.keys():
+                        node_attrs[child.tag] = []
+                    for cc in map(dictify, child):
+                        node_attrs[child.tag].append(dict([cc]))
+            else:
+                for cc in map(dictify, n):
+                    node_attrs.append(dict([cc]))
+            node_dict[n.tag] = node_attrs
+        nodetree[key].append({name: node_dict})
+    return nodetree
+
+def run(counts=(1000, 10000)):
+    rows = []
+    for count in counts:
+        xml = replicate("recipes.xml", count)
+        legacy_time, expected = timed(legacy_to_dict, xml)
+        new_time, result = timed(parser.to_dict, xml)
+        assert result == expected, "to_dict output differs from legacy output"
+        rows.append(("%d recipes (%.1f MB), legacy" % (count, len(xml) / 1048576.0),
+                     "%.3f s" % legacy_time))
+        rows.append(("%d recipes, single pass" % count,
+                     "%.3f s (%.1fx)" % (new_time, legacy_time / new_time)))
+    report("parser.to_dict", rows)
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+# Compare searching recipe notes by scanning the words of
+# every recipe, against searching them with the InvertedIndex.
+
+import random
+
+from brewery.beerxml.search import InvertedIndex, tokenize
+from brewery.benchmarks import timed, report
+
+WORDS = ("malt", "hops", "crisp", "roasted", "chocolate", "caramel", "citrus",
+         "pine", "fruity", "dry", "sweet", "bitter", "smoky", "clean", "lager",
+         "ale", "wheat", "rye", "oak", "vanilla", "coffee", "honey", "spicy",
+         "banana", "clove", "pale", "amber", "dark", "light", "strong")
+
+QUERIES = ("chocolate coffee", "smoky oak", "citrus pine hops", "banana clove wheat",
+           "honey", "vanilla oak coffee")
+
+def make_notes(count, seed=0):
+    rnd = random.Random(seed)
+    # A long tail of rare words, so the vocabulary is realistic
+    rare = ["word%d" % i for i in xrange(5000)]
+    return [(pk, u" ".join([rnd.choice(WORDS) for i in xrange(rnd.randint(5, 30))]
+                           + [rnd.choice(rare) for i in xrange(rnd.randint(0, 10))]))
+            for pk in xrange(1, count + 1)]
+
+def build(notes):
+    index = InvertedIndex(None, ("notes",))
+    for pk, text in notes:
+        index.add(pk, [text])
+    return index
+
+def scan(notes, queries):
+    results = []
+    for query in queries:
+        words = set(tokenize(query))
+        results.append(set([pk for pk, text in notes
+                            if words <= set(tokenize(text))]))
+    return results
+
+def search(index, queries, limit=None):
+    return [set([pk for pk, score in index.search(query, limit)])
+            for query in queries]
+
+def run(counts=(10000, 100000)):
+    for count in counts:
+        notes = make_notes(count)
+        build_secs, index = timed(build, notes)
+        scan_secs, expected = timed(scan, notes, QUERIES)
+        index_secs, result = timed(search, index, QUERIES)
+        assert result == expected
+        top_secs, result = timed(search, index, QUERIES, 20)
+        report("%d recipes, %d queries" % (count, len(QUERIES)), [
+            ("build index", "%.3fs" % build_secs),
+            ("scan all recipes", "%.3fs" % scan_secs),
+            ("inverted index", "%.3fs (%.0fx)" % (index_secs, scan_secs / index_secs)),
+            ("ms per query", "%.1f" % (index_secs * 1000 / len(QUERIES))),
+            ("ms per query, top 20", "%.1f" % (top_secs * 1000 / len(QUERIES))),
+        ])
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+#
+# Compare finding similar recipes by computing the cosine
+# similarity with every recipe in Python, against the
+# SimilarityIndex, which does it with matrix products.
+
+import math
+import random
+
+import numpy as np
+
+from brewery.beerxml.similarity import SimilarityIndex, FEATURES
+from brewery.benchmarks import timed, report
+
+def make_vectors(count, seed=0):
+    rnd = np.random.RandomState(seed)
+    # Sparse, non negative features like the recipe features
+    vectors = rnd.random_sample((count, len(FEATURES)))
+    vectors[rnd.random_sample(vectors.shape) < 0.6] = 0
+    return vectors
+
+def scan(pks, vectors, query, count):
+    norm = math.sqrt(sum(q * q for q in query))
+    similarities = []
+    for pk, vector in zip(pks, vectors):
+        dot = sum(a * b for a, b in zip(vector, query))
+        length = math.sqrt(sum(a * a for a in vector)) * norm
+        similarities.append((dot / length if length else 0.0, pk))
+    return [pk for s, pk in sorted(similarities, reverse=True)[:count]]
+
+def run(count=300000, queries=1000, scanned=3):
+    vectors = make_vectors(count)
+    pks = range(1, count + 1)
+    build_secs, index = timed(SimilarityIndex, pks, vectors)
+    rows = vectors.tolist()
+    picks = random.Random(1).sample(xrange(count), queries)
+
+    scan_secs, expected = timed(lambda: [scan(pks, rows, rows[i], 10)
+                                         for i in picks[:scanned]])
+    one_secs, result = timed(lambda: [[pk for pk, s in index.nearest(vectors[i], 10)]
+                                      for i in picks[:scanned]])
+    assert [set(r) for r in result] == [set(e) for e in expected]
+    many_secs, result = timed(index.nearest_many, vectors[picks], 10)
+    report("%d recipes, %d features" % (count, len(FEATURES)), [
+        ("build index", "%.3fs" % build_secs),
+        ("python scan, per query", "%.3fs" % (scan_secs / scanned)),
+        ("index, per query", "%.4fs (%.0fx)" % (one_secs / scanned, scan_secs / one_secs)),
+        ("index, %d queries in batches" % queries, "%.3fs" % many_secs),
+        ("batched, per query", "%.4fs" % (many_secs / queries)),
+    ])
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# Compare matching recipes to styles by comparing the ranges
+# of every style, against matching them with the StyleIndex, and
+# finding the nearest styles by sorting the distances to every
+# style, against StyleIndex.nearest().
+
+import random
+
+from brewery.beerxml.styles import StyleIndex, DIMENSIONS
+from brewery.benchmarks import timed, report
+
+# (lowest value, highest value, typical range width) per dimension
+SCALES = {
+    "og": (1.025, 1.120, 0.015),
+    "fg": (1.000, 1.030, 0.008),
+    "ibu": (5, 100, 20),
+    "color": (2, 40, 8),
+    "abv": (2.5, 12, 2),
+}
+
+def make_styles(count, seed=0):
+    rnd = random.Random(seed)
+    styles = []
+    for pk in xrange(count):
+        ranges = {}
+        for d in DIMENSIONS:
+            low, high, width = SCALES[d]
+            start = rnd.uniform(low, high - width)
+            ranges[d] = (start, start + rnd.uniform(0.5, 1.5) * width)
+        styles.append((pk, ranges))
+    return styles
+
+def make_recipes(count, seed=1):
+    rnd = random.Random(seed)
+    return [dict([(d, rnd.uniform(SCALES[d][0], SCALES[d][1])) for d in DIMENSIONS])
+            for i in xrange(count)]
+
+def scan(styles, recipes):
+    results = []
+    for values in recipes:
+        matches = []
+        for pk, ranges in styles:
+            for d in DIMENSIONS:
+                low, high = ranges[d]
+                if not low <= values[d] <= high:
+                    break
+            else:
+                matches.append(pk)
+        results.append(matches)
+    return results
+
+def scan_nearest(index, recipes, count=3):
+    results = []
+    for values in recipes:
+        values = index._values(values)
+        results.append(sorted([(index.distance(values, i), pk)
+                               for i, pk in enumerate(index.pks)])[:count])
+    return results
+
+def run(styles=(100, 1000), recipes=100000, nearest=2000):
+    recipe_rows = make_recipes(recipes)
+    for count in styles:
+        style_rows = make_styles(count)
+        build_secs, index = timed(StyleIndex, style_rows)
+        scan_secs, expected = timed(scan, style_rows, recipe_rows)
+        index_secs, result = timed(index.match_many, recipe_rows)
+        assert result == expected
+        nearest_rows = recipe_rows[:nearest]
+        sort_secs, expected = timed(scan_nearest, index, nearest_rows)
+        nearest_secs, result = timed(index.nearest_many, nearest_rows)
+        assert [[pk for d, pk in r] for r in result] == [[pk for d, pk in r] for r in expected]
+        report("%d recipes, %d styles" % (recipes, count), [
+            ("build index", "%.3fs" % build_secs),
+            ("scan all styles", "%.3fs" % scan_secs),
+            ("style index", "%.3fs (%.0fx)" % (index_secs, scan_secs / index_secs)),
+            ("recipes per second", "%.0f" % (recipes / index_secs)),
+            ("nearest, sorting %d recipes" % nearest, "%.3fs" % sort_secs),
+            ("nearest, style index", "%.3fs (%.0fx)" % (nearest_secs, sort_secs / nearest_secs)),
+        ])
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#
+# Compare matching water profiles one problem at a time, against
+# solving them all at once with the batch solvers in formulas.water.
+
+import numpy as np
+
+from brewery.beerxml.formulas import water
+from brewery.benchmarks import timed, report
+
+def make_profiles(count, seed=0):
+    rnd = np.random.RandomState(seed)
+    scale = np.array([150, 40, 50, 300, 100, 300], dtype=float)
+    return rnd.uniform(0, 1, (count, len(water.IONS))) * scale
+
+def pairs_one_at_a_time(library, targets):
+    # Best blend of each pair of library waters, for each target
+    results = []
+    for target in targets:
+        for i in xrange(len(library)):
+            for j in xrange(i + 1, len(library)):
+                ratio = float(water.best_pair_ratios(library[i], library[j], target))
+                blend = ratio * library[i] + (1 - ratio) * library[j]
+                results.append(float(water.distance(blend, target)))
+    return results
+
+def pairs_at_once(library, targets):
+    first, second = np.triu_indices(len(library), 1)
+    results = []
+    for target in targets:
+        ratios = water.best_pair_ratios(library[first], library[second], target)[:, np.newaxis]
+        blends = ratios * library[first] + (1 - ratios) * library[second]
+        results.extend(water.distance(blends, target).tolist())
+    return results
+
+def salts_one_at_a_time(profiles, targets):
+    return np.vstack([water.match_salts(p, t, 20, iterations=200)
+                      for p, t in zip(profiles, targets)])
+
+def run(waters=50, targets=100, problems=2000):
+    library = make_profiles(waters)
+    wanted = make_profiles(targets, 1)
+    loop_secs, expected = timed(pairs_one_at_a_time, library, wanted)
+    batch_secs, result = timed(pairs_at_once, library, wanted)
+    assert np.allclose(result, expected)
+    report("%d targets, %d pairs of waters" % (targets, len(expected) / targets), [
+        ("one pair at a time", "%.3fs" % loop_secs),
+        ("all pairs at once", "%.3fs (%.1fx)" % (batch_secs, loop_secs / batch_secs)),
+    ])
+
+    profiles, wanted = make_profiles(problems, 2), make_profiles(problems, 3)
+    loop_secs, expected = timed(salts_one_at_a_time, profiles, wanted)
+    batch_secs, result = timed(water.match_salts, profiles, wanted, 20, iterations=200)
+    # The batch runs until all problems converge, so the results
+    # are as close or closer to the targets
+    assert (water.distance(water.add_salts(profiles, result, 20), wanted) <=
+            water.distance(water.add_salts(profiles, expected, 20), wanted) + 1e-6).all()
+    report("%d salt additions" % problems, [
+        ("one at a time", "%.3fs" % loop_secs),
+        ("all at once", "%.3fs (%.1fx)" % (batch_secs, loop_secs / batch_secs)),
+    ])
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+
+from django.db.models import signals
+from django.dispatch.dispatcher import receiver
+
+from brewery import models
+
+@receiver(signals.post_syncdb, sender=models)
+def create_search_tables_callback(sender, verbosity=1, db="default", **kwargs):
+    from brewery.beerxml.search import create_search_tables
+    create_search_tables(db, verbosity)
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from django.db.models import get_models
+
+from brewery import models
+
+class Command(NoArgsCommand):
+    help = """Computes the content fingerprint of all BeerXML
+    records which does not have one yet."""
+    
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        verbosity = int(options.get("verbosity", 1))
+        for model in get_models(models):
+            if not issubclass(model, models.BeerXMLBase):
+                continue
+            count = 0
+            for obj in model.objects.filter(fingerprint="").iterator():
+                obj.clean()
+                model.objects.filter(pk=obj.pk).update(fingerprint=obj.get_fingerprint())
+                count += 1
+            if verbosity > 0 and count:
+                self.stdout.write("%s: %d fingerprints\n" % (model.__name__, count))
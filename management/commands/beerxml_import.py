@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from brewery.beerxml.ingest import ingest
+
+class Command(BaseCommand):
+    help = """Imports BeerXML files to the database. Directories are
+    searched recursively for .xml files, which are parsed in parallel."""
+    args = "path [path ...]"
+    
+    option_list = BaseCommand.option_list + (
+        make_option("--processes", action="store", type="int", dest="processes",
+            default=None, help="Number of parser processes. Defaults to the "
+                "number of cpus."),
+        make_option("--user", action="store", dest="username", default=None,
+            help="Username to register the imported records on."),
+    )
+    
+    def handle(self, *paths, **options):
+        if not paths:
+            raise CommandError("Please provide at least one file or directory.")
+        
+        verbosity = int(options.get("verbosity", 1))
+        inherit = {}
+        if options.get("username"):
+            try:
+                inherit["registered_by"] = User.objects.get(username=options["username"])
+            except User.DoesNotExist:
+                raise CommandError("User %s does not exist." % options["username"])
+        
+        def callback(result):
+            if not result.success:
+                self.stderr.write("FAILED %s: %s\n" % (result.path, result.error))
+            elif verbosity > 1:
+                self.stdout.write("OK     %s (%d records)\n" % (result.path, result.nodes))
+        
+        report = ingest(paths, processes=options.get("processes"),
+                        callback=callback, inherit=inherit)
+        
+        if verbosity > 0:
+            self.stdout.write("Imported %d of %d files (%d records) in %.2f seconds, "
+                              "%.1f files/s, %.1f records/s\n" % (
+                    len(report.succeeded), len(report.results), report.nodes,
+                    report.elapsed, report.files_per_second, report.nodes_per_second))
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand, CommandError
+
+from brewery.beerxml.similarity import SimilarityIndex
+
+class Command(BaseCommand):
+    help = """Builds the feature vectors of all recipes for finding
+    similar recipes, and saves them as path.pks.npy and
+    path.vectors.npy."""
+    args = "path"
+    
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Please provide the path to save the index to.")
+        
+        verbosity = int(options.get("verbosity", 1))
+        try:
+            index = SimilarityIndex.from_queryset()
+        except ImportError, e:
+            raise CommandError(e)
+        index.save(args[0])
+        if verbosity > 0:
+            self.stdout.write("Saved the feature vectors of %d recipes\n" % len(index))
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from brewery.models import Recipe, RecipeStats
+from brewery.beerxml.calculations import update_stats
+
+class Command(NoArgsCommand):
+    help = """Recalculates the stats of all recipes, e.g. after
+    changes to the formulas."""
+    
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        verbosity = int(options.get("verbosity", 1))
+        RecipeStats.objects.all().delete()
+        count = update_stats(Recipe.objects.all())
+        if verbosity > 0:
+            self.stdout.write("Updated the stats of %d recipes\n" % count)
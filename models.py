@@ -58,13 +58,18 @@
 #    plato – Gravity measured in degrees plato
 #===============================================================================
 
-from django.db import models
+import hashlib
+from decimal import Decimal, Context
+
+from django.db import models, connections, router, transaction
 from django.db.models import signals
 from django.contrib.auth.models import User
 from django.utils.translation import ugettext_lazy as _
 from django.dispatch.dispatcher import receiver
 from django.template.defaultfilters import slugify
 
+from brewery.beerxml import graph
+
 
 
 #
@@ -81,6 +86,21 @@ class BeerXMLBase(models.Model):
     class Meta:
         abstract = True
         app_label = "brewery"
+    
+    # Fields which are not part of the content fingerprint
+    FINGERPRINT_EXCLUDE = ("id", "version", "slug", "registered_by", 
+                           "modified_by", "cdt", "mdt", "fingerprint")
+    
+    # Many-to-many relations which are part of the content
+    # fingerprint, through the fingerprints of their objects. The
+    # order of the objects only counts in the ORDERED_RELATIONS.
+    FINGERPRINT_RELATIONS = ()
+    ORDERED_RELATIONS = ()
+    
+    # Normalization rules, see normalize(). BeerXML list values
+    # are stored in lower case, and the slug is made from the name
+    # when it is empty.
+    LOWERCASE_FIELDS = ()
         
     name = models.CharField(_("name"), max_length=100)
     version = models.PositiveSmallIntegerField(_("version"), default=1,
@@ -92,8 +112,129 @@ class BeerXMLBase(models.Model):
             related_name="%(app_label)s_%(class)s_modified_by_set", help_text="Modified by")
     cdt = models.DateTimeField(_("created"), editable=False, auto_now_add=True)
     mdt = models.DateTimeField(_("modified"), editable=False, auto_now=True)
+    # Identical records are found by looking up the fingerprint and
+    # owner before saving (see BeerXMLNode.get_or_create() and
+    # beerxml.bulk). The fingerprint is not unique in the database:
+    # rows without an owner could not be kept unique anyway, as NULLs
+    # never compare equal, and the fingerprints of records with
+    # FINGERPRINT_RELATIONS change while their relations are added,
+    # passing through the fingerprints of other records. Enforcing
+    # uniqueness is a non-goal: imports running at the same time
+    # may both create a record, and leave two identical rows.
+    fingerprint = models.CharField(_("fingerprint"), max_length=40, blank=True,
+            db_index=True, editable=False, help_text="""Hash of the content of 
+            this object, used to find identical objects.""")
+    
+    def get_related_fingerprints(self):
+        """
+        Return a dict of the fingerprints of the objects in each
+        relation in FINGERPRINT_RELATIONS, in the order they were
+        added. An unsaved object has no related objects yet.
+        """
+        if self.pk is None:
+            return dict([(name, []) for name in self.FINGERPRINT_RELATIONS])
+        return self.get_related_fingerprints_many([self.pk])[self.pk]
+    
+    @classmethod
+    def get_related_fingerprints_many(cls, pks):
+        """
+        Return a dict of the related fingerprints (see
+        get_related_fingerprints()) of the objects with pks,
+        read with one query per relation.
+        """
+        related = dict([(pk, dict([(name, []) for name in cls.FINGERPRINT_RELATIONS]))
+                        for pk in pks])
+        for name in cls.FINGERPRINT_RELATIONS:
+            field = cls._meta.get_field(name)
+            source = field.m2m_field_name()
+            rows = field.rel.through.objects.filter(**{"%s__in" % source: related.keys()})
+            for pk, fingerprint in rows.order_by("pk").values_list(source,
+                    "%s__fingerprint" % field.m2m_reverse_field_name()):
+                related[pk][name].append(fingerprint)
+        return related
+    
+    def get_fingerprint(self, related=None):
+        """
+        Return a sha1 hash of the normalized values of all
+        non-relational content fields, and the fingerprints of the
+        objects in FINGERPRINT_RELATIONS. Objects with the same
+        content have the same fingerprint, regardless of how
+        the values were typed in.
+        
+        related is a dict of the fingerprints in each relation, see
+        get_related_fingerprints(), for objects whose relations are
+        not saved yet. By default they are read from the database.
+        """
+        values = []
+        for field in sorted(self._meta.fields, key=lambda f: f.name):
+            if field.rel or field.name in self.FINGERPRINT_EXCLUDE:
+                continue
+            value = getattr(self, field.attname)
+            if value is None or value == "":
+                value = u""
+            else:
+                value = field.to_python(value)
+                if isinstance(value, Decimal):
+                    value = value.quantize(Decimal(1).scaleb(-field.decimal_places),
+                                           context=Context(prec=40))
+                elif isinstance(value, bool):
+                    value = int(value)
+                value = (u"%s" % value).strip()
+            values.append(u"%s=%s" % (field.name, value))
+        if self.FINGERPRINT_RELATIONS:
+            if related is None:
+                related = self.get_related_fingerprints()
+            for name in sorted(self.FINGERPRINT_RELATIONS):
+                fingerprints = related.get(name, [])
+                if not name in self.ORDERED_RELATIONS:
+                    fingerprints = sorted(fingerprints)
+                values.append(u"%s=%s" % (name, u",".join(fingerprints)))
+        return hashlib.sha1(u"\x1f".join(values).encode("utf-8")).hexdigest()
+    
+    @classmethod
+    def normalize_rows(cls, rows):
+        """
+        Apply the normalization rules to rows, a list of
+        dicts of field values, in place.
+        """
+        slugs = {}
+        lowercase = cls.LOWERCASE_FIELDS
+        for row in rows:
+            if not row.get("slug"):
+                name = row.get("name", u"")
+                try:
+                    row["slug"] = slugs[name]
+                except KeyError:
+                    row["slug"] = slugs[name] = slugify(name)
+            for field in lowercase:
+                value = row.get(field)
+                if value:
+                    row[field] = u"%s" % value.lower()
     
-            
+    def clean(self):
+        normalize([self])
+    
+    def save(self, *args, **kwargs):
+        # The fingerprint is made from the cleaned values
+        self.clean()
+        self.fingerprint = self.get_fingerprint()
+        super(BeerXMLBase, self).save(*args, **kwargs)
+    
+
+def get_boil_volume(values):
+    """
+    Return the boil volume calculated from values, a dict of
+    Equipment field values, like a row or an instance __dict__.
+    Missing losses and evaporation count as none, and None is
+    returned when the batch size is missing.
+    """
+    if values.get("batch_size") is None:
+        return None
+    return (values["batch_size"] - (values.get("top_up_water") or 0)
+            - (values.get("trub_chiller_loss") or 0)) \
+           * (1 + (values.get("boil_time") or 0) * (values.get("evap_rate") or 0))
+
+
 class Equipment(BeerXMLBase):
     """
     Database model for equipment
@@ -188,14 +329,16 @@ class Equipment(BeerXMLBase):
     
     @property
     def boil_volume(self):
-        return (self.batch_size - self.top_up_water - self.trub_chiller_loss) \
-                * (1 + self.boil_time * self.evap_rate)
+        return get_boil_volume(self.__dict__)
                 
-    def clean(self):
-        if not self.slug:
-            self.slug = slugify(self.name)
-        if self.calc_boil_volume is True:
-            self.boil_size = self.boil_volume
+    @classmethod
+    def normalize_rows(cls, rows):
+        super(Equipment, cls).normalize_rows(rows)
+        for row in rows:
+            if row.get("calc_boil_volume") is True:
+                boil_volume = get_boil_volume(row)
+                if boil_volume is not None:
+                    row["boil_size"] = boil_volume
       
             
 class Fermentable(BeerXMLBase):
@@ -204,6 +347,8 @@ class Fermentable(BeerXMLBase):
     substantially to the beer including extracts, grains, sugars, honey, fruits.
     """
     
+    LOWERCASE_FIELDS = ("ferm_type",)
+    
     TYPE = (
         (u"grain", u"Grain"),
         (u"sugar", u"Sugar"),
@@ -288,18 +433,15 @@ class Fermentable(BeerXMLBase):
     
     def __unicode__(self):
         return u"%s" % self.name
-
-    def clean(self):
-        if not self.slug:
-            self.slug = slugify(self.name)
-        if self.ferm_type:
-            self.ferm_type = u"%s" % self.ferm_type.lower()
     
     
 class Hop(BeerXMLBase):
     """
     The “Hop” identifier is used to define all varieties of hops.
     """
+    
+    LOWERCASE_FIELDS = ("use", "hop_type", "form")
+    
     USE = (
         (u"boil", u"Boil"),
         (u"dry hop", u"Dry Hop"),
@@ -377,22 +519,15 @@ class Hop(BeerXMLBase):
     
     def __unicode__(self):
         return u"%s" % self.name
-
-    def clean(self):
-        if not self.slug:
-            self.slug = slugify(self.name)
-        if self.use:
-            self.use = u"%s" % self.use.lower()
-        if self.hop_type:
-            self.hop_type = u"%s" % self.hop_type.lower()
-        if self.form:
-            self.form = u"%s" % self.use.lower()
     
 
 class MashStep(BeerXMLBase):
     """
     Used within a Mash profile to record the steps
     """
+    
+    LOWERCASE_FIELDS = ("mash_type",)
+    
     TYPE = (
         (u"infusion", u"Infusion"),
         (u"temperature", u"Temperature"),
@@ -455,12 +590,6 @@ class MashStep(BeerXMLBase):
 
     def __unicode__(self):
         return u"%s" % self.name
-
-    def clean(self):
-        if not self.slug:
-            self.slug = slugify(self.name)
-        if self.mash_type:
-            self.mash_type = u"%s" % self.mash_type.lower()
         
 
 class MashProfile(BeerXMLBase):
@@ -471,6 +600,8 @@ class MashProfile(BeerXMLBase):
     <MASH_STEPS> record that contains the actual mash steps.
     """
     
+    FINGERPRINT_RELATIONS = ORDERED_RELATIONS = ("mash_steps",)
+    
     grain_temp = models.DecimalField(_("grain temperature"), max_digits=14, 
             decimal_places=9, help_text="""The temperature of the grain before 
             adding it to the mash in degrees Celsius.""")
@@ -512,10 +643,6 @@ class MashProfile(BeerXMLBase):
     
     def __unicode__(self):
         return u"%s" % self.name
-    
-    def clean(self):
-        if not self.slug:
-            self.slug = slugify(self.name)
 
 
 class Misc(BeerXMLBase):
@@ -523,6 +650,8 @@ class Misc(BeerXMLBase):
     Database model for various items
     """
     
+    LOWERCASE_FIELDS = ("misc_type", "use")
+    
     TYPE = (
         (u"spice", u"Spice"),
         (u"fining", u"Fining"),
@@ -577,20 +706,14 @@ class Misc(BeerXMLBase):
     def __unicode__(self):
         return u"%s" % self.name
     
-    def clean(self):
-        if not self.slug:
-            self.slug = slugify(self.name)
-        if self.misc_type:
-            self.misc_type = u"%s" % self.misc_type.lower()
-        if self.use:
-            self.use = u"%s" % self.use.lower()
-    
     
 class Yeast(BeerXMLBase):
     """
     Database model for yeast
     """
     
+    LOWERCASE_FIELDS = ("yiest_type", "form", "flocculation")
+    
     TYPE = (
         (u"ale", u"Ale"),
         (u"lager", u"Lager"),
@@ -679,16 +802,6 @@ class Yeast(BeerXMLBase):
     
     def __unicode__(self):
         return u"%s" % self.name
-
-    def clean(self):
-        if not self.slug:
-            self.slug = slugify(self.name)
-        if self.yiest_type:
-            self.yiest_type = u"%s" % self.yiest_type.lower()
-        if self.form:
-            self.form = u"%s" % self.form.lower()
-        if self.flocculation:
-            self.flocculation = u"%s" % self.flocculation.lower()
     
     
 class Water(BeerXMLBase):
@@ -722,16 +835,14 @@ class Water(BeerXMLBase):
     def __unicode__(self):
         return u"%s" % self.name
     
-    def clean(self):
-        if not self.slug:
-            self.slug = slugify(self.name)
-    
     
 class Style(BeerXMLBase):
     """
     Database model for brewing styles
     """
     
+    LOWERCASE_FIELDS = ("style_type",)
+    
     TYPE = (
         (u"lager", u"Lager"),
         (u"ale", u"Ale"),
@@ -839,18 +950,63 @@ class Style(BeerXMLBase):
     
     def __unicode__(self):
         return u"%s" % self.name
+    
+    
+class RecipeQuerySet(models.query.QuerySet):
+    """
+    Recipe queryset which can load whole recipe
+    graphs with a fixed number of queries.
+    """
+    # Set by with_graph(), to load the mash steps in order
+    _with_mash_steps = False
+    
+    def _clone(self, *args, **kwargs):
+        clone = super(RecipeQuerySet, self)._clone(*args, **kwargs)
+        clone._with_mash_steps = self._with_mash_steps
+        return clone
+    
+    def _prefetch_related_objects(self):
+        super(RecipeQuerySet, self)._prefetch_related_objects()
+        if self._with_mash_steps:
+            graph.attach_mash_steps(self._result_cache)
+    
+    def with_graph(self):
+        """
+        Load the style, equipment, mash profile and steps, ingredients,
+        options and stats along with each recipe, see beerxml.graph.
+        """
+        return graph.with_graph(self)
+    
+    def graphs(self):
+        """
+        Return the recipes as read-only records, with their
+        whole graph, see beerxml.graph.recipe_graphs().
+        """
+        return graph.recipe_graphs(self)
+    
 
-    def clean(self):
-        if not self.slug:
-            self.slug = slugify(self.name)
-        if self.style_type:
-            self.style_type = u"%s" % self.style_type.lower()
+class RecipeManager(models.Manager):
+    
+    def get_query_set(self):
+        return RecipeQuerySet(self.model, using=self._db)
     
+    def with_graph(self):
+        return self.get_query_set().with_graph()
     
+    def graphs(self):
+        return self.get_query_set().graphs()
+    
+
 class Recipe(BeerXMLBase):
     """
     Database model for reciepes
     """
+    
+    LOWERCASE_FIELDS = ("recipe_type", "ibu_method")
+    FINGERPRINT_RELATIONS = ("hops", "fermentables", "miscs", "yeasts", "waters")
+    
+    objects = RecipeManager()
+    
     TYPE = (
         (u"extract", u"Extract"),
         (u"partial mash", u"Partial Mash"),
@@ -1027,14 +1183,6 @@ class Recipe(BeerXMLBase):
     
     def __unicode__(self):
         return u"%s" % self.name
-
-    def clean(self):
-        if not self.slug:
-            self.slug = slugify(self.name)
-        if self.recipe_type:
-            self.recipe_type = u"%s" % self.recipe_type.lower()
-        if self.ibu_method:
-            self.ibu_method = u"%s" % self.ibu_method.lower()
     
     
 
@@ -1064,6 +1212,12 @@ class RecipeOption(models.Model):
         (1, u"Fahrenheit")
     )
 
+    PRESSURE = (
+        (0, u"Kilopascals"),
+        (1, u"Pounds per square inch"),
+        (2, u"Bar")
+    )
+
     GRAVITY = (
         (0, u"20C/20C Specific gravity"),
         (1, u"Plato/Brix/Bailing")
@@ -1095,6 +1249,8 @@ class RecipeOption(models.Model):
     temperature = models.PositiveSmallIntegerField(_("temperature units"), 
             choices=TEMPERATURE, default=1, help_text="""Temperature units for 
             this recipe""")
+    pressure = models.PositiveSmallIntegerField(_("pressure units"), 
+            choices=PRESSURE, default=1, help_text="Pressure units for this recipe")
     gravity = models.PositiveSmallIntegerField(_("gravity units"), 
             choices=GRAVITY, default=0, help_text="Gravity units for this recipe")
     color = models.PositiveSmallIntegerField(_("color system"), choices=COLOR, 
@@ -1118,58 +1274,220 @@ class RecipeOption(models.Model):
     def clean(self):
         if not self.slug:
             self.slug = slugify("%s-recipe-options" % self.recipe)
+    
+    def save(self, *args, **kwargs):
+        self.clean()
+        super(RecipeOption, self).save(*args, **kwargs)
+
+
+class RecipeStats(models.Model):
+    """
+    Estimated values calculated from the ingredients of a 
+    recipe. Kept up to date when the recipe or its ingredients
+    change, so recipes can be sorted and filtered on them.
+    """
+    
+    class Meta:
+        app_label = "brewery"
+        verbose_name_plural = "recipe stats"
+    
+    recipe = models.OneToOneField(Recipe, primary_key=True, related_name="stats")
+    og = models.DecimalField(_("estimated OG"), max_digits=14, decimal_places=9,
+            db_index=True)
+    fg = models.DecimalField(_("estimated FG"), max_digits=14, decimal_places=9,
+            db_index=True)
+    color = models.DecimalField(_("estimated color (SRM)"), max_digits=14, 
+            decimal_places=9, db_index=True)
+    ibu = models.DecimalField(_("estimated IBU"), max_digits=14, decimal_places=9,
+            db_index=True)
+    abv = models.DecimalField(_("estimated ABV %"), max_digits=14, decimal_places=9,
+            db_index=True)
+    mdt = models.DateTimeField(_("modified"), editable=False, auto_now=True)
+    
+    def __unicode__(self):
+        return u"%s stats" % self.recipe_id
+
+
+#
+# Normalization
+#
+# Brewery models translate some BeerXML values to brewery
+# compatible values before they are saved, following the rules
+# declared on each model (see BeerXMLBase.normalize_rows()).
+# save() applies them to one instance, and normalize() to any
+# number of instances or BeerXMLNodes at once, e.g. before a
+# bulk insert, which sends no signals and calls no save().
+
+def normalize(objects):
+    """
+    Normalize a list of model instances or BeerXMLNodes, in place.
+    Nodes and instances of different models may be mixed. Returns
+    objects.
+    """
+    groups = {}
+    for obj in objects:
+        if isinstance(obj, BeerXMLBase):
+            # The field values of an instance live in its __dict__
+            groups.setdefault(obj.__class__, []).append(obj.__dict__)
+        else:
+            groups.setdefault(obj._model, []).append(obj)
+    for model, rows in groups.iteritems():
+        model.normalize_rows(rows)
+    return objects
 
 
 #
 # Signals
 #
-# Brewery models depend on model cleaning to
-# translate some BeerXML values to brewery compatible
-# values. We need to hook onto the pre_save signal on
-# each model to achieve that.
-# NOTE: This is not very DRY, can it be done better?
 
-@receiver(signals.pre_save, sender=Equipment)
-def clean_equipment_callback(sender, instance, **kwargs):
-    instance.clean()
+# clear() sends no pk_set, so receivers of a reverse clear(), like
+# hop.recipe_set.clear(), read the pks of the objects it changes on
+# pre_clear with remember_cleared(), and get them on post_clear
+# from cleared_pks().
 
-@receiver(signals.pre_save, sender=Fermentable)
-def clean_fermentable_callback(sender, instance, **kwargs):
-    instance.clean()
-    
-@receiver(signals.pre_save, sender=Hop)
-def clean_hop_callback(sender, instance, **kwargs):
-    instance.clean()
-    
-@receiver(signals.pre_save, sender=MashStep)
-def clean_mash_step_callback(sender, instance, **kwargs):
-    instance.clean()
-    
-@receiver(signals.pre_save, sender=MashProfile)
-def clean_mash_profile_callback(sender, instance, **kwargs):
-    instance.clean()
-    
-@receiver(signals.pre_save, sender=Misc)
-def clean_misc_callback(sender, instance, **kwargs):
-    instance.clean()
-    
-@receiver(signals.pre_save, sender=Yeast)
-def clean_yeast_callback(sender, instance, **kwargs):
-    instance.clean()
-    
-@receiver(signals.pre_save, sender=Water)
-def clean_water_callback(sender, instance, **kwargs):
-    instance.clean()
-    
-@receiver(signals.pre_save, sender=Style)
-def clean_style_callback(sender, instance, **kwargs):
-    instance.clean()
+def remember_cleared(key, instance, queryset):
+    cleared = instance.__dict__.setdefault("_cleared_pks", {})
+    cleared[key] = set(queryset.values_list("pk", flat=True))
+
+def cleared_pks(key, instance):
+    return instance.__dict__.get("_cleared_pks", {}).pop(key, set())
+
+# BeerXMLBase.save() sets the fingerprint. The fingerprints of
+# records with FINGERPRINT_RELATIONS also change when objects are
+# added to or removed from the relations, or when the related
+# objects change, which do not save the record itself.
+
+def refresh_fingerprints(model, pks):
+    """
+    Update the stored fingerprints of the objects of model with
+    pks, a list or a values queryset, reading their relations
+    with one query per relation.
+    """
+    objects = list(model.objects.filter(pk__in=pks))
+    related = model.get_related_fingerprints_many([obj.pk for obj in objects])
+    changed = []
+    for obj in objects:
+        fingerprint = obj.get_fingerprint(related[obj.pk])
+        if fingerprint != obj.fingerprint:
+            changed.append((fingerprint, obj.pk))
+    if changed:
+        using = router.db_for_write(model)
+        qn = connections[using].ops.quote_name
+        connections[using].cursor().executemany("UPDATE %s SET %s = %%s WHERE %s = %%s" 
+            % (qn(model._meta.db_table), qn(model._meta.get_field("fingerprint").column),
+               qn(model._meta.pk.column)), changed)
+        transaction.commit_unless_managed(using=using)
+
+_fingerprint_owners = {}     # through model -> (model with the relation, relation name)
+_fingerprint_targets = {}    # related model -> [(model, relation name)]
+
+def related_fingerprint_callback(sender, instance, action, reverse, pk_set, **kwargs):
+    model, name = _fingerprint_owners[sender]
+    key = (related_fingerprint_callback, sender)
+    if reverse and action == "pre_clear":
+        remember_cleared(key, instance, model.objects.filter(**{name: instance}))
+    if not action in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        instance.fingerprint = instance.get_fingerprint()
+        model.objects.filter(pk=instance.pk).update(fingerprint=instance.fingerprint)
+        return
+    if action == "post_clear":
+        pk_set = cleared_pks(key, instance)
+    if pk_set:
+        refresh_fingerprints(model, list(pk_set))
+
+def related_content_callback(sender, instance, created=False, raw=False, **kwargs):
+    # New objects are not related to anything yet
+    if raw or created:
+        return
+    for model, name in _fingerprint_targets[sender]:
+        refresh_fingerprints(model, model.objects.filter(**{name: instance}).values("pk"))
+
+def connect_fingerprint_relations(models):
+    for model in models:
+        for name in model.FINGERPRINT_RELATIONS:
+            field = model._meta.get_field(name)
+            _fingerprint_owners[field.rel.through] = (model, name)
+            _fingerprint_targets.setdefault(field.rel.to, []).append((model, name))
+            signals.m2m_changed.connect(related_fingerprint_callback,
+                                        sender=field.rel.through)
+            signals.post_save.connect(related_content_callback, sender=field.rel.to)
+
+connect_fingerprint_relations((MashProfile, Recipe))
+
+
+#
+# Recipe stats
+#
+# RecipeStats are refreshed whenever something they are
+# calculated from is saved. The calculations module imports
+# the models, so it is imported when needed.
+
+def refresh_stats(recipes):
+    from brewery.beerxml.calculations import update_stats
+    update_stats(recipes)
+
+@receiver(signals.post_save, sender=Recipe)
+def recipe_stats_callback(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_stats(Recipe.objects.filter(pk=instance.pk))
+
+@receiver(signals.post_save, sender=RecipeOption)
+@receiver(signals.post_delete, sender=RecipeOption)
+def recipe_option_stats_callback(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_stats(Recipe.objects.filter(pk=instance.recipe_id))
+
+@receiver(signals.post_save, sender=Equipment)
+@receiver(signals.post_save, sender=Fermentable)
+@receiver(signals.post_save, sender=Hop)
+@receiver(signals.post_save, sender=Yeast)
+def ingredient_stats_callback(sender, instance, created=False, raw=False, **kwargs):
+    # New ingredients are not part of any recipe yet
+    if not raw and not created:
+        field = {Equipment: "equipment", Fermentable: "fermentables",
+                 Hop: "hops", Yeast: "yeasts"}[sender]
+        refresh_stats(Recipe.objects.filter(**{field: instance}))
+
+_stats_relations = {Recipe.fermentables.through: "fermentables",
+                    Recipe.hops.through: "hops", Recipe.yeasts.through: "yeasts"}
+
+@receiver(signals.m2m_changed, sender=Recipe.fermentables.through)
+@receiver(signals.m2m_changed, sender=Recipe.hops.through)
+@receiver(signals.m2m_changed, sender=Recipe.yeasts.through)
+def recipe_ingredients_stats_callback(sender, instance, action, reverse, pk_set, **kwargs):
+    key = (recipe_ingredients_stats_callback, sender)
+    if reverse and action == "pre_clear":
+        remember_cleared(key, instance, 
+                         Recipe.objects.filter(**{_stats_relations[sender]: instance}))
+    if not action in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        refresh_stats(Recipe.objects.filter(pk=instance.pk))
+        return
+    if action == "post_clear":
+        pk_set = cleared_pks(key, instance)
+    if pk_set:
+        refresh_stats(Recipe.objects.filter(pk__in=pk_set))
+
+
+#
+# Search
+#
+# The search indexes of styles and recipes are updated when they
+# are saved or deleted. The search module imports the models, so
+# it is imported when needed.
+
+@receiver(signals.post_save, sender=Style)
+@receiver(signals.post_save, sender=Recipe)
+def update_search_index_callback(sender, instance, raw=False, **kwargs):
+    if not raw:
+        from brewery.beerxml.search import update_objects
+        update_objects(sender, [instance])
 
-@receiver(signals.pre_save, sender=Recipe)
-def clean_recipe_callback(sender, instance, **kwargs):
-    instance.clean()
-    
-@receiver(signals.pre_save, sender=RecipeOption)
-def clean_recipe_option_callback(sender, instance, **kwargs):
-    instance.clean()
-    
\ No newline at end of file
+@receiver(signals.post_delete, sender=Style)
+@receiver(signals.post_delete, sender=Recipe)
+def remove_search_index_callback(sender, instance, **kwargs):
+    from brewery.beerxml.search import remove_objects
+    remove_objects(sender, [instance.pk])
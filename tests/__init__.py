@@ -2,6 +2,11 @@
 
 import os
 
+# Private names, as the test modules imported below are
+# imported into this module with their names.
+from brewery.beerxml.parser import iter_beerxml as _iter_beerxml
+from brewery.beerxml.bulk import bulk_get_or_create as _bulk_get_or_create
+
 EXAMPLES_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 
                             "beerxml-examples")
 FILES = ("equipment.xml", "grain.xml", "hops.xml", "mash.xml",
@@ -10,6 +15,26 @@ FILES = ("equipment.xml", "grain.xml", "hops.xml", "mash.xml",
 
 __all__ = ("EXAMPLES_DIR", "FILES")
 
+
+class RecipesFixtureMixin(object):
+    """
+    Imports the recipes in recipes.xml before each test.
+    """
+    def setUp(self):
+        _bulk_get_or_create(list(_iter_beerxml(
+            path=os.path.join(EXAMPLES_DIR, "recipes.xml"))))
+
+
 from brewery.tests.parser import *
 from brewery.tests.nodes import *
-from brewery.tests.formulas import *
\ No newline at end of file
+from brewery.tests.formulas import *
+from brewery.tests.ingest import *
+from brewery.tests.bulk import *
+from brewery.tests.calculations import *
+from brewery.tests.mashing import *
+from brewery.tests.waters import *
+from brewery.tests.styles import *
+from brewery.tests.search import *
+from brewery.tests.similarity import *
+from brewery.tests.display import *
+from brewery.tests.graph import *
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import os
+from django.test import TestCase
+from django.contrib.auth.models import User
+
+from brewery.beerxml import parser, search
+from brewery.beerxml.bulk import bulk_get_or_create
+from brewery.models import Hop, MashProfile, Style
+from brewery.tests import FILES, EXAMPLES_DIR
+
+class BulkGetOrCreateTestCase(TestCase):
+    """
+    Test bulk persistence of BeerXMLNodes
+    """
+    def load(self, f):
+        with open(os.path.join(EXAMPLES_DIR, f), "r") as fname:
+            return list(parser.iter_beerxml(fname))
+    
+    def tearDown(self):
+        search.clear_indexes()
+    
+    def test_bulk_get_or_create(self):
+        """
+        Save all example files, and make sure
+        relations are saved too
+        """
+        for f in FILES:
+            nodes = self.load(f)
+            results = bulk_get_or_create(nodes)
+            self.assertEqual(len(results), len(nodes))
+            for node, (obj, created) in zip(nodes, results):
+                self.assertIsInstance(obj, node._model)
+                self.assertTrue(obj.pk)
+                self.assertEqual(obj.name, node["name"])
+        
+        nodes = self.load("recipes.xml")
+        for node, (recipe, created) in zip(nodes, bulk_get_or_create(nodes)):
+            self.assertFalse(created)
+            self.assertEqual(recipe.style.name, node["style"]["name"])
+            self.assertEqual(sorted(recipe.hops.values_list("name", flat=True)),
+                             sorted([h["name"] for h in node["hops"]]))
+            # only identical mash profiles are shared between recipes
+            self.assertEqual(sorted(recipe.mash.mash_steps.values_list("name", flat=True)),
+                             sorted([s["name"] for s in node["mash"]["mash_steps"]]))
+            self.assertTrue(recipe.slug)
+    
+    def test_document_order(self):
+        """
+        Mash steps keep the order of the document, which is
+        the order of the rows in the many-to-many table
+        """
+        nodes = self.load("recipes.xml")
+        through = MashProfile.mash_steps.through.objects.order_by("pk")
+        for node, (recipe, created) in zip(nodes, bulk_get_or_create(nodes)):
+            if node.get("mash") is None:
+                continue
+            steps = through.filter(mashprofile=recipe.mash_id)
+            self.assertEqual(list(steps.values_list("mashstep__name", flat=True)),
+                             [s["name"] for s in node["mash"]["mash_steps"]])
+    
+    def test_reuses_existing_rows(self):
+        """
+        Saving the same nodes twice creates no new rows, and
+        rows saved by get_or_create() are reused
+        """
+        nodes = self.load("hops.xml")
+        obj, created = nodes[0].get_or_create()
+        results = bulk_get_or_create(nodes)
+        self.assertEqual(results[0], (obj, False))
+        self.assertTrue(all(created for obj, created in results[1:]))
+        count = Hop.objects.count()
+        
+        results = bulk_get_or_create(self.load("hops.xml"))
+        self.assertFalse(any(created for obj, created in results))
+        self.assertEqual(Hop.objects.count(), count)
+    
+    def test_inherit(self):
+        user = User.objects.create(username="brewer")
+        for obj, created in bulk_get_or_create(self.load("style.xml"), 
+                                               inherit={"registered_by": user}):
+            self.assertEqual(obj.registered_by, user)
+        self.assertFalse(Style.objects.filter(registered_by__isnull=True).exists())
+    
+    def test_number_of_queries(self):
+        """
+        Queries depend on the number of models and many-to-many
+        tables (10 and 6 for recipes.xml), not the number of rows
+        """
+        nodes = self.load("recipes.xml")
+        # delete and insert per FTS5 search table
+        indexes = [search.get_index(model) for model in search.SEARCH_FIELDS]
+        fts5 = len([i for i in indexes if isinstance(i, search.FTS5Index)]) * 2
+        # find, insert and read back per model, find and insert per 
+        # many-to-many table, and calculate, delete and insert recipe stats
+        with self.assertNumQueries(10 * 3 + 6 * 2 + 6 + fts5):
+            bulk_get_or_create(nodes)
+        # nothing else to insert on the second run, but
+        # the existing stats are deleted before inserting
+        with self.assertNumQueries(10 + 6 + 7):
+            bulk_get_or_create(nodes)
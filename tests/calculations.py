@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+from decimal import Decimal
+from django.test import TestCase
+from django.core.management import call_command
+
+from brewery.beerxml import calculations
+from brewery.models import Hop, Recipe, RecipeOption, RecipeStats
+from brewery.tests import RecipesFixtureMixin
+
+class CalculationsTestCase(RecipesFixtureMixin, TestCase):
+    """
+    Test the recipe calculations
+    """
+    def test_calculate(self):
+        """
+        Estimated gravities are close to the gravities
+        measured for the example recipes
+        """
+        for recipe in Recipe.objects.all():
+            with self.assertNumQueries(4):
+                estimates = calculations.calculate(recipe.pk)
+            self.assertAlmostEqual(estimates["og"], float(recipe.og), places=2)
+            self.assertAlmostEqual(estimates["fg"], float(recipe.fg), places=2)
+            self.assertTrue(estimates["fg"] < estimates["og"])
+            self.assertTrue(0 < estimates["color"] < 50)
+            self.assertTrue(0 < estimates["ibu"] < 120)
+            self.assertAlmostEqual(estimates["abv"], 
+                                   (estimates["og"] - estimates["fg"]) * 133.33, places=2)
+    
+    def test_ibu_formula(self):
+        recipe = Recipe.objects.get(name="Dry Stout")
+        option = RecipeOption.objects.create(recipe=recipe)
+        results = {}
+        for formula, name in RecipeOption.IBU_FORMULA:
+            option.ibu_formula = formula
+            option.save()
+            results[formula] = calculations.calculate(recipe.pk)["ibu"]
+            self.assertTrue(20 < results[formula] < 60, "%s: %s" % (name, results[formula]))
+        self.assertEqual(len(set(results.values())), 3)
+        
+        # without options, the recipe's own ibu method is used
+        option.delete()
+        Recipe.objects.filter(pk=recipe.pk).update(ibu_method="rager")
+        self.assertEqual(calculations.calculate(recipe.pk)["ibu"], results[1])
+    
+    def test_calculate_many(self):
+        """
+        The batch calculations give the same results, with
+        four queries per chunk of recipes
+        """
+        RecipeOption.objects.create(recipe=Recipe.objects.all()[0], 
+                                    color_formula=0, ibu_formula=2)
+        with self.assertNumQueries(3 * 4):
+            results = list(calculations.calculate_many(Recipe.objects.all(), chunk_size=4))
+        self.assertEqual([pk for pk, estimates in results], 
+                         list(Recipe.objects.order_by("pk").values_list("pk", flat=True)))
+        for pk, estimates in results:
+            self.assertEqual(estimates, calculations.calculate(pk))
+    
+    def test_recalculate(self):
+        recipe = Recipe.objects.get(name="Dry Stout")
+        RecipeOption.objects.create(recipe=recipe, gravity=1, color=1)
+        self.assertEqual(calculations.recalculate(Recipe.objects.all()), 9)
+        
+        estimates = calculations.calculate(recipe.pk)
+        recipe = Recipe.objects.get(pk=recipe.pk)
+        self.assertTrue(recipe.est_og.endswith(u"°P"))
+        self.assertEqual(recipe.est_color, u"%.1f EBC" % (estimates["color"] * 1.97))
+        self.assertEqual(recipe.ibu, Decimal("%.1f" % estimates["ibu"]))
+        self.assertEqual(recipe.est_abv, Decimal("%.1f" % estimates["abv"]))
+        
+        other = Recipe.objects.exclude(pk=recipe.pk)[0]
+        self.assertEqual(other.est_og, u"%.3f sg" % calculations.calculate(other)["og"])
+        self.assertTrue(other.est_color.endswith(u"SRM"))
+
+
+class RecipeStatsTestCase(RecipesFixtureMixin, TestCase):
+    """
+    Test that recipe stats are kept up to date
+    """
+    def setUp(self):
+        super(RecipeStatsTestCase, self).setUp()
+        self.recipe = Recipe.objects.get(name="Dry Stout")
+    
+    def assertStats(self, recipe):
+        stats = RecipeStats.objects.get(recipe=recipe)
+        for key, value in calculations.calculate(recipe.pk).iteritems():
+            self.assertEqual(getattr(stats, key), Decimal("%.9f" % value))
+    
+    def test_bulk_import(self):
+        self.assertEqual(RecipeStats.objects.count(), Recipe.objects.count())
+        for recipe in Recipe.objects.all():
+            self.assertStats(recipe)
+    
+    def test_incremental_refresh(self):
+        ibu = self.recipe.stats.ibu
+        hop = Hop.objects.filter(use="boil", time__gt=10).exclude(recipe=self.recipe)[0]
+        self.recipe.hops.add(hop)
+        self.assertStats(self.recipe)
+        self.assertTrue(RecipeStats.objects.get(recipe=self.recipe).ibu > ibu)
+        
+        self.recipe.hops.remove(hop)
+        self.assertEqual(RecipeStats.objects.get(recipe=self.recipe).ibu, ibu)
+        hop.recipe_set.add(self.recipe)
+        self.assertStats(self.recipe)
+        
+        hop.alpha += 2
+        hop.save()
+        for recipe in hop.recipe_set.all():
+            self.assertStats(recipe)
+        
+        self.recipe.fermentables.clear()
+        self.assertEqual(RecipeStats.objects.get(recipe=self.recipe).og, 1)
+        
+        # Clearing from the ingredient side refreshes all its recipes
+        recipes = list(hop.recipe_set.all())
+        self.assertTrue(recipes)
+        hop.recipe_set.clear()
+        for recipe in recipes:
+            self.assertStats(recipe)
+        
+        RecipeOption.objects.create(recipe=self.recipe, ibu_formula=1)
+        self.assertStats(self.recipe)
+    
+    def test_sort_and_filter(self):
+        with self.assertNumQueries(1):
+            recipes = list(Recipe.objects.filter(stats__ibu__gt=20)
+                           .order_by("-stats__ibu").values_list("name", "stats__ibu"))
+        self.assertTrue(recipes)
+        self.assertEqual(recipes, sorted(recipes, key=lambda r: r[1], reverse=True))
+    
+    def test_rebuild_command(self):
+        RecipeStats.objects.all().delete()
+        call_command("rebuild_recipe_stats", verbosity=0)
+        for recipe in Recipe.objects.all():
+            self.assertStats(recipe)
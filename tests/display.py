@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from django.test import TestCase
+
+from brewery.beerxml import parser, display
+from brewery.beerxml.bulk import bulk_get_or_create
+from brewery.beerxml.display import DisplayValue, LRUCache
+from brewery.models import Equipment, Recipe, RecipeOption
+from brewery.tests import EXAMPLES_DIR, RecipesFixtureMixin
+
+class DisplayTestCase(TestCase):
+    """
+    Test parsing of display strings
+    """
+    def setUp(self):
+        display.clear_cache()
+    
+    def test_parse(self):
+        for text, expected in (
+                (u"5.00 gal", (5.0, u"gal")),
+                (u"64 F", (64.0, u"F")),
+                (u"64°F", (64.0, u"F")),
+                (u"18.5 °P", (18.5, u"plato")),
+                (u"20 deg C", (20.0, u"C")),
+                (u"1.050 SG", (1.05, u"sg")),
+                (u"5.00 gm", (5.0, u"g")),
+                (u"2 Tbsp", (2.0, u"tblsp")),
+                (u"1,5 kg", (1.5, u"kg")),
+                (u"-1.5 C", (-1.5, u"C")),
+                (u".5 oz", (0.5, u"oz")),
+                (u"2.4 vols", (2.4, u"vols")),
+                (u"72.0", (72.0, None)),
+                (u"  12 Furlongs ", (12.0, u"Furlongs")),
+                (u"-", (None, None)),
+                (u"", (None, None)),
+                (None, (None, None)),
+                (u"about 5 gal", (None, None))):
+            self.assertEqual(display.parse(text), DisplayValue(*expected), text)
+    
+    def test_convert(self):
+        self.assertAlmostEqual(display.convert(u"5.00 gal", "l"), 18.92705892)
+        self.assertAlmostEqual(display.convert(u"212 F", "C"), 100)
+        self.assertAlmostEqual(display.convert(u"8 oz", "kg"), 0.226796185)
+        self.assertEqual(display.convert(u"72.0", "C"), 72.0)
+        self.assertEqual(display.convert(u"5 gal", "kg"), None)
+        self.assertEqual(display.convert(u"1.050 SG", "l"), None)
+        self.assertEqual(display.convert(u"-", "l"), None)
+        
+        # oz is both a weight and a volume
+        self.assertAlmostEqual(display.convert(u"8 oz", "l"), 0.2365882365)
+        self.assertAlmostEqual(display.convert(u"1 lb", "oz", "weight"), 16)
+        self.assertAlmostEqual(display.convert(u"1 cup", "oz", "volume"), 8)
+        self.assertEqual(display.convert(u"1 cup", "oz", "weight"), None)
+        self.assertRaises(ValueError, display.convert, u"8 oz", "oz")
+        self.assertRaises(ValueError, display.convert, u"8 oz", "kg", "volume")
+    
+    def test_cache(self):
+        for i in xrange(1000):
+            display.parse(u"5.00 gal")
+        self.assertEqual(display._cache.misses, 1)
+        self.assertEqual(display._cache.hits, 999)
+    
+    def test_lru(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        # b was the least recently used
+        self.assertFalse("b" in cache)
+        self.assertTrue("a" in cache and "c" in cache)
+        self.assertEqual(len(cache), 2)
+        
+        cache.set("a", 4)
+        cache.set("d", 5)
+        self.assertEqual(cache.get("a"), 4)
+        self.assertEqual(cache.get("c"), None)
+        self.assertEqual(cache.get("d"), 5)
+        
+        # Against a plain list of the keys, least recently used first
+        cache, keys = LRUCache(10), []
+        for i in xrange(1000):
+            key = (i * 7919) % 23
+            if key in keys:
+                keys.remove(key)
+                self.assertEqual(cache.get(key), key)
+            else:
+                self.assertEqual(cache.get(key), None)
+                cache.set(key, key)
+                keys = keys[-9:]
+            keys.append(key)
+            self.assertEqual(sorted(cache.items), sorted(keys))
+    
+    def test_lru_threads(self):
+        cache = LRUCache(50)
+        def work(seed):
+            for i in xrange(5000):
+                key = (i * seed) % 97
+                if cache.get(key) is None:
+                    cache.set(key, key)
+        threads = [threading.Thread(target=work, args=(seed,)) for seed in (7919, 104729, 1299709, 15485863)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        # The list still links every item once, in both directions
+        self.assertEqual(len(cache), 50)
+        keys, link = [], cache.root[1]
+        while link is not cache.root:
+            self.assertTrue(link[1][0] is link)
+            keys.append(link[2])
+            link = link[1]
+        self.assertEqual(sorted(keys), sorted(cache.items))
+        self.assertEqual(cache.hits + cache.misses, 4 * 5000)
+    
+    def test_parse_column(self):
+        bulk_get_or_create(list(parser.iter_beerxml(path=os.path.join(EXAMPLES_DIR, "equipment.xml"))))
+        count = Equipment.objects.count()
+        with self.assertNumQueries(count // 2 + 1):
+            results = list(display.parse_column(Equipment.objects.all(), "display_batch_size",
+                                                chunk_size=2))
+        self.assertEqual(len(results), count)
+        for pk, value in results:
+            self.assertEqual(value, display.parse(Equipment.objects.get(pk=pk).display_batch_size))
+        self.assertTrue([v for pk, v in results if v.unit == u"gal"])
+
+
+class RecipeUnitsTestCase(RecipesFixtureMixin, TestCase):
+    """
+    Test the display units of recipes
+    """
+    def test_recipe_units(self):
+        recipe = Recipe.objects.order_by("pk")[0]
+        RecipeOption.objects.filter(recipe=recipe).delete()
+        RecipeOption.objects.create(recipe=recipe, weight=0, volume=2, temperature=0,
+                                    pressure=2)
+        with self.assertNumQueries(1):
+            units = display.recipe_units(Recipe.objects.all())
+        self.assertEqual(len(units), Recipe.objects.count())
+        self.assertEqual(units[recipe.pk]["weight"], "kg")
+        self.assertEqual(units[recipe.pk]["small volume"], "imp oz")
+        self.assertEqual(units[recipe.pk]["temperature"], "C")
+        self.assertEqual(units[recipe.pk]["pressure"], "bar")
+        other = Recipe.objects.exclude(pk=recipe.pk).filter(recipeoption__isnull=True)[0]
+        self.assertEqual(units[other.pk]["volume"], "gal")
+        self.assertEqual(units[other.pk]["temperature"], "F")
+        self.assertEqual(units[other.pk]["pressure"], "psi")
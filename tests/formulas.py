@@ -20,7 +20,344 @@ class BitternessTestCase(TestCase):
         tinseth = bitterness.Tinseth()
         btf = tinseth.boil_time_factor(self.boil_time_minutes)
         
-        diff = abs(btf - 0.978140252219)
+        diff = abs(btf - 0.219104107641)
         delta = 0.000000000001
         self.assertTrue(diff < delta,
-                "difference: %s is not less than %s" % (diff, delta))
\ No newline at end of file
+                "difference: %s is not less than %s" % (diff, delta))
+    
+    def test_garetz_utilization_table(self):
+        garetz = bitterness.Garetz()
+        table = garetz.utilization_table
+        for minutes, utilization in ((0, 0), (10, 0), (10.5, 2), (15, 2), (15.0, 2), 
+                                     (31, 14), (59.9, 20), (60, 20), (60.0, 20), 
+                                     (61, 21), (90, 23), (91, 23), (240, 23)):
+            self.assertEqual(table[minutes], utilization)
+            self.assertEqual(garetz.utilization_percentage(minutes), utilization)
+        self.assertEqual(table.get(25), 8)
+        self.assertEqual(table.lookup([5, 25, 100]), [0, 8, 23])
+        
+        # interpolated between the boil times in the table
+        for minutes, utilization in ((0, 0), (5, 0), (12.5, 1), (55, 19.5), 
+                                     (60, 20), (100, 23)):
+            self.assertEqual(garetz.utilization_percentage(minutes, interpolate=True), 
+                             utilization)
+        self.assertEqual(table.lookup([12.5, 55], interpolate=True), [1, 19.5])
+    
+    def test_garetz_gravity_factor(self):
+        garetz = bitterness.Garetz()
+        self.assertAlmostEqual(garetz.gravity_factor(1.070), 1.1)
+        self.assertEqual(garetz.gravity_factor(1.040), 1)
+
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from django.utils import unittest
+from brewery.beerxml.formulas import color, gravity, vectorized
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class VectorizedTestCase(TestCase):
+    """
+    Test that the vectorized formulas give the
+    same results as the scalar formulas
+    """
+    
+    def setUp(self):
+        random = numpy.random.RandomState(42)
+        self.offsets = numpy.array([0, 3, 3, 4, 8])     # second recipe has no additions
+        self.times = numpy.array([60, 15, 5, 90, 60, 45, 20, 1])
+        self.alpha = random.uniform(0.03, 0.15, 8)
+        self.grams = random.uniform(5, 100, 8)
+        self.gravity = random.uniform(1.030, 1.100, 4)
+        self.batch_size = random.uniform(10, 40, 4)
+        
+    def assertClose(self, a, b):
+        self.assertTrue(numpy.allclose(a, b, rtol=1e-12, atol=0), "%s != %s" % (a, b))
+    
+    def per_recipe(self, func):
+        """
+        Sum scalar func(addition, recipe) for each recipe.
+        """
+        return [sum(func(i, r) for i in xrange(self.offsets[r], self.offsets[r + 1]))
+                for r in xrange(len(self.offsets) - 1)]
+    
+    def test_segments(self):
+        self.assertEqual(vectorized.segment_ids(self.offsets).tolist(), 
+                         [0, 0, 0, 2, 3, 3, 3, 3])
+        self.assertEqual(vectorized.segment_sum(range(8), self.offsets).tolist(),
+                         [3, 0, 3, 22])
+        self.assertEqual(vectorized.expand([1, 2, 3, 4], self.offsets).tolist(),
+                         [1, 1, 1, 3, 4, 4, 4, 4])
+    
+    def test_color(self):
+        mcu = vectorized.recipe_mcu(self.alpha * 100, self.grams, self.offsets, 
+                                    self.batch_size)
+        self.assertClose(mcu, self.per_recipe(lambda i, r: color.mcu(
+                self.alpha[i] * 100, self.grams[i], self.batch_size[r])))
+        for name in ("srm_to_ebc", "mosher", "daniels", "morey"):
+            self.assertClose(getattr(vectorized, name)(mcu),
+                             [getattr(color, name)(float(v)) for v in mcu])
+    
+    def test_gravity(self):
+        og, fg = self.gravity, self.gravity - 0.02
+        for name in ("specific_gravity", "alcohol_by_volume", "true_extract", 
+                     "true_attenuation"):
+            self.assertClose(getattr(vectorized, name)(og, fg),
+                [getattr(gravity, name)(float(o), float(f)) for o, f in zip(og, fg)])
+        for name in ("gravity_to_plato", "gravity_to_brix"):
+            self.assertClose(getattr(vectorized, name)(og),
+                             [getattr(gravity, name)(float(o)) for o in og])
+        self.assertClose(vectorized.plato_to_gravity([10, 12.5]), 
+                         [gravity.plato_to_gravity(10), gravity.plato_to_gravity(12.5)])
+        self.assertClose(vectorized.alcohol_by_weight([5.0, 7.0], [1.010, 1.012]),
+                         [gravity.alcohol_by_weight(5.0, 1.010), 
+                          gravity.alcohol_by_weight(7.0, 1.012)])
+    
+    def test_tinseth(self):
+        scalar, vector = bitterness.Tinseth(), vectorized.Tinseth()
+        def ibu(i, r):
+            utilization = scalar.alpha_acid_utilization(
+                scalar.bigness_factor(self.gravity[r]),
+                scalar.boil_time_factor(self.times[i]))
+            return scalar.ibu(utilization, scalar.mg_alpha_acids(
+                self.alpha[i], self.grams[i], self.batch_size[r]))
+        self.assertClose(vector.recipe_ibu(self.alpha, self.grams, self.times, 
+                                           self.offsets, self.gravity, self.batch_size),
+                         self.per_recipe(ibu))
+    
+    def test_rager(self):
+        scalar, vector = bitterness.Rager(), vectorized.Rager()
+        def ibu(i, r):
+            return scalar.ibu(self.grams[i], scalar.utilization_percentage(self.times[i]),
+                self.alpha[i], self.batch_size[r], 
+                scalar.gravity_adjustment(self.gravity[r]))
+        self.assertClose(vector.recipe_ibu(self.alpha, self.grams, self.times, 
+                                           self.offsets, self.gravity, self.batch_size),
+                         self.per_recipe(ibu))
+    
+    def test_garetz(self):
+        scalar, vector = bitterness.Garetz(), vectorized.Garetz()
+        adjustments = numpy.array([1.1, 1.0, 1.2, 1.05])
+        times = numpy.array([60, 15, 5, 120, 60, 45.5, 20, 1])
+        def ibu(i, r):
+            return scalar.ibu(self.grams[i], scalar.utilization_percentage(times[i]),
+                self.alpha[i], self.batch_size[r], adjustments[r])
+        self.assertClose(vector.recipe_ibu(self.alpha, self.grams, times, 
+                                           self.offsets, self.batch_size, adjustments),
+                         self.per_recipe(ibu))
+        
+        times = numpy.arange(-5, 120, 0.25)
+        table = scalar.utilization_table
+        self.assertEqual(vector.utilization_percentage(times).tolist(), table.lookup(times))
+        self.assertClose(vector.utilization_percentage(times, interpolate=True), 
+                         table.lookup(times, interpolate=True))
+
+
+from brewery.beerxml.formulas import weight, volume, temperature, pressure
+
+class UnitsTestCase(TestCase):
+    """
+    Test the unit conversion tables
+    """
+    
+    def test_weight(self):
+        self.assertAlmostEqual(weight.kilograms_to_pounds(1), 2.20462262185)
+        self.assertAlmostEqual(weight.convert(16, "oz", "lb"), 1)
+        self.assertAlmostEqual(weight.convert(1000, "g", "kg"), 1)
+        self.assertAlmostEqual(weight.grams_to_ounces(weight.ounces_to_grams(3.5)), 3.5)
+        self.assertRaises(ValueError, weight.convert, 1, "kg", "l")
+    
+    def test_volume(self):
+        self.assertAlmostEqual(volume.convert(1, "gal", "qt"), 4)
+        self.assertAlmostEqual(volume.convert(1, "cup", "oz"), 8)
+        self.assertAlmostEqual(volume.convert(1, "tblsp", "tsp"), 3)
+        self.assertAlmostEqual(volume.convert(1, "imp gal", "imp pt"), 8)
+        self.assertAlmostEqual(volume.liters_to_gallons(18.92705892), 5)
+    
+    def test_temperature(self):
+        self.assertAlmostEqual(temperature.celsius_to_fahrenheit(100), 212)
+        self.assertAlmostEqual(temperature.fahrenheit_to_celsius(32), 0)
+        self.assertAlmostEqual(temperature.convert(-40, "F", "C"), -40)
+        self.assertAlmostEqual(temperature.convert(0, "K", "F"), -459.67)
+    
+    def test_pressure(self):
+        self.assertAlmostEqual(pressure.convert(1, "atm", "psi"), 14.6959488, places=6)
+        self.assertAlmostEqual(pressure.psi_to_kilopascals(1), 6.89475729)
+    
+    def test_decimal(self):
+        from decimal import Decimal
+        self.assertAlmostEqual(temperature.celsius_to_fahrenheit(Decimal("20.5")), 68.9)
+    
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_arrays(self):
+        celsius = numpy.array([0, 20, 65.5, 100])
+        fahrenheit = temperature.celsius_to_fahrenheit(celsius)
+        self.assertTrue(numpy.allclose(fahrenheit,
+            [temperature.celsius_to_fahrenheit(c) for c in celsius]))
+        self.assertTrue(numpy.allclose(temperature.convert([0, 100], "C", "F"), [32, 212]))
+        
+        # A unit per value
+        self.assertTrue(numpy.allclose(temperature.convert(celsius, "C", ["C", "F", "K", "F"]),
+                                       [0, 68, 338.65, 212]))
+        self.assertTrue(numpy.allclose(weight.convert([1, 1, 1], ["kg", "lb", "g"], "g"),
+                                       [1000, 453.59237, 1]))
+        # One value to or from each unit
+        self.assertTrue(numpy.allclose(weight.convert(1, ["kg", "lb"], "g"), [1000, 453.59237]))
+        self.assertTrue(numpy.allclose(temperature.convert(100, "C", ["F", "K"]), [212, 373.15]))
+        self.assertRaises(ValueError, weight.convert, [1, 1, 1], ["kg", "lb"], "g")
+
+
+from brewery.beerxml.formulas import mash
+
+class MashTestCase(TestCase):
+    """
+    Test the mash heat balance calculations
+    """
+    
+    def test_strike_temp(self):
+        # 5 kg of grain at 20 C, heated to 66 C with 15 liters of water
+        self.assertAlmostEqual(mash.strike_temp(5, 20, 66, 15), 66 + 2 * 46 / 15.0)
+        # A 4 kg tun with a specific heat of 0.12 at 15 C
+        self.assertAlmostEqual(mash.strike_temp(5, 20, 66, 15, 4, 0.12, 15),
+                               66 + (2 * 46 + 0.48 * 51) / 15.0)
+    
+    def test_infusion(self):
+        heat, capacity = 66 * 17.0, 17.0
+        temp = mash.infusion_temp(heat, capacity, 72, 5)
+        self.assertAlmostEqual(temp, 72 + 17 * 6 / 5.0)
+        self.assertAlmostEqual(mash.infusion_amount(heat, capacity, 72, temp), 5)
+    
+    def test_schedule(self):
+        steps = [(u"Infusion", 66, 15), (u"Infusion", 72, 5), (u"Temperature", 78, None),
+                 (u"Decoction", 85, None)]
+        results = mash.schedule(5, steps, 20)
+        self.assertAlmostEqual(results[0].infuse_temp, mash.strike_temp(5, 20, 66, 15))
+        self.assertAlmostEqual(results[1].infuse_temp, 72 + 17 * 6 / 5.0)
+        self.assertEqual(results[2].infuse_temp, None)
+        self.assertAlmostEqual(results[2].heat, 22 * 6)
+        self.assertEqual([r.water for r in results], [15, 20, 20, 20])
+        self.assertEqual([r.ratio for r in results], [3, 4, 4, 4])
+        # Boiling the decoction adds the heat for the last 7 degrees
+        fraction = 7 / 22.0
+        self.assertAlmostEqual(results[3].heat, 22 * 7)
+        self.assertAlmostEqual(results[3].decoction_amount,
+                               fraction * (20 + 5 * mash.GRAIN_VOLUME))
+        
+        # A tun which is not preheated takes heat in every step
+        adjusted = mash.schedule(5, steps, 20, 20, 4, 0.12, equip_adjust=True)
+        self.assertEqual(mash.schedule(5, steps, 20, 20, 4, 0.12), results)
+        for r, a in zip(results, adjusted)[:2]:
+            self.assertTrue(a.infuse_temp > r.infuse_temp)
+    
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_schedule_many(self):
+        random = numpy.random.RandomState(7)
+        profiles, offsets = [], [0]
+        steps = []
+        for i in xrange(50):
+            count = random.randint(0, 5)
+            profile = (random.uniform(0, 10), random.uniform(10, 25), random.uniform(10, 25),
+                       random.uniform(0, 5), random.uniform(0.1, 0.2), random.rand() > 0.5)
+            profiles.append(profile)
+            steps.extend([(mash.STEP_TYPES[random.randint(0, 3)], random.uniform(40, 78),
+                           random.choice([0, random.uniform(1, 10)])) for j in xrange(count)])
+            offsets.append(len(steps))
+        
+        results = mash.schedule_many([p[0] for p in profiles], [p[1] for p in profiles],
+            [p[2] for p in profiles], [p[3] * p[4] if p[5] else 0 for p in profiles],
+            [mash.STEP_TYPES.index(s[0]) for s in steps], [s[1] for s in steps],
+            [s[2] for s in steps], offsets)
+        
+        nan = lambda v: numpy.nan if v is None else v
+        for i, profile in enumerate(profiles):
+            expected = mash.schedule(profile[0], steps[offsets[i]:offsets[i + 1]], *profile[1:])
+            for j, result in enumerate(expected):
+                for name in ("infuse_temp", "water", "ratio", "decoction_amount", "heat"):
+                    self.assertTrue(numpy.allclose(results[name][offsets[i] + j],
+                        nan(getattr(result, name)), equal_nan=True), name)
+
+
+from brewery.beerxml.formulas import water
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class WaterTestCase(TestCase):
+    """
+    Test water blending and salt additions
+    """
+    
+    def setUp(self):
+        # Burton on Trent, distilled, Pilsen and Dublin
+        self.profiles = numpy.array([[295, 45, 55, 725, 25, 300], [0, 0, 0, 0, 0, 0],
+                                     [7, 2, 2, 5, 5, 15], [118, 4, 12, 54, 19, 319]],
+                                    dtype=float)
+    
+    def test_salt_ppm(self):
+        # One gram of gypsum per gallon gives 61.5 ppm calcium
+        # and 147.4 ppm sulfate
+        gypsum = numpy.array(water.salt_ppm("gypsum")) * volume.liters_to_gallons(1)
+        self.assertAlmostEqual(gypsum[0], 61.5, places=1)
+        self.assertAlmostEqual(gypsum[3], 147.4, places=1)
+        chalk = numpy.array(water.salt_ppm("chalk")) * volume.liters_to_gallons(1)
+        self.assertAlmostEqual(chalk[0], 105.8, places=1)
+        self.assertEqual(water.SALTS_MATRIX.shape, (len(water.SALTS), len(water.IONS)))
+    
+    def test_blend(self):
+        self.assertTrue(numpy.allclose(water.blend(self.profiles, [1, 1, 0, 0]),
+                                       self.profiles[0] / 2))
+        blends = water.blend(self.profiles, [[1, 0, 0, 0], [0, 0, 3, 1]])
+        self.assertTrue(numpy.allclose(blends[0], self.profiles[0]))
+        self.assertTrue(numpy.allclose(blends[1], (3 * self.profiles[2] + self.profiles[3]) / 4))
+    
+    def test_add_salts(self):
+        grams = numpy.zeros(len(water.SALT_NAMES))
+        grams[water.SALT_NAMES.index("table salt")] = 20
+        profile = water.add_salts(self.profiles[1], grams, 20)
+        self.assertTrue(numpy.allclose(profile, water.salt_ppm("table salt")))
+    
+    def test_project_simplex(self):
+        random = numpy.random.RandomState(3)
+        x = random.normal(size=(100, 5))
+        projected = water.project_simplex(x)
+        self.assertTrue((projected >= 0).all())
+        self.assertTrue(numpy.allclose(projected.sum(axis=1), 1))
+        self.assertTrue(numpy.allclose(water.project_simplex(projected), projected))
+        self.assertTrue(numpy.allclose(water.project_simplex([[2, 0, 0]]), [[1, 0, 0]]))
+    
+    def test_match_blend(self):
+        fractions = numpy.array([0.5, 0.3, 0.2, 0])
+        target = fractions.dot(self.profiles)
+        result = water.match_blend(self.profiles, [target, self.profiles[3]], iterations=5000)
+        self.assertTrue(numpy.allclose(result, [fractions, [0, 0, 0, 1]], atol=1e-3))
+    
+    def test_match_salts(self):
+        grams = numpy.array([2, 0, 1, 0, 0.5, 0, 3])
+        targets = water.add_salts(self.profiles, grams, 20)
+        result = water.match_salts(self.profiles, targets, 20, iterations=5000)
+        self.assertTrue(numpy.allclose(water.distance(
+            water.add_salts(self.profiles, result, 20), targets), 0, atol=1e-2))
+        # Salts can not be taken away
+        result = water.match_salts(self.profiles[0], self.profiles[1], 20)
+        self.assertTrue(numpy.allclose(result, 0))
+        # At most 0.05 g/l of each salt
+        result = water.match_salts(self.profiles[1], self.profiles[0], 20, max_grams=0.05)
+        self.assertTrue((result <= 1 + 1e-9).all())
+    
+    def test_best_pair_ratios(self):
+        first, second = self.profiles[[0, 0, 2]], self.profiles[[1, 3, 3]]
+        target = self.profiles[3] * 0.8
+        ratios = water.best_pair_ratios(first, second, target)
+        grid = numpy.linspace(0, 1, 10001)
+        for a, b, ratio in zip(first, second, ratios):
+            blends = grid[:, numpy.newaxis] * a + (1 - grid[:, numpy.newaxis]) * b
+            best = grid[water.distance(blends, target).argmin()]
+            self.assertAlmostEqual(ratio, best, places=3)
+        # Blending a water with itself
+        self.assertEqual(water.best_pair_ratios(first, first, target).tolist(), [0, 0, 0])
+    
+    def test_pairwise_distances(self):
+        distances = water.pairwise_distances(self.profiles[:2], self.profiles)
+        for i in xrange(2):
+            self.assertTrue(numpy.allclose(distances[i],
+                                           water.distance(self.profiles, self.profiles[i])))
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+from django.test import TestCase
+
+from brewery.beerxml.graph import GRAPH_QUERIES
+from brewery.models import MashProfile, Recipe, RecipeOption
+from brewery.tests import RecipesFixtureMixin
+
+class RecipeGraphTestCase(RecipesFixtureMixin, TestCase):
+    """
+    Test loading recipes with their related records
+    """
+    def setUp(self):
+        super(RecipeGraphTestCase, self).setUp()
+        RecipeOption.objects.create(recipe=Recipe.objects.order_by("pk")[0], volume=2)
+    
+    def touch(self, recipe):
+        """
+        Read everything a rendered recipe shows.
+        """
+        values = [recipe.style, recipe.equipment, recipe.stats]
+        try:
+            values.append(recipe.recipeoption)
+        except RecipeOption.DoesNotExist:
+            pass
+        for name in ("hops", "fermentables", "miscs", "yeasts", "waters"):
+            values.extend(getattr(recipe, name).all())
+        if recipe.mash is not None:
+            values.extend(recipe.mash.mash_steps.all())
+        return values
+    
+    def test_with_graph(self):
+        with self.assertNumQueries(GRAPH_QUERIES):
+            for recipe in Recipe.objects.with_graph():
+                self.touch(recipe)
+        with self.assertNumQueries(GRAPH_QUERIES):
+            for recipe in Recipe.objects.order_by("-pk").with_graph()[:3]:
+                self.touch(recipe)
+    
+    def test_mash_step_order(self):
+        # Add the steps of a mash profile again in reverse, so the
+        # order they were added differs from the default order
+        profile = [r.mash for r in Recipe.objects.exclude(mash=None).order_by("pk")
+                   if r.mash.mash_steps.count() > 1][0]
+        steps = list(profile.mash_steps.order_by("pk"))
+        profile.mash_steps.clear()
+        for step in reversed(steps):
+            profile.mash_steps.add(step)
+        expected = [s.pk for s in reversed(steps)]
+        
+        recipes = Recipe.objects.filter(mash=profile).order_by("pk")
+        for recipe in recipes.with_graph():
+            self.assertEqual([s.pk for s in recipe.mash.mash_steps.all()], expected)
+        for record in recipes.graphs():
+            self.assertEqual([s.id for s in record.mash.mash_steps], expected)
+    
+    def test_graphs(self):
+        with self.assertNumQueries(GRAPH_QUERIES):
+            records = Recipe.objects.order_by("pk").graphs()
+        recipes = list(Recipe.objects.order_by("pk"))
+        self.assertEqual([r.pk for r in recipes], [r.id for r in records])
+        
+        with self.assertNumQueries(0):
+            for record in records:
+                self.assertTrue(record.stats.og > 1)
+                self.assertEqual(record.style.id, record.style_id)
+                if record.mash is not None:
+                    self.assertTrue(all(step.name for step in record.mash.mash_steps))
+                self.assertEqual(record.display("recipe_type"), 
+                                 dict(Recipe.TYPE)[record.recipe_type])
+        
+        for recipe, record in zip(recipes, records):
+            self.assertEqual(record.name, recipe.name)
+            self.assertEqual(record.batch_size, recipe.batch_size)
+            self.assertEqual(sorted([h.id for h in record.hops]), 
+                             sorted(recipe.hops.values_list("pk", flat=True)))
+            if recipe.equipment_id is None:
+                self.assertEqual(record.equipment, None)
+            else:
+                self.assertEqual(record.equipment.name, recipe.equipment.name)
+            if recipe.mash_id is not None:
+                through = MashProfile.mash_steps.through.objects.filter(
+                    mashprofile=recipe.mash_id).order_by("pk")
+                self.assertEqual([s.id for s in record.mash.mash_steps],
+                                 list(through.values_list("mashstep", flat=True)))
+        self.assertEqual(records[0].recipeoption.volume, 2)
+        self.assertEqual(records[1].recipeoption, None)
+        
+        # Records are read-only
+        self.assertRaises(AttributeError, setattr, records[0], "name", u"Spam")
+    
+    def test_graphs_page(self):
+        Recipe.objects.filter(pk__in=Recipe.objects.order_by("pk")[:2]
+                              .values_list("pk", flat=True)).update(mash=None)
+        # No mash steps to read
+        with self.assertNumQueries(GRAPH_QUERIES - 1):
+            page = Recipe.objects.order_by("pk").filter(mash__isnull=True).graphs()
+        self.assertEqual([r.mash for r in page], [None, None])
+        with self.assertNumQueries(1):
+            self.assertEqual(Recipe.objects.filter(pk=0).graphs(), [])
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from django.test import TestCase
+from django.core.management import call_command
+
+from brewery.beerxml import ingest
+from brewery.models import Recipe, Hop
+from brewery.tests import FILES, EXAMPLES_DIR
+
+class IngestTestCase(TestCase):
+    """
+    Test bulk import of BeerXML files
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for f in ("hops.xml", "recipes.xml"):
+            shutil.copy(os.path.join(EXAMPLES_DIR, f), self.tmpdir)
+        with open(os.path.join(self.tmpdir, "broken.xml"), "w") as fname:
+            fname.write("<RECIPES><RECIPE><NAME>Spam</NAME>")
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+    
+    def test_find_files(self):
+        files = ingest.find_files([self.tmpdir])
+        self.assertEqual([os.path.basename(f) for f in files], 
+                         ["broken.xml", "hops.xml", "recipes.xml"])
+    
+    def test_ingest_examples(self):
+        """
+        Import all example files using a process pool
+        """
+        report = ingest.ingest([EXAMPLES_DIR], processes=2)
+        self.assertEqual(len(report.results), len(FILES))
+        self.assertEqual(report.failed, [])
+        self.assertTrue(report.nodes > 0)
+        self.assertTrue(report.files_per_second > 0)
+        self.assertEqual(Recipe.objects.count(), 9)
+    
+    def test_ingest_reports_failures(self):
+        """
+        A broken file is reported, and does not
+        stop the other files from being imported
+        """
+        results = []
+        report = ingest.ingest([self.tmpdir], processes=1, callback=results.append)
+        self.assertEqual(results, report.results)
+        self.assertEqual([os.path.basename(r.path) for r in report.failed], 
+                         ["broken.xml"])
+        self.assertEqual(len(report.succeeded), 2)
+        self.assertTrue(Hop.objects.exists())
+    
+    def test_import_command(self):
+        stdout, stderr = StringIO(), StringIO()
+        call_command("beerxml_import", self.tmpdir, processes=2,
+                     stdout=stdout, stderr=stderr)
+        self.assertTrue("Imported 2 of 3 files" in stdout.getvalue())
+        self.assertTrue("broken.xml" in stderr.getvalue())
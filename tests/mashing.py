@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+from django.test import TestCase
+from django.utils import unittest
+
+from brewery.beerxml import mashing
+from brewery.beerxml.formulas import mash
+from brewery.models import MashStep, Recipe
+from brewery.tests import RecipesFixtureMixin
+
+class MashScheduleTestCase(RecipesFixtureMixin, TestCase):
+    """
+    Test the mash infusion calculations of recipes
+    """
+    def test_mash_schedule(self):
+        recipe = Recipe.objects.get(name="Dry Stout")
+        results = mashing.mash_schedule(recipe)
+        self.assertTrue(results)
+        step = MashStep.objects.get(pk=results[0][0])
+        # Matches the strike temperature exported by BeerSmith
+        self.assertAlmostEqual(results[0][1].infuse_temp, float(step.infuse_temp), places=3)
+        recipe.mash = None
+        recipe.save()
+        self.assertEqual(mashing.mash_schedule(recipe), [])
+    
+    @unittest.skipIf(mash.np is None, "numpy is not installed")
+    def test_check_mashes(self):
+        with self.assertNumQueries(3):
+            mismatches = list(mashing.check_mashes(Recipe.objects.all()))
+        for pk, step, stored, calculated in mismatches:
+            self.assertTrue(abs(stored - calculated) > 1)
+            results = dict(mashing.mash_schedule(pk))
+            self.assertAlmostEqual(results[step].infuse_temp, calculated)
+        self.assertEqual(list(mashing.check_mashes(Recipe.objects.all(), 
+                                                   tolerance=1000)), [])
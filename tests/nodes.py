@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
 
 import os
+import pickle
+from decimal import Decimal
 from django.test import TestCase
+from django.contrib.auth.models import User
 from django.db.models.base import Model
 
 from brewery.beerxml import parser
-from brewery.beerxml.nodes import BeerXMLNode
+from brewery.beerxml.error import BeerXMLValidationError
+from brewery.beerxml import nodes
+from brewery.beerxml.nodes import BeerXMLNode, get_conversion_plan, get_relation_fields
+from brewery.beerxml.nodes import MANY_TO_ONE, MANY_TO_MANY
+from django.db.models.fields.related import ManyToOneRel, ManyToManyRel
+from brewery.models import Equipment, Fermentable, Hop, MashProfile, Recipe, normalize
 from brewery.tests import FILES, EXAMPLES_DIR
 
 class BeerXMLNodeTestCase(TestCase):
@@ -79,3 +87,252 @@ class BeerXMLNodeTestCase(TestCase):
                         obj, created = node.get_or_create()
                         self.assertIsInstance(obj, Model, "is not a model instance")
                         self.assertTrue(created, "was not created")
+    
+    def test_conversion_plan(self):
+        """
+        Make sure conversion plans map BeerXML tags to
+        model fields, converters and relations
+        """
+        plan = get_conversion_plan(Fermentable)
+        self.assertTrue(plan is get_conversion_plan(Fermentable))
+        self.assertEqual(plan["type"][0], "ferm_type")
+        self.assertEqual(plan["yield"][0], "ferm_yield")
+        self.assertEqual(plan["add_after_boil"][1]("TRUE"), True)
+        self.assertEqual(plan["add_after_boil"][1]("FALSE"), False)
+        self.assertFalse("spam" in plan)
+        
+        plan = get_conversion_plan(Recipe)
+        self.assertEqual(plan["style"][2], MANY_TO_ONE)
+        self.assertEqual(plan["hops"][2], MANY_TO_MANY)
+        self.assertEqual(plan["name"][2], None)
+    
+    def test_node_conversion(self):
+        """
+        Make sure node values are converted and renamed
+        """
+        node = BeerXMLNode("FERMENTABLE", {"NAME": "Pale Malt", "TYPE": "Grain",
+                                           "AMOUNT": "4.5", "ADD_AFTER_BOIL": "FALSE",
+                                           "NOT_A_FIELD": "spam"})
+        self.assertEqual(node["name"], "Pale Malt")
+        self.assertEqual(node["ferm_type"], "Grain")
+        self.assertEqual(node["amount"], Decimal("4.5"))
+        self.assertEqual(node["add_after_boil"], False)
+        self.assertFalse("not_a_field" in node)
+        self.assertRaises(BeerXMLValidationError, BeerXMLNode, "FERMENTABLE",
+                          {"AMOUNT": "spam"})
+    
+    def test_registry(self):
+        """
+        Make sure models and relation fields are resolved
+        once, and that the registry can be cleared
+        """
+        nodes.clear_registry()
+        self.assertEqual(nodes._models, {})
+        
+        node = BeerXMLNode("RECIPE", {"NAME": "Spam ale", "HOPS": [], "STYLE": {"NAME": "Spam"}})
+        self.assertTrue(nodes.get_node_model("RECIPE") is Recipe)
+        self.assertTrue("RECIPE" in nodes._models)
+        self.assertTrue("STYLE" in nodes._models)
+        self.assertEqual(nodes.get_relation_fields(Recipe, ManyToManyRel),
+                         frozenset(["hops", "fermentables", "miscs", "yeasts", "waters"]))
+        self.assertEqual(node.many_to_many, [{"hops": []}])
+        self.assertEqual([m.keys() for m in node.many_to_one], [["style"]])
+        
+        # keys which are not model fields are ignored
+        node["spam"] = "eggs"
+        self.assertEqual(list(node.iter_field_type(ManyToOneRel)), node.many_to_one)
+        
+        self.assertRaises(BeerXMLValidationError, nodes.get_node_model, "SPAM")
+        nodes.clear_registry()
+        self.assertEqual(nodes._models, {})
+        self.assertEqual(nodes._conversion_plans, {})
+    
+    def test_compact_node(self):
+        """
+        Make sure values are stored once, can be read as
+        attributes and survive pickling
+        """
+        with open(os.path.join(EXAMPLES_DIR, "recipes.xml"), "r") as fname:
+            node = parser.to_beerxml(fname)["RECIPES"][0]
+        self.assertFalse(hasattr(node, "__dict__"))
+        self.assertEqual(node.name, node["name"])
+        self.assertEqual(node.style.name, node["style"]["name"])
+        self.assertRaises(AttributeError, getattr, node, "spam")
+        
+        for protocol in (0, pickle.HIGHEST_PROTOCOL):
+            copy = pickle.loads(pickle.dumps(node, protocol))
+            self.assertIsInstance(copy, BeerXMLNode)
+            self.assertEqual(copy, node)
+            self.assertEqual(copy.__name__, "RECIPE")
+            self.assertEqual(copy.hops, node.hops)
+            self.assertEqual(sorted(copy.many_to_many), sorted(node.many_to_many))
+    
+    def test_lazy_node(self):
+        """
+        Make sure lazy nodes convert values on first access,
+        and end up equal to eagerly converted nodes
+        """
+        for f in FILES:
+            path = os.path.join(EXAMPLES_DIR, f)
+            for lazy, node in zip(parser.iter_beerxml(path=path, lazy=True), 
+                                  parser.iter_beerxml(path=path)):
+                self.assertEqual(lazy._model, node._model)
+                self.assertEqual(lazy["name"], node["name"])
+                self.assertEqual(lazy.get("version"), node.get("version"))
+                self.assertEqual(sorted(lazy.keys()), sorted(node.keys()))
+                self.assertEqual(lazy, node)
+        
+        node = BeerXMLNode("RECIPE", {"NAME": "Spam ale", "BATCH_SIZE": "18.9",
+                                      "STYLE": {"NAME": "Spam"}}, lazy=True)
+        self.assertEqual(dict.__getitem__(node, "batch_size"), "18.9")
+        self.assertEqual(node.batch_size, Decimal("18.9"))
+        self.assertEqual(dict.__getitem__(node, "batch_size"), Decimal("18.9"))
+        self.assertEqual(dict.__getitem__(node, "style"), {"NAME": "Spam"})
+        self.assertIsInstance(node["style"], BeerXMLNode)
+        self.assertEqual(node["style"]["name"], "Spam")
+        
+        # conversion errors are raised on access
+        node = BeerXMLNode("FERMENTABLE", {"AMOUNT": "spam"}, lazy=True)
+        self.assertRaises(BeerXMLValidationError, node.get, "amount")
+    
+    def test_fingerprint(self):
+        """
+        Objects with the same content get the same fingerprint,
+        and get_or_create() reuses them per owner
+        """
+        a = Fermentable(name="Pale Malt", ferm_type="Grain", amount="5.0", 
+                        ferm_yield=Decimal("78"), color=3)
+        b = Fermentable(name="Pale Malt", ferm_type="grain", amount=Decimal("5"), 
+                        ferm_yield="78.000", color=Decimal("3.0"), slug="pale")
+        a.clean(), b.clean()
+        self.assertEqual(len(a.get_fingerprint()), 40)
+        self.assertEqual(a.get_fingerprint(), b.get_fingerprint())
+        b.amount = Decimal("5.5")
+        self.assertNotEqual(a.get_fingerprint(), b.get_fingerprint())
+        
+        with open(os.path.join(EXAMPLES_DIR, "grain.xml"), "r") as fname:
+            node = parser.to_beerxml(fname).values()[0][0]
+        obj, created = node.get_or_create()
+        self.assertTrue(created)
+        self.assertEqual(obj.fingerprint, obj.get_fingerprint())
+        self.assertEqual(node.get_or_create(), (obj, False))
+        
+        user = User.objects.create(username="brewer")
+        other, created = node.get_or_create(inherit={"registered_by": user})
+        self.assertTrue(created)
+        self.assertEqual(other.fingerprint, obj.fingerprint)
+        self.assertEqual(node.get_or_create(inherit={"registered_by": user}), 
+                         (other, False))
+    
+    def test_related_fingerprint(self):
+        """
+        Mash profiles and recipes which only differ in their
+        many-to-many relations get different fingerprints
+        """
+        with open(os.path.join(EXAMPLES_DIR, "mash.xml"), "r") as fname:
+            node = parser.to_beerxml(fname).values()[0][0]
+        steps = node["mash_steps"]
+        self.assertTrue(len(steps) > 1)
+        profile, created = node.get_or_create()
+        self.assertEqual(profile.fingerprint, profile.get_fingerprint())
+        through = MashProfile.mash_steps.through.objects.filter(mashprofile=profile)
+        self.assertEqual(list(through.order_by("pk").values_list("mashstep__name", flat=True)),
+                         [s["name"] for s in steps])
+        self.assertEqual(node.get_or_create(), (profile, False))
+        
+        # The same profile with fewer steps is a different profile
+        node["mash_steps"] = steps[:1]
+        other, created = node.get_or_create()
+        self.assertTrue(created)
+        self.assertEqual(other.mash_steps.count(), 1)
+        self.assertNotEqual(other.fingerprint, profile.fingerprint)
+        # and so are the steps in another order
+        node["mash_steps"] = list(reversed(steps))
+        self.assertTrue(node.get_or_create()[1])
+        
+        # Fingerprints follow changes to the relations
+        other.mash_steps.add(*profile.mash_steps.exclude(pk__in=other.mash_steps.all()))
+        self.assertEqual(MashProfile.objects.get(pk=other.pk).fingerprint,
+                         other.get_fingerprint())
+        self.assertEqual(other.fingerprint, other.get_fingerprint())
+        step = other.mash_steps.all()[0]
+        step.step_temp += 1
+        # Saving the step, reading its profiles and their steps, 
+        # and updating the profile fingerprints
+        with self.assertNumQueries(5):
+            step.save()
+        self.assertEqual(MashProfile.objects.get(pk=other.pk).fingerprint, 
+                         other.get_fingerprint())
+        profiles = list(step.mashprofile_set.all())
+        self.assertTrue(profiles)
+        step.mashprofile_set.clear()
+        for obj in profiles:
+            self.assertEqual(MashProfile.objects.get(pk=obj.pk).fingerprint,
+                             obj.get_fingerprint())
+        
+        # Ingredients of a recipe count, in any order
+        recipe = Recipe(name=u"Pale Ale", recipe_type=u"All Grain", brewer=u"me",
+                        batch_size=20, boil_size=25, boil_time=60)
+        hops = [Hop(name=u"Cascade", alpha=5), Hop(name=u"Saaz", alpha=3)]
+        a, b = [h.get_fingerprint() for h in normalize(hops)]
+        self.assertNotEqual(recipe.get_fingerprint(), recipe.get_fingerprint({"hops": [a]}))
+        self.assertEqual(recipe.get_fingerprint({"hops": [a, b]}),
+                         recipe.get_fingerprint({"hops": [b, a]}))
+
+
+class NormalizeTestCase(TestCase):
+    """
+    Test the normalization of nodes and model instances
+    """
+    def test_normalize(self):
+        hops = [Hop(name=u"East Kent Goldings", use=u"Boil", hop_type=u"Aroma",
+                    form=u"Pellet"),
+                Hop(name=u"Saaz", use=u"Dry Hop", form=u"Leaf", slug=u"saaz-cz")]
+        recipe = Recipe(name=u"Dry Stout", recipe_type=u"All Grain", ibu_method=u"Tinseth")
+        self.assertTrue(normalize(hops + [recipe]) is not None)
+        self.assertEqual([(h.slug, h.use, h.hop_type, h.form) for h in hops],
+                         [(u"east-kent-goldings", u"boil", u"aroma", u"pellet"),
+                          (u"saaz-cz", u"dry hop", None, u"leaf")])
+        self.assertEqual((recipe.slug, recipe.recipe_type, recipe.ibu_method),
+                         (u"dry-stout", u"all grain", u"tinseth"))
+    
+    def test_normalize_nodes(self):
+        """
+        Nodes are normalized to the same values as
+        the instances made from them
+        """
+        nodetree = []
+        for f in FILES:
+            with open(os.path.join(EXAMPLES_DIR, f), "r") as fname:
+                for node_list in parser.to_beerxml(fname).values():
+                    nodetree.extend(node_list)
+        instances = []
+        for node in nodetree:
+            relations = get_relation_fields(node._model, ManyToOneRel) \
+                      | get_relation_fields(node._model, ManyToManyRel)
+            instances.append(node._model(**dict([(k, v) for k, v in node.iteritems()
+                                                 if not k in relations])))
+        normalize(nodetree)
+        for node, instance in zip(nodetree, instances):
+            instance.clean()
+            for key, value in node.iteritems():
+                if not isinstance(value, (list, BeerXMLNode)):
+                    self.assertEqual(value, getattr(instance, key))
+            self.assertEqual(node["slug"], instance.slug)
+    
+    def test_save(self):
+        equipment = Equipment(name=u"Pot", batch_size=Decimal("20"), boil_time=60,
+                              evap_rate=Decimal("0.001"), top_up_water=0,
+                              trub_chiller_loss=Decimal("1"), calc_boil_volume=True)
+        equipment.save()
+        equipment = Equipment.objects.get(pk=equipment.pk)
+        self.assertEqual(equipment.slug, u"pot")
+        self.assertEqual(equipment.boil_size, Decimal("19") * Decimal("1.06"))
+        self.assertEqual(equipment.fingerprint, equipment.get_fingerprint())
+        
+        # Missing losses count as none
+        rows = [{"batch_size": Decimal("20"), "boil_size": Decimal("1"), 
+                 "calc_boil_volume": True},
+                {"boil_size": Decimal("1"), "calc_boil_volume": True}]
+        Equipment.normalize_rows(rows)
+        self.assertEqual([r["boil_size"] for r in rows], [Decimal("20"), Decimal("1")])
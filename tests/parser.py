@@ -1,9 +1,16 @@
 # -*- coding: utf-8 -*-
 
 import os
+import csv
+import mmap
+from cStringIO import StringIO
 from django.test import TestCase
 
 from brewery.beerxml import parser
+from brewery.beerxml.error import BeerXMLError
+from brewery.beerxml.nodes import BeerXMLNode
+from brewery.beerxml.bulk import bulk_get_or_create
+from brewery.models import Recipe
 from brewery.tests import FILES, EXAMPLES_DIR
 
 class BeerXMLParserTestCase(TestCase):
@@ -81,6 +88,213 @@ class BeerXMLParserTestCase(TestCase):
             with open(os.path.join(EXAMPLES_DIR, f), "r") as fname:
                 self.assertIsInstance(fname, file)  # make sure fname is file
                 parser.to_beerxml(fname)
-
-
-                
\ No newline at end of file
+    
+    def test_iter_beerxml_as_str(self):
+        """
+        Test iter_beerxml method on all example files
+        as xml string object
+        """
+        for f in FILES:
+            with open(os.path.join(EXAMPLES_DIR, f), "r") as fname:
+                xml_str = fname.read()               # test xml as str
+                self.assertIsInstance(xml_str, str)  # make sure xml is str
+                for node in parser.iter_beerxml(xml_str):
+                    self.assertIsInstance(node, BeerXMLNode)
+    
+    def test_iter_beerxml_as_file(self):
+        """
+        Test iter_beerxml method on all example files
+        as file object
+        """
+        for f in FILES:
+            with open(os.path.join(EXAMPLES_DIR, f), "r") as fname:
+                self.assertIsInstance(fname, file)  # make sure fname is file
+                for node in parser.iter_beerxml(fname):
+                    self.assertIsInstance(node, BeerXMLNode)
+    
+    def test_iter_beerxml_equals_to_beerxml(self):
+        """
+        Make sure iter_beerxml yields the same nodes
+        as to_beerxml produces
+        """
+        for f in FILES:
+            with open(os.path.join(EXAMPLES_DIR, f), "r") as fname:
+                xml_str = fname.read()
+                expected = []
+                for nodelist in parser.to_beerxml(xml_str).itervalues():
+                    expected.extend(nodelist)
+                nodes = list(parser.iter_beerxml(xml_str))
+                # to_beerxml returns nodes in reversed document order
+                self.assertEqual(nodes, list(reversed(expected)))
+                self.assertEqual([n.__name__ for n in nodes],
+                                 [n.__name__ for n in reversed(expected)])
+    
+    def test_to_beerxml_as_path(self):
+        """
+        Test to_beerxml method on all example files
+        as a path to the file
+        """
+        for f in FILES:
+            path = os.path.join(EXAMPLES_DIR, f)
+            with open(path, "r") as fname:
+                expected_xml = fname.read()
+            expected = parser.to_dict(expected_xml)
+            self.assertEqual(parser.to_dict(path=path), expected)
+            self.assertEqual(parser.to_tuple(path=path), parser.to_tuple(expected_xml))
+            parser.to_beerxml(path=path)
+            list(parser.iter_beerxml(path=path))
+        self.assertRaises(BeerXMLError, parser.to_dict, expected_xml, path=path)
+    
+    def test_path_as_str(self):
+        """
+        Strings are always read as documents, never
+        opened as paths, so they can not read local files
+        """
+        path = os.path.join(EXAMPLES_DIR, "recipes.xml")
+        for xml in (path, unicode(path), os.path.abspath(__file__)):
+            for parse in (parser.to_tuple, parser.to_dict, parser.to_beerxml):
+                self.assertRaises(BeerXMLError, parse, xml)
+            self.assertRaises(BeerXMLError, list, parser.iter_beerxml(xml))
+    
+    def test_to_beerxml_as_buffer(self):
+        """
+        Test to_beerxml method on all example files
+        as buffer objects and memory mapped files
+        """
+        for f in FILES:
+            with open(os.path.join(EXAMPLES_DIR, f), "r") as fname:
+                xml_str = fname.read()
+                expected = parser.to_dict(xml_str)
+                for xml in (buffer(xml_str), bytearray(xml_str), 
+                            memoryview(xml_str), xml_str.decode("utf-8")):
+                    self.assertEqual(parser.to_dict(xml), expected)
+                
+                xml = mmap.mmap(fname.fileno(), 0, access=mmap.ACCESS_READ)
+                self.assertEqual(parser.to_dict(xml), expected)
+                xml.close()
+    
+    def test_declared_encoding(self):
+        """
+        Test documents in other encodings than UTF-8, as
+        strings and as unicode strings
+        """
+        xml = u"""<?xml version="1.0" encoding="%s"?>
+<HOPS><HOP><NAME>Saaz \xe9t\xe9</NAME><ALPHA>3.5</ALPHA></HOP></HOPS>"""
+        expected = {"HOPS": [{"HOP": {"NAME": u"Saaz \xe9t\xe9", "ALPHA": "3.5"}}]}
+        for encoding in ("UTF-16", "ISO-8859-1"):
+            self.assertEqual(parser.to_dict((xml % encoding).encode(encoding)), expected)
+            self.assertEqual(parser.to_dict(xml % encoding), expected)
+            nodes = list(parser.iter_beerxml((xml % encoding).encode(encoding)))
+            self.assertEqual(nodes[0]["name"], u"Saaz \xe9t\xe9")
+    
+    def test_invalid_input(self):
+        """
+        Make sure unsupported input types raise a BeerXMLError
+        """
+        for xml in (None, 42, ["<RECIPES/>"]):
+            self.assertRaises(BeerXMLError, parser.to_dict, xml)
+        # Neither a path nor a document
+        for xml in ("no\0such\0file", "<RECIPES><RECIPE>", "x" * 10000):
+            for parse in (parser.to_tuple, parser.to_dict, parser.to_beerxml):
+                self.assertRaises(BeerXMLError, parse, xml)
+            self.assertRaises(BeerXMLError, list, parser.iter_beerxml(xml))
+    
+    def test_to_dict_structure(self):
+        """
+        Make sure to_dict nests related records the
+        way BeerXMLNode expects them
+        """
+        with open(os.path.join(EXAMPLES_DIR, "recipes.xml"), "r") as fname:
+            nodetree = parser.to_dict(fname)
+        self.assertEqual(nodetree.keys(), ["RECIPES"])
+        self.assertEqual(len(nodetree["RECIPES"]), 9)
+        for item in nodetree["RECIPES"]:
+            self.assertEqual(item.keys(), ["RECIPE"])
+            recipe = item["RECIPE"]
+            self.assertIsInstance(recipe["NAME"], str)
+            self.assertIsInstance(recipe["STYLE"], dict)
+            self.assertIsInstance(recipe["STYLE"]["NAME"], str)
+            for hop in recipe["HOPS"]:
+                self.assertEqual(hop.keys(), ["HOP"])
+                self.assertIsInstance(hop["HOP"], dict)
+            self.assertIsInstance(recipe["MASH"], dict)
+            for step in recipe["MASH"]["MASH_STEPS"] or []:
+                self.assertEqual(step.keys(), ["MASH_STEP"])
+    
+    def test_export_toxml(self):
+        """
+        Exported records are read back as identical records
+        """
+        for f in FILES:
+            nodes = list(parser.iter_beerxml(path=os.path.join(EXAMPLES_DIR, f)))
+            results = bulk_get_or_create(nodes)
+            objects = [obj for obj, created in results]
+            queryset = objects[0].__class__.objects.all()
+            
+            xml = parser.export_toxml(queryset)
+            self.assertTrue(xml.startswith("<?xml"))
+            exported = list(parser.iter_beerxml(xml))
+            self.assertEqual(len(exported), queryset.count())
+            for obj, created in bulk_get_or_create(exported):
+                self.assertFalse(created)
+            self.assertEqual(len(exported), queryset.count())
+            
+            # single instances and lists are exported too
+            node = parser.iter_beerxml(parser.export_toxml(objects[0])).next()
+            self.assertEqual(node["name"], objects[0].name)
+            self.assertEqual(parser.export_toxml(objects[:1]), 
+                             parser.export_toxml(objects[0]))
+    
+    def test_export_toxml_streaming(self):
+        """
+        Records are read in chunks, with a fixed
+        number of queries per chunk
+        """
+        bulk_get_or_create(list(parser.iter_beerxml(
+            path=os.path.join(EXAMPLES_DIR, "recipes.xml"))))
+        output = StringIO()
+        # 9 recipes in 3 chunks, each with one query for the recipes
+        # and one per prefetched many-to-many relation
+        with self.assertNumQueries(3 * 7):
+            parser.export_toxml(Recipe.objects.all(), output, chunk_size=4)
+        recipes = list(parser.iter_beerxml(output.getvalue()))
+        objects = Recipe.objects.order_by("pk")
+        self.assertEqual(len(recipes), len(objects))
+        for recipe, obj in zip(recipes, objects):
+            self.assertEqual(recipe["name"], obj.name)
+            self.assertEqual(recipe["style"]["name"], obj.style.name)
+            self.assertEqual(len(recipe["hops"]), obj.hops.count())
+    
+    def test_export_tocsv(self):
+        """
+        Rows are streamed in chunks, with two
+        queries per chunk
+        """
+        bulk_get_or_create(list(parser.iter_beerxml(
+            path=os.path.join(EXAMPLES_DIR, "recipes.xml"))))
+        with self.assertNumQueries(0):
+            lines = parser.export_tocsv(Recipe.objects.all(), chunk_size=4)
+        with self.assertNumQueries(3 * 2):
+            rows = list(csv.reader(lines))
+        
+        header, rows = rows[0], rows[1:]
+        self.assertIn("name", header)
+        self.assertIn("batch_size", header)
+        self.assertNotIn("fingerprint", header)
+        self.assertEqual([r[header.index("name")] for r in rows],
+                         list(Recipe.objects.order_by("pk").values_list("name", flat=True)))
+        
+        # one row per recipe and hop
+        output = StringIO()
+        parser.export_tocsv(Recipe.objects.all(), ["name", "hops__name", "hops__alpha"], 
+                            output, chunk_size=4)
+        rows = list(csv.reader(StringIO(output.getvalue())))
+        self.assertEqual(rows[0], ["name", "hops__name", "hops__alpha"])
+        self.assertEqual(len(rows) - 1, Recipe.hops.through.objects.count())
+        for name, hop, alpha in rows[1:]:
+            self.assertTrue(Recipe.objects.filter(name=name, hops__name=hop).exists())
+            self.assertFalse(alpha.endswith("0"))
+        
+        recipe = Recipe.objects.all()[0]
+        rows = list(csv.reader(parser.export_tocsv(recipe, ["name"])))
+        self.assertEqual(rows, [["name"], [recipe.name.encode("utf-8")]])
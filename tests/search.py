@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import os
+from django.test import TestCase
+
+from brewery.beerxml import parser, search
+from brewery.beerxml.bulk import bulk_get_or_create
+from brewery.beerxml.search import InvertedIndex, FTS5Index
+from brewery.models import Recipe, Style
+from brewery.tests import EXAMPLES_DIR
+
+class InvertedIndexTestCase(TestCase):
+    """
+    Test searching styles and recipes with the in memory index
+    """
+    backend = InvertedIndex
+
+    def setUp(self):
+        search.clear_indexes()
+        for f in ("style.xml", "recipes.xml"):
+            bulk_get_or_create(list(parser.iter_beerxml(path=os.path.join(EXAMPLES_DIR, f))))
+        for model in (Style, Recipe):
+            search.get_index(model, self.backend)
+
+    def tearDown(self):
+        search.clear_indexes()
+
+    def names(self, model, query):
+        return [obj.name for obj in search.search(model, query)]
+
+    def test_search(self):
+        self.assertEqual(self.names(Style, "pilsner")[0], "Bohemian Pilsner")
+        self.assertEqual(self.names(Style, "WHEAT")[0], "American Wheat")
+        names = self.names(Style, "chocolate malt")
+        self.assertTrue("Dry Stout (Irish)" in names)
+        self.assertTrue("Traditional Bock" in names)
+        self.assertFalse("American Wheat" in names)
+        self.assertEqual(self.names(Style, "saaz chocolate"), [])
+        self.assertEqual(self.names(Style, "nothing-like-this"), [])
+        self.assertEqual(self.names(Style, "  "), [])
+
+        for recipe in Recipe.objects.all():
+            self.assertTrue(recipe in search.search(Recipe, recipe.name))
+
+    def test_limit(self):
+        self.assertEqual(len(search.search(Style, "malt", limit=2)), 2)
+        everything = search.search(Style, "malt", limit=None)
+        self.assertTrue(len(everything) > 2)
+        self.assertEqual(everything, search.search(Style, "malt", limit=len(everything)))
+
+    def test_update(self):
+        style = Style.objects.get(name="Traditional Bock")
+        style.notes = u"Smoky variations are welcome"
+        style.save()
+        self.assertEqual(self.names(Style, "smoky"), ["Traditional Bock"])
+
+        style.notes = u""
+        style.save()
+        self.assertEqual(self.names(Style, "smoky"), [])
+
+        style.delete()
+        self.assertEqual(self.names(Style, "einbecker"), [])
+
+    def test_bulk(self):
+        recipe = Recipe.objects.order_by("pk")[0]
+        nodes = list(parser.iter_beerxml(path=os.path.join(EXAMPLES_DIR, "recipes.xml")))
+        for node in nodes:
+            node["name"] = u"Rauchbier %s" % node["name"]
+        bulk_get_or_create(nodes)
+        self.assertEqual(len(search.search(Recipe, "rauchbier")), len(nodes))
+        self.assertTrue(search.search(Recipe, recipe.name))
+
+
+class FTS5IndexTestCase(InvertedIndexTestCase):
+    """
+    Test searching styles and recipes with SQLite FTS5
+    """
+    backend = FTS5Index
+
+    def setUp(self):
+        if not search.has_fts5():
+            self.skipTest("SQLite FTS5 is not available")
+        super(FTS5IndexTestCase, self).setUp()
+
+    def test_same_results(self):
+        index = InvertedIndex(Style, search.SEARCH_FIELDS[Style])
+        index.rebuild()
+        for query in ("malt", "hops flavor", "light color", "lager yeast"):
+            self.assertEqual(set([pk for pk, score in index.search(query)]),
+                             set([pk for pk, score in search.get_index(Style).search(query)]))
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+from django.test import TestCase
+from django.utils import unittest
+
+from brewery.beerxml import similarity
+from brewery.beerxml.similarity import SimilarityIndex, FEATURES
+from brewery.models import Recipe
+from brewery.tests import RecipesFixtureMixin
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class SimilarityTestCase(RecipesFixtureMixin, TestCase):
+    """
+    Test finding similar recipes
+    """
+    def setUp(self):
+        super(SimilarityTestCase, self).setUp()
+        self.index = SimilarityIndex.from_queryset()
+    
+    def test_features(self):
+        features = similarity.recipe_features(20,
+            [(4, 2, u"grain"), (1, 60, u"grain"), (1, 0, u"sugar")],
+            [(10, 0.02, 60, u"boil"), (5, 0.04, 5, u"boil"), (5, 0.02, 0, u"dry hop")],
+            [70, None, 80])
+        self.assertEqual(len(features), len(FEATURES))
+        features = dict(zip(FEATURES, features))
+        self.assertAlmostEqual(features["type grain"], 5 / 6.0)
+        self.assertAlmostEqual(features["type sugar"], 1 / 6.0)
+        self.assertAlmostEqual(features["color 3"], 5 / 6.0)
+        self.assertAlmostEqual(features["color 200"], 1 / 6.0)
+        # 2, 2 and 1 grams of alpha acids
+        self.assertAlmostEqual(features["hops boil bittering"], 0.4)
+        self.assertAlmostEqual(features["hops boil late"], 0.4)
+        self.assertAlmostEqual(features["hops dry hop"], 0.2)
+        self.assertAlmostEqual(features["hopping rate"], 5 / 20.0 / similarity.HOPPING_RATE_SCALE)
+        self.assertAlmostEqual(features["attenuation"], 0.8)
+    
+    def test_index(self):
+        self.assertEqual(len(self.index), Recipe.objects.count())
+        norms = np.sqrt((self.index.vectors ** 2).sum(axis=1))
+        self.assertTrue(np.allclose(norms[norms > 0], 1, atol=1e-6))
+    
+    def test_similar(self):
+        vectors = self.index.vectors.astype(np.float64)
+        for i, pk in enumerate(self.index.pks.tolist()):
+            results = self.index.similar(pk, count=3)
+            self.assertEqual(len(results), 3)
+            self.assertFalse(pk in [p for p, s in results])
+            similarities = [s for p, s in results]
+            self.assertEqual(similarities, sorted(similarities, reverse=True))
+            # Same as comparing with every recipe
+            expected = sorted([s for j, s in enumerate(vectors.dot(vectors[i])) if j != i],
+                              reverse=True)[:3]
+            self.assertTrue(np.allclose(similarities, expected, atol=1e-5))
+    
+    def test_nearest_many(self):
+        vectors = self.index.vectors[:5]
+        results = self.index.nearest_many(vectors, count=4, batch_size=2)
+        self.assertEqual(len(results), 5)
+        for result, expected in zip(results, [self.index.nearest(v, count=4) for v in vectors]):
+            self.assertEqual([p for p, s in result], [p for p, s in expected])
+            self.assertTrue(np.allclose([s for p, s in result], [s for p, s in expected]))
+    
+    def test_similar_recipes(self):
+        recipe = Recipe.objects.order_by("pk")[0]
+        recipes = similarity.similar_recipes(recipe, self.index, count=20)
+        self.assertEqual(len(recipes), Recipe.objects.count() - 1)
+        self.assertFalse(recipe in recipes)
+        
+        # A recipe which is not in the index
+        index = SimilarityIndex.from_queryset(Recipe.objects.exclude(pk=recipe.pk))
+        self.assertEqual(similarity.similar_recipes(recipe, index, count=20), recipes)
+    
+    def test_save(self):
+        path = tempfile.mkdtemp()
+        try:
+            self.index.save(os.path.join(path, "recipes"))
+            for mmap_mode in (None, "r"):
+                index = SimilarityIndex.load(os.path.join(path, "recipes"), mmap_mode)
+                self.assertEqual(index.pks.tolist(), self.index.pks.tolist())
+                pk = index.pks[0]
+                self.assertEqual(index.similar(pk), self.index.similar(pk))
+        finally:
+            shutil.rmtree(path)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import os
+import random
+from django.test import TestCase
+
+from brewery.beerxml import parser, styles
+from brewery.beerxml.bulk import bulk_get_or_create
+from brewery.beerxml.styles import StyleIndex, DIMENSIONS
+from brewery.models import Recipe, RecipeStats, Style
+from brewery.tests import EXAMPLES_DIR
+
+class StyleIndexTestCase(TestCase):
+    """
+    Test matching recipes to styles
+    """
+    def setUp(self):
+        styles.clear_style_index()
+        for f in ("style.xml", "recipes.xml"):
+            bulk_get_or_create(list(parser.iter_beerxml(path=os.path.join(EXAMPLES_DIR, f))))
+    
+    def scan(self, values):
+        """
+        Match values by comparing them with every style.
+        """
+        matches = []
+        for style in Style.objects.order_by("pk"):
+            for d in DIMENSIONS:
+                low, high = getattr(style, "%s_min" % d), getattr(style, "%s_max" % d)
+                if low is not None and values[d] < low or \
+                   high is not None and values[d] > high:
+                    break
+            else:
+                matches.append(style.pk)
+        return matches
+    
+    # Ranges of the random values in test_nearest
+    bounds = {"og": (1.020, 1.120), "fg": (1.000, 1.030), "ibu": (0, 120),
+              "color": (1, 60), "abv": (2, 14)}
+    
+    def test_ranges(self):
+        index = StyleIndex([
+            (1, {"og": (1.040, 1.050), "ibu": (10, 30)}),
+            (2, {"og": (1.050, 1.060), "ibu": (20, None)}),
+            (3, {}),
+        ])
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.match({"og": 1.050, "ibu": 25}), [1, 2, 3])
+        self.assertEqual(index.match({"og": 1.050, "ibu": 35}), [2, 3])
+        self.assertEqual(index.match({"og": 1.0505, "ibu": 20}), [2, 3])
+        self.assertEqual(index.match({"og": 1.039, "ibu": 20}), [3])
+        self.assertEqual(index.match({"og": 1.045}), [1, 3])
+        self.assertEqual(index.match({}), [1, 2, 3])
+        
+        index = StyleIndex([
+            (1, {"og": (1.040, 1.050), "ibu": (10, 30)}),
+            (2, {"og": (1.050, 1.060), "ibu": (20, 40)}),
+        ])
+        self.assertEqual(index.match({"og": 1.070, "ibu": 25}), [])
+        nearest = index.nearest({"og": 1.070, "ibu": 25})
+        self.assertEqual([pk for distance, pk in nearest], [2, 1])
+        self.assertTrue(0 < nearest[0][0] < nearest[1][0])
+        self.assertEqual(index.nearest({"og": 1.045, "ibu": 15}, count=1), [(0.0, 1)])
+    
+    def test_match(self):
+        """
+        The index matches the same styles as comparing
+        the ranges of every style
+        """
+        index = styles.get_style_index()
+        self.assertEqual(len(index), Style.objects.count())
+        matched = 0
+        for stats in RecipeStats.objects.all():
+            values = dict([(d, getattr(stats, d)) for d in DIMENSIONS])
+            matches = index.match(values)
+            self.assertEqual(matches, self.scan(values))
+            nearest = index.nearest(values, count=len(index))
+            self.assertEqual(sorted([pk for distance, pk in nearest if distance == 0]),
+                             matches)
+            matched += bool(matches)
+        self.assertTrue(matched)
+        
+        results = dict(styles.classify(Recipe.objects.all()))
+        self.assertEqual(len(results), Recipe.objects.count())
+        for pk, matches in results.iteritems():
+            stats = RecipeStats.objects.get(pk=pk)
+            self.assertEqual(matches, index.match(dict([(d, getattr(stats, d)) 
+                                                        for d in DIMENSIONS])))
+        for pk, nearest in styles.classify(Recipe.objects.all(), nearest=True, count=2):
+            self.assertEqual(len(nearest), 2)
+    
+    def test_nearest(self):
+        """
+        The nearest styles are the same as when sorting
+        the distances to every style
+        """
+        index = styles.get_style_index()
+        rnd = random.Random(0)
+        rows = [dict([(d, rnd.uniform(*self.bounds[d])) for d in DIMENSIONS])
+                for i in xrange(50)]
+        rows.append({"og": 1.050})
+        numpy = styles.np
+        try:
+            for np in (numpy, None):
+                styles.np = np
+                for values in rows:
+                    expected = sorted([(index.distance(index._values(values), i), pk)
+                                       for i, pk in enumerate(index.pks)])
+                    for count in (1, 3, len(index) + 1):
+                        nearest = index.nearest(values, count)
+                        self.assertEqual([pk for distance, pk in nearest],
+                                         [pk for distance, pk in expected[:count]])
+                        for (distance, pk), (other, pk) in zip(nearest, expected):
+                            self.assertAlmostEqual(distance, other)
+        finally:
+            styles.np = numpy
+    
+    def test_refresh(self):
+        index = styles.get_style_index()
+        self.assertTrue(styles.get_style_index() is index)
+        style = Style.objects.all()[0]
+        style.og_min, style.og_max = 1, 2
+        # The index notices the change by itself, as
+        # it would when another process saved the style
+        style.save()
+        self.assertFalse(styles.get_style_index() is index)
+        self.assertIn(style.pk, styles.get_style_index().match({"og": 1.5}))
+        
+        style.delete()
+        self.assertNotIn(style.pk, styles.get_style_index().match({}))
+        
+        # bulk imports send no signals, but refresh the index too
+        index = styles.get_style_index()
+        bulk_get_or_create(list(parser.iter_beerxml(path=os.path.join(EXAMPLES_DIR, "style.xml"))))
+        self.assertFalse(styles.get_style_index() is index)
+        self.assertEqual(len(styles.get_style_index()), Style.objects.count())
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+from django.test import TestCase
+from django.utils import unittest
+
+from brewery.beerxml import waters
+from brewery.beerxml.formulas import water
+from brewery.models import Recipe, Water
+from brewery.tests import RecipesFixtureMixin
+
+@unittest.skipIf(water.np is None, "numpy is not installed")
+class RecipeWaterTestCase(RecipesFixtureMixin, TestCase):
+    """
+    Test the water profiles of recipes
+    """
+    def test_recipe_waters(self):
+        with self.assertNumQueries(1):
+            profiles = waters.recipe_waters(Recipe.objects.all())
+        self.assertTrue(profiles)
+        for pk, (profile, liters) in profiles.iteritems():
+            used = Recipe.objects.get(pk=pk).waters.all()
+            self.assertAlmostEqual(liters, sum(float(w.amount or 1) for w in used))
+            if len(used) == 1:
+                self.assertAlmostEqual(profile[0], float(used[0].calcium))
+    
+    def test_closest_waters(self):
+        profiles = waters.recipe_waters(Recipe.objects.all())
+        with self.assertNumQueries(3):
+            closest = dict(waters.closest_waters(Recipe.objects.all(), count=2))
+        self.assertEqual(sorted(closest), sorted(profiles))
+        for pk, matches in closest.iteritems():
+            self.assertEqual(len(matches), min(2, Water.objects.count()))
+            self.assertEqual(matches, sorted(matches))
+            # The recipe's own water is in the library
+            if Recipe.objects.get(pk=pk).waters.count() == 1:
+                self.assertAlmostEqual(matches[0][0], 0, places=3)
+        self.assertEqual(list(waters.closest_waters(Recipe.objects.all(),
+                                                    Water.objects.none())), [])